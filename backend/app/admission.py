@@ -0,0 +1,255 @@
+"""
+Admission control: rate limit per client e limiti di concorrenza per classe di route
+
+Ogni richiesta viene assegnata a una classe (pdf, bulk_export, export,
+list, write; le altre non sono limitate) in base a metodo e path:
+
+- rate limit token bucket per (client, classe): ADMISSION_RATE_LIMITS,
+  es. "pdf=0.5:5" = 0.5 richieste/s a regime con burst di 5.
+  Oltre il limite: 429 con Retry-After
+- concorrenza massima per classe nel worker: ADMISSION_CONCURRENCY,
+  es. "pdf=4" = al più 4 PDF in generazione insieme.
+  Oltre il limite: 503 immediato con Retry-After (nessuna coda)
+
+Per le classi in WORK_LIMITED_CLASSES (pdf) il limite di concorrenza non si
+applica alle richieste ma al lavoro effettivo (WorkSlots, usato dall'export
+attorno al render): le richieste che attendono un render identico già in
+corso (single-flight) non occupano uno slot. Questo limite protegge la CPU
+del worker e vale anche per le richieste con token admin.
+
+Il client è l'IP della connessione (o il primo X-Forwarded-For con
+ADMISSION_TRUST_FORWARDED=true, dietro un reverse proxy); le richieste con
+X-Admin-Token valido non sono limitate. I limiti valgono per worker: con N
+worker uvicorn il limite complessivo è circa N volte quello configurato.
+"""
+import asyncio
+import json
+import math
+import os
+import re
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional, Pattern, Tuple
+
+from fastapi import HTTPException
+
+from app.api.deps import is_admin_token
+from app.metrics import ADMISSION_IN_PROGRESS, ADMISSION_REJECTED
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_CONTROL_ENABLED", "true").lower() in ("1", "true", "yes")
+ADMISSION_TRUST_FORWARDED = os.getenv("ADMISSION_TRUST_FORWARDED", "false").lower() in ("1", "true", "yes")
+ADMISSION_RATE_LIMITS = os.getenv(
+    "ADMISSION_RATE_LIMITS", "pdf=0.5:5,bulk_export=0.1:3,export=5:30,list=5:30,write=5:30",
+)
+ADMISSION_CONCURRENCY = os.getenv("ADMISSION_CONCURRENCY", "pdf=4,bulk_export=2")
+# Oltre questo numero di bucket si eliminano quelli inattivi (pieni)
+ADMISSION_MAX_BUCKETS = int(os.getenv("ADMISSION_MAX_BUCKETS", "10000"))
+
+# Classi limitate sul lavoro effettivo (WorkSlots) invece che dal middleware
+WORK_LIMITED_CLASSES = ("pdf",)
+
+# (classe, metodi, pattern del path): vince la prima che corrisponde
+ROUTE_CLASSES: List[Tuple[str, Tuple[str, ...], Pattern]] = [
+    ("pdf", ("GET",), re.compile(r"^/api/export/[^/]+/pdf$")),
+    ("bulk_export", ("GET",), re.compile(r"^/api/export/(stix|table)$")),
+    ("bulk_export", ("POST",), re.compile(r"^/api/incidents/import/bulk$")),
+    ("export", ("GET", "POST"), re.compile(r"^/api/export/")),
+    ("list", ("GET",), re.compile(r"^/api/incidents/(stats|search/text|[^/]+/similar)?$")),
+    ("list", ("POST",), re.compile(r"^/api/incidents/similar$")),
+    ("write", ("POST", "PUT", "DELETE"), re.compile(r"^/api/incidents/")),
+]
+
+
+def parse_limits(spec: str) -> Dict[str, Tuple[float, float]]:
+    """'pdf=0.5:5,list=5:30' -> {'pdf': (0.5, 5.0), 'list': (5.0, 30.0)}"""
+    limits = {}
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        name, value = item.split("=", 1)
+        rate, _, burst = value.partition(":")
+        limits[name.strip()] = (float(rate), float(burst or rate))
+    return limits
+
+
+def parse_concurrency(spec: str) -> Dict[str, int]:
+    """'pdf=4,bulk_export=2' -> {'pdf': 4, 'bulk_export': 2}"""
+    return {
+        name.strip(): int(value)
+        for name, value in (item.split("=", 1) for item in spec.split(",") if "=" in item)
+    }
+
+
+def classify(method: str, path: str) -> Optional[str]:
+    """Classe di admission della richiesta (None = non limitata)"""
+    for name, methods, pattern in ROUTE_CLASSES:
+        if method in methods and pattern.match(path):
+            return name
+    return None
+
+
+class TokenBuckets:
+    """Token bucket per chiave (client, classe), con ricarica calcolata a ogni richiesta"""
+
+    def __init__(self, limits: Dict[str, Tuple[float, float]], max_buckets: int = ADMISSION_MAX_BUCKETS):
+        self.limits = limits
+        self.max_buckets = max_buckets
+        # chiave -> [token disponibili, istante dell'ultimo aggiornamento]
+        self._buckets: Dict[Tuple[str, str], List[float]] = {}
+
+    def acquire(self, client: str, route_class: str, now: Optional[float] = None) -> float:
+        """
+        Consuma un token.
+
+        Returns:
+            0 se la richiesta è ammessa, altrimenti i secondi di attesa per il prossimo token
+        """
+        limit = self.limits.get(route_class)
+        if limit is None:
+            return 0.0
+        rate, burst = limit
+        now = time.monotonic() if now is None else now
+
+        key = (client, route_class)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self.max_buckets:
+                self._evict(now)
+            bucket = self._buckets[key] = [burst, now]
+        else:
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return 0.0
+        return (1 - bucket[0]) / rate if rate > 0 else float("inf")
+
+    def _evict(self, now: float) -> None:
+        """Rimuove i bucket che a quest'ora sarebbero di nuovo pieni (client inattivi)"""
+        for key, (tokens, updated) in list(self._buckets.items()):
+            rate, burst = self.limits[key[1]]
+            if tokens + (now - updated) * rate >= burst:
+                del self._buckets[key]
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+class WorkSlots:
+    """
+    Limite di concorrenza senza coda attorno a un'elaborazione costosa.
+
+    Example:
+        >>> async with pdf_slots.hold():
+        ...     pdf = await asyncio.to_thread(render, incident)
+    """
+
+    def __init__(self, route_class: str, limit: Optional[int]):
+        self.route_class = route_class
+        self._semaphore = asyncio.Semaphore(limit) if limit else None
+
+    @asynccontextmanager
+    async def hold(self) -> AsyncIterator[None]:
+        """Occupa uno slot per la durata del blocco; 503 con Retry-After se sono tutti occupati"""
+        if self._semaphore is None:
+            yield
+            return
+        if self._semaphore.locked():
+            ADMISSION_REJECTED.inc(self.route_class, "concurrency")
+            raise HTTPException(
+                status_code=503, detail="Servizio occupato: riprovare tra poco", headers={"Retry-After": "1"},
+            )
+        async with self._semaphore:
+            ADMISSION_IN_PROGRESS.inc(self.route_class)
+            try:
+                yield
+            finally:
+                ADMISSION_IN_PROGRESS.dec(self.route_class)
+
+
+def work_slots(route_class: str, concurrency: Optional[str] = None) -> WorkSlots:
+    """Slot di lavoro di una classe secondo ADMISSION_CONCURRENCY (illimitati se l'admission control è spento)"""
+    if not ADMISSION_ENABLED and concurrency is None:
+        return WorkSlots(route_class, None)
+    limits = parse_concurrency(ADMISSION_CONCURRENCY if concurrency is None else concurrency)
+    return WorkSlots(route_class, limits.get(route_class))
+
+
+def _client_id(scope) -> str:
+    if ADMISSION_TRUST_FORWARDED:
+        for key, value in scope.get("headers", []):
+            if key == b"x-forwarded-for":
+                return value.decode("latin-1").split(",")[0].strip()
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+def _is_admin(scope) -> bool:
+    for key, value in scope.get("headers", []):
+        if key == b"x-admin-token":
+            return is_admin_token(value.decode("latin-1"))
+    return False
+
+
+async def _reject(send, status: int, detail: str, retry_after: float) -> None:
+    body = json.dumps({"detail": detail}, ensure_ascii=False).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class AdmissionMiddleware:
+    """Middleware ASGI che ammette o rifiuta le richieste prima del routing"""
+
+    def __init__(self, app, rate_limits: Optional[str] = None, concurrency: Optional[str] = None):
+        self.app = app
+        self.buckets = TokenBuckets(parse_limits(ADMISSION_RATE_LIMITS if rate_limits is None else rate_limits))
+        self.concurrency = {
+            name: cap
+            for name, cap in parse_concurrency(ADMISSION_CONCURRENCY if concurrency is None else concurrency).items()
+            if name not in WORK_LIMITED_CLASSES
+        }
+        self.in_flight: Dict[str, int] = {name: 0 for name in self.concurrency}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        route_class = classify(scope["method"], scope["path"])
+        if route_class is None or _is_admin(scope):
+            await self.app(scope, receive, send)
+            return
+
+        wait = self.buckets.acquire(_client_id(scope), route_class)
+        if wait:
+            ADMISSION_REJECTED.inc(route_class, "rate_limit")
+            await _reject(send, 429, "Troppe richieste: riprovare più tardi", wait)
+            return
+
+        cap = self.concurrency.get(route_class)
+        if cap is None:
+            await self.app(scope, receive, send)
+            return
+
+        if self.in_flight[route_class] >= cap:
+            ADMISSION_REJECTED.inc(route_class, "concurrency")
+            await _reject(send, 503, "Servizio occupato: riprovare tra poco", 1)
+            return
+
+        # Lo slot resta occupato fino alla fine della risposta (anche in streaming)
+        self.in_flight[route_class] += 1
+        ADMISSION_IN_PROGRESS.inc(route_class)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.in_flight[route_class] -= 1
+            ADMISSION_IN_PROGRESS.dec(route_class)
@@ -0,0 +1,30 @@
+from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi.responses import FileResponse
+from app.api.deps import require_admin
+from app.profiling import list_profiles, get_profile, get_profile_file
+
+router = APIRouter(dependencies=[Depends(require_admin)])
+
+
+@router.get("/profiles")
+async def get_profiles():
+    """Lista dei profili di richiesta salvati (dal più recente)"""
+    return list_profiles()
+
+
+@router.get("/profiles/{profile_id}")
+async def get_profile_detail(profile_id: str, top: int = Query(30, ge=1, le=500)):
+    """Dettaglio di un profilo: span applicativi e funzioni più costose"""
+    profile = get_profile(profile_id, top=top)
+    if not profile:
+        raise HTTPException(status_code=404, detail="Profilo non trovato")
+    return profile
+
+
+@router.get("/profiles/{profile_id}/download")
+async def download_profile(profile_id: str):
+    """Scarica il profilo CPU in formato pstats (.prof)"""
+    path = get_profile_file(profile_id)
+    if not path:
+        raise HTTPException(status_code=404, detail="Profilo CPU non trovato")
+    return FileResponse(path, media_type="application/octet-stream", filename=f"{profile_id}.prof")
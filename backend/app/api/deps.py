@@ -0,0 +1,31 @@
+"""
+Dipendenze comuni ai router
+"""
+import os
+import secrets
+from typing import Optional
+
+from fastapi import Header, HTTPException
+
+# Token per gli endpoint amministrativi: se non configurato gli endpoint sono disabilitati
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+
+def is_admin_token(token: Optional[str]) -> bool:
+    """Verifica (a tempo costante) un token amministrativo"""
+    return bool(ADMIN_TOKEN and token and secrets.compare_digest(token, ADMIN_TOKEN))
+
+
+async def require_admin(x_admin_token: Optional[str] = Header(None)) -> None:
+    """Richiede l'header X-Admin-Token valido"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Endpoint amministrativi disabilitati (ADMIN_TOKEN non configurato)")
+    if not is_admin_token(x_admin_token):
+        raise HTTPException(status_code=401, detail="Token amministrativo non valido")
+
+
+async def get_author(x_ice_user: Optional[str] = Header(None, max_length=200)) -> Optional[str]:
+    """Autore della modifica per lo storico revisioni (header X-ICE-User, opzionale)"""
+    if x_ice_user is None:
+        return None
+    return x_ice_user.strip() or None
@@ -1,70 +1,198 @@
-from fastapi import APIRouter, HTTPException, Response
-from fastapi.responses import JSONResponse
+import asyncio
+import os
+import time
+from datetime import datetime, timezone
+from typing import Callable, List, Optional, Tuple
+from fastapi import APIRouter, HTTPException, Query, Response
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.encoders import jsonable_encoder
+from app.admission import work_slots
 from app.services.taxonomy_service import taxonomy_service
-from app.services.report_service import generate_pdf_report
 from app.services.misp_service import create_misp_event
-from app.db import get_collection
+from app.services.stix_service import build_stix_bundle, stream_stix_bundle
+from app.services.table_export_service import stream_incident_table, table_media_type
+from app.services.archive_service import ARCHIVE_COLLECTION, ArchiveService
+from app.services.incident_store import incident_store
+from app.services.revision_service import REVISIONS_COLLECTION, RevisionService
+from app.db import get_collection, get_read_collection
+from app.metrics import EXPORT_CACHE_REQUESTS, EXPORT_COALESCED, EXPORT_PAYLOAD_BYTES, PDF_RENDER_LATENCY
+from app.profiling import span
 from app.models.incident import Incident
+from app.utils.cache import TTLCache
+from app.utils.singleflight import SingleFlight
+from app.utils.serialization import model_from_db
 from app.utils.taxonomy_helpers import extract_all_codes_from_taxonomy_dict
 
 router = APIRouter()
 
 COLLECTION_NAME = "incidents"
 
+# Formati di export abilitati in questo deployment (es. "json,misp" per pod solo API)
+EXPORT_FORMATS = {
+    fmt.strip().lower()
+    for fmt in os.getenv("EXPORT_FORMATS", "json,pdf,misp,stix,table").split(",")
+    if fmt.strip()
+}
+
+# Export storici (revision/as_of): il contenuto di una revisione non cambia più,
+# quindi restano in cache senza scadenza (solo LRU) finché non cambia la tassonomia
+HISTORICAL_EXPORT_CACHE_SIZE = int(os.getenv("HISTORICAL_EXPORT_CACHE_SIZE", "256"))
+
+_historical_exports = TTLCache(ttl=None, maxsize=HISTORICAL_EXPORT_CACHE_SIZE)
+
+# Richieste concorrenti per lo stesso export (incidente, versione, formato)
+# condividono un'unica generazione
+_export_flights = SingleFlight()
+
+# Formati il cui rendering è abbastanza pesante da spostarlo fuori dall'event loop
+_THREADED_FORMATS = {"pdf"}
+
+# Render contemporanei per formato (ADMISSION_CONCURRENCY), contati solo sul
+# leader del single-flight: chi attende un render in corso non occupa slot
+_render_slots = {fmt: work_slots(fmt) for fmt in _THREADED_FORMATS}
+
+
+def _require_format(fmt: str) -> None:
+    """Verifica che il formato di export sia abilitato"""
+    if fmt not in EXPORT_FORMATS:
+        raise HTTPException(status_code=404, detail=f"Export {fmt.upper()} non abilitato su questa istanza")
+
+
+def _pdf_renderer():
+    """
+    Ritorna il generatore PDF importandolo al primo utilizzo.
+
+    ReportLab pesa sull'avvio: i worker che servono solo CRUD non lo caricano mai.
+    """
+    from app.services.report_service import generate_pdf_report
+    return generate_pdf_report
+
+
+def preload_renderers() -> None:
+    """Importa subito i renderer abilitati (evita la latenza sul primo export)"""
+    if "pdf" in EXPORT_FORMATS:
+        _pdf_renderer()
+
 
 def _doc_to_incident(doc: dict) -> Incident:
-    """Converte un documento MongoDB in modello Incident"""
-    if "_id" in doc:
-        doc["id"] = doc.pop("_id")
-    return Incident(**doc)
+    """Converte un documento MongoDB in modello Incident (senza rivalidarlo)"""
+    return model_from_db(Incident, doc)
 
 
 async def _get_incident(incident_id: str) -> Incident:
     """Helper per ottenere un incidente"""
+    # Primario: il documento letto popola la cache condivisa degli incidenti
     collection = get_collection(COLLECTION_NAME)
-    incident = await collection.find_one({"_id": incident_id})
+    with span("mongo"):
+        incident = await incident_store.get(collection, incident_id)
+        if not incident:
+            # Incidente archiviato: decompresso su richiesta
+            incident = await ArchiveService(collection, get_read_collection(ARCHIVE_COLLECTION)).get(incident_id)
     if not incident:
         raise HTTPException(status_code=404, detail="Incidente non trovato")
     return _doc_to_incident(incident)
 
 
+async def _get_historical_incident(
+    incident_id: str,
+    revision: Optional[int],
+    as_of: Optional[datetime],
+) -> Tuple[Incident, int]:
+    """
+    Ricostruisce l'incidente a una revisione o a un istante dallo storico.
+
+    Returns:
+        (incidente, numero di revisione effettivo)
+    """
+    revisions = RevisionService(get_collection(REVISIONS_COLLECTION))
+
+    if as_of is not None:
+        # I datetime salvati sono UTC naive
+        if as_of.tzinfo is not None:
+            as_of = as_of.astimezone(timezone.utc).replace(tzinfo=None)
+        with span("mongo"):
+            record = await revisions.resolve_revision(incident_id, as_of)
+        if record is None:
+            if not await revisions.has_history(incident_id):
+                # Incidente precedente allo storico e mai modificato: vale lo stato attuale
+                current = await incident_store.get(get_collection(COLLECTION_NAME), incident_id)
+                if current and current["updated_at"] <= as_of:
+                    return _doc_to_incident(current), current.get("revision") or 0
+            raise HTTPException(status_code=404, detail="Incidente non presente alla data indicata")
+        if record["operation"] == "delete":
+            raise HTTPException(status_code=404, detail="Incidente già eliminato alla data indicata")
+        revision = record["revision"]
+
+    with span("mongo"):
+        doc = await revisions.reconstruct(incident_id, revision)
+    if doc is None:
+        raise HTTPException(status_code=404, detail="Revisione non trovata")
+    return _doc_to_incident(doc), revision
+
+
+async def _render_export(
+    fmt: str,
+    incident_id: str,
+    revision: Optional[int],
+    as_of: Optional[datetime],
+    render: Callable[[Incident], bytes],
+) -> Tuple[bytes, Optional[int]]:
+    """
+    Produce il payload di export, dello stato attuale o storico.
+
+    Gli export storici sono messi in cache per (formato, incidente, revisione,
+    versione tassonomia): le label dipendono dalla tassonomia caricata.
+
+    Returns:
+        (payload, revisione esportata o None per lo stato attuale)
+    """
+    if revision is not None and as_of is not None:
+        raise HTTPException(status_code=400, detail="Specificare revision oppure as_of, non entrambi")
+
+    if revision is None and as_of is None:
+        incident = await _get_incident(incident_id)
+        version = incident.revision if incident.revision is not None else incident.updated_at.isoformat()
+        key = (fmt, incident_id, version, taxonomy_service.version)
+        return await _coalesced_render(fmt, key, render, incident), None
+
+    incident, resolved = await _get_historical_incident(incident_id, revision, as_of)
+    key = (fmt, incident_id, resolved, taxonomy_service.version)
+    body = _historical_exports.get(key)
+    if body is not None:
+        EXPORT_CACHE_REQUESTS.inc(fmt, "hit")
+        return body, resolved
+
+    EXPORT_CACHE_REQUESTS.inc(fmt, "miss")
+    body = await _coalesced_render(fmt, key, render, incident)
+    _historical_exports.set(key, body)
+    return body, resolved
+
+
+async def _coalesced_render(fmt: str, key: tuple, render: Callable[[Incident], bytes], incident: Incident) -> bytes:
+    """Esegue render una sola volta per key tra le richieste concorrenti"""
+    async def run() -> bytes:
+        if fmt in _THREADED_FORMATS:
+            async with _render_slots[fmt].hold():
+                return await asyncio.to_thread(render, incident)
+        return render(incident)
+
+    body, shared = await _export_flights.do(key, run)
+    if shared:
+        EXPORT_COALESCED.inc(fmt)
+    return body
+
+
+def _export_headers(incident_id: str, revision: Optional[int], extension: str) -> dict:
+    suffix = f"_rev{revision}" if revision is not None else ""
+    headers = {"Content-Disposition": f'attachment; filename="incident_{incident_id}{suffix}.{extension}"'}
+    if revision is not None:
+        headers["X-ICE-Revision"] = str(revision)
+    return headers
+
+
 def _build_block_lookup():
-    """Crea lookup table per i codici tassonomia"""
-    taxonomy = taxonomy_service.get_taxonomy()
-    lookup = {}
-    for mc in taxonomy.get("taxonomy", {}).get("macrocategories", []):
-        mc_code = mc.get("code")
-        mc_name = mc.get("name", mc_code)
-        for predicate in mc.get("predicates", []):
-            pred_code = predicate.get("code")
-            pred_name = predicate.get("name", pred_code)
-            for value in predicate.get("values", []):
-                lookup[value["code"]] = {
-                    "label": value.get("label", ""),
-                    "description": value.get("description", ""),
-                    "macro": mc_code,
-                    "macro_name": mc_name,
-                    "predicate": pred_code,
-                    "predicate_name": pred_name,
-                    "subpredicate": None,
-                    "subpredicate_name": None,
-                }
-            for subpred in predicate.get("subpredicates", []):
-                sub_code = subpred.get("code")
-                sub_name = subpred.get("name", sub_code)
-                for value in subpred.get("values", []):
-                    lookup[value["code"]] = {
-                        "label": value.get("label", ""),
-                        "description": value.get("description", ""),
-                        "macro": mc_code,
-                        "macro_name": mc_name,
-                        "predicate": pred_code,
-                        "predicate_name": pred_name,
-                        "subpredicate": sub_code,
-                        "subpredicate_name": sub_name,
-                    }
-    return lookup
+    """Ritorna la lookup table per i codici tassonomia"""
+    return taxonomy_service.get_code_index()
 
 
 def _collect_incident_codes(incident: Incident):
@@ -87,12 +215,12 @@ def _collect_incident_codes(incident: Incident):
     return collected
 
 
-@router.get("/{incident_id}/json")
-async def export_incident_json(incident_id: str):
-    """Esporta incidente in formato JSON"""
-    incident = await _get_incident(incident_id)
+_REVISION_QUERY = Query(None, ge=0, description="Esporta l'incidente com'era a questa revisione")
+_AS_OF_QUERY = Query(None, description="Esporta l'incidente com'era a questo istante (ISO 8601)")
+
 
-    # Arricchisci con informazioni della tassonomia
+def _render_json(incident: Incident) -> bytes:
+    """Serializza l'incidente arricchito con i dettagli dei blocchi tassonomia"""
     enriched = {
         **incident.model_dump(),
         "taxonomy_version": "2.0",
@@ -100,62 +228,166 @@ async def export_incident_json(incident_id: str):
     }
 
     # Aggiungi dettagli completi dei blocchi selezionati
-    lookup = _build_block_lookup()
-    blocks = []
-    for item in _collect_incident_codes(incident):
-        info = lookup.get(item["code"], {})
-        blocks.append({
-            "code": item["code"],
-            "taxonomy_key": item["taxonomy_key"],
-            "label": info.get("label"),
-            "description": info.get("description"),
-            "macro": info.get("macro"),
-            "macro_name": info.get("macro_name"),
-            "predicate": info.get("predicate"),
-            "predicate_name": info.get("predicate_name"),
-            "subpredicate": info.get("subpredicate"),
-            "subpredicate_name": info.get("subpredicate_name"),
-            "detail": (incident.code_details or {}).get(item["code"]),
-        })
+    with span("taxonomy"):
+        lookup = _build_block_lookup()
+        blocks = []
+        for item in _collect_incident_codes(incident):
+            info = lookup.get(item["code"], {})
+            blocks.append({
+                "code": item["code"],
+                "taxonomy_key": item["taxonomy_key"],
+                "label": info.get("label"),
+                "description": info.get("description"),
+                "macro": info.get("macro"),
+                "macro_name": info.get("macro_name"),
+                "predicate": info.get("predicate"),
+                "predicate_name": info.get("predicate_name"),
+                "subpredicate": info.get("subpredicate"),
+                "subpredicate_name": info.get("subpredicate_name"),
+                "detail": (incident.code_details or {}).get(item["code"]),
+            })
     enriched["blocks"] = blocks
 
-    return JSONResponse(
-        content=jsonable_encoder(enriched),
-        headers={"Content-Disposition": f'attachment; filename="incident_{incident_id}.json"'}
+    with span("serialization"):
+        return JSONResponse(content=jsonable_encoder(enriched)).body
+
+
+def _render_pdf(incident: Incident) -> bytes:
+    generate_pdf_report = _pdf_renderer()
+    start = time.perf_counter()
+    with span("reportlab"):
+        pdf_bytes = generate_pdf_report(incident.model_dump(), taxonomy_service)
+    PDF_RENDER_LATENCY.observe(time.perf_counter() - start)
+    return pdf_bytes
+
+
+def _render_misp(incident: Incident) -> bytes:
+    with span("serialization"):
+        misp_event = create_misp_event(incident.model_dump(), taxonomy_service)
+        return JSONResponse(content=misp_event).body
+
+
+def _render_stix(incident: Incident) -> bytes:
+    with span("serialization"):
+        bundle = build_stix_bundle(incident.model_dump(), taxonomy_service)
+        return JSONResponse(content=jsonable_encoder(bundle)).body
+
+
+@router.get("/stix")
+async def export_incidents_stix(
+    code: Optional[List[str]] = Query(None, description="Solo gli incidenti che contengono tutti i codici indicati"),
+    updated_since: Optional[datetime] = Query(None, description="Solo gli incidenti modificati da questo istante"),
+):
+    """Esporta più incidenti in un unico bundle STIX 2.1 (in streaming)"""
+    _require_format("stix")
+    query = {}
+    if code:
+        query["all_codes"] = {"$all": code}
+    if updated_since is not None:
+        if updated_since.tzinfo is not None:
+            updated_since = updated_since.astimezone(timezone.utc).replace(tzinfo=None)
+        query["updated_at"] = {"$gte": updated_since}
+
+    cursor = get_read_collection(COLLECTION_NAME).find(query).sort("created_at", -1).batch_size(200)
+    return StreamingResponse(
+        stream_stix_bundle(cursor, taxonomy_service),
+        media_type="application/stix+json;version=2.1",
+        headers={"Content-Disposition": 'attachment; filename="incidents_stix.json"'},
     )
 
 
-@router.get("/{incident_id}/pdf")
-async def export_incident_pdf(incident_id: str):
-    """Esporta incidente in formato PDF"""
-    incident = await _get_incident(incident_id)
+@router.get("/table")
+async def export_incidents_table(
+    layout: str = Query("long", pattern="^(long|wide)$", description="long: una riga per incidente/codice; wide: una colonna 0/1 per codice"),
+    format: str = Query("csv", pattern="^(csv|parquet)$", description="csv oppure parquet (richiede pyarrow)"),
+    code: Optional[List[str]] = Query(None, description="Solo gli incidenti che contengono tutti i codici indicati"),
+):
+    """Esporta gli incidenti in forma tabellare per analisi (pandas, BI), in streaming"""
+    _require_format("table")
+    try:
+        body = stream_incident_table(
+            get_read_collection(COLLECTION_NAME), layout, format, taxonomy_service.get_code_index(), code,
+        )
+    except RuntimeError as exc:
+        raise HTTPException(status_code=501, detail=str(exc))
+
+    media_type, extension = table_media_type(format)
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="incidents_{layout}.{extension}"'},
+    )
+
+
+@router.get("/{incident_id}/json")
+async def export_incident_json(
+    incident_id: str,
+    revision: Optional[int] = _REVISION_QUERY,
+    as_of: Optional[datetime] = _AS_OF_QUERY,
+):
+    """Esporta incidente in formato JSON (attuale o a una revisione/data passata)"""
+    _require_format("json")
+    body, exported = await _render_export("json", incident_id, revision, as_of, _render_json)
+    EXPORT_PAYLOAD_BYTES.observe(len(body), "json")
+    return Response(
+        content=body,
+        media_type="application/json",
+        headers=_export_headers(incident_id, exported, "json"),
+    )
 
-    # Genera PDF
-    pdf_bytes = generate_pdf_report(incident.model_dump(), taxonomy_service)
 
+@router.get("/{incident_id}/pdf")
+async def export_incident_pdf(
+    incident_id: str,
+    revision: Optional[int] = _REVISION_QUERY,
+    as_of: Optional[datetime] = _AS_OF_QUERY,
+):
+    """Esporta incidente in formato PDF (attuale o a una revisione/data passata)"""
+    _require_format("pdf")
+    body, exported = await _render_export("pdf", incident_id, revision, as_of, _render_pdf)
+    EXPORT_PAYLOAD_BYTES.observe(len(body), "pdf")
     return Response(
-        content=pdf_bytes,
+        content=body,
         media_type="application/pdf",
-        headers={
-            "Content-Disposition": f"attachment; filename=incident_{incident_id}.pdf"
-        }
+        headers=_export_headers(incident_id, exported, "pdf"),
     )
 
 
 @router.get("/{incident_id}/misp")
-async def export_incident_misp(incident_id: str):
-    """Esporta incidente in formato MISP Event"""
-    incident = await _get_incident(incident_id)
+async def export_incident_misp(
+    incident_id: str,
+    revision: Optional[int] = _REVISION_QUERY,
+    as_of: Optional[datetime] = _AS_OF_QUERY,
+):
+    """Esporta incidente in formato MISP Event (attuale o a una revisione/data passata)"""
+    _require_format("misp")
+    body, exported = await _render_export("misp", incident_id, revision, as_of, _render_misp)
+    EXPORT_PAYLOAD_BYTES.observe(len(body), "misp")
+    headers = {"X-ICE-Revision": str(exported)} if exported is not None else None
+    return Response(content=body, media_type="application/json", headers=headers)
 
-    # Crea evento MISP
-    misp_event = create_misp_event(incident.model_dump(), taxonomy_service)
 
-    return JSONResponse(content=misp_event)
+@router.get("/{incident_id}/stix")
+async def export_incident_stix(
+    incident_id: str,
+    revision: Optional[int] = _REVISION_QUERY,
+    as_of: Optional[datetime] = _AS_OF_QUERY,
+):
+    """Esporta incidente come bundle STIX 2.1 (attuale o a una revisione/data passata)"""
+    _require_format("stix")
+    body, exported = await _render_export("stix", incident_id, revision, as_of, _render_stix)
+    EXPORT_PAYLOAD_BYTES.observe(len(body), "stix")
+    return Response(
+        content=body,
+        media_type="application/stix+json;version=2.1",
+        headers=_export_headers(incident_id, exported, "stix.json"),
+    )
 
 
 @router.post("/{incident_id}/misp/push")
 async def push_to_misp(incident_id: str):
     """Push dell'incidente su istanza MISP (richiede configurazione)"""
+    _require_format("misp")
     await _get_incident(incident_id)
 
     # TODO: Implementare push verso MISP reale
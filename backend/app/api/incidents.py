@@ -1,55 +1,259 @@
-from fastapi import APIRouter, HTTPException, Body
-from typing import List
+from fastapi import APIRouter, HTTPException, Body, Depends, Header, Query
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from typing import Any, Dict, List, Optional
 import uuid
 from datetime import datetime
-from app.models.incident import Incident, IncidentCreate, IncidentUpdate, IncidentSummary
-from app.db import get_collection
+from app.models.incident import (
+    Incident, IncidentCreate, IncidentUpdate, IncidentSummary, IncidentStats, TextSearchResult,
+    SimilarityQuery, SimilarIncident, IncidentRevision, BulkImportResult,
+)
+from app.api.deps import get_author
+from app.db import get_collection, get_read_collection
+from app.profiling import span
+from app.services import invalidation_bus
+from app.services.archive_service import ARCHIVE_COLLECTION, ArchiveService
+from app.services.idempotency_service import IDEMPOTENCY_COLLECTION, IdempotencyStore, payload_fingerprint
+from app.services.incident_store import incident_store
+from app.services.revision_service import REVISIONS_COLLECTION, RevisionService
+from app.services.stats_service import compute_incident_stats, invalidate_stats_cache
+from app.services.search_service import search_incidents_text
+from app.services.similarity_service import (
+    SimilarityMetric, get_similarity_index, index_incident, unindex_incident
+)
+from app.utils.serialization import model_from_db, trusted_json_response
 from app.utils.taxonomy_helpers import count_codes_by_category, extract_all_codes_from_taxonomy_dict
+from app.utils.incident_helpers import build_denormalized_fields, compute_content_hash
 
 router = APIRouter()
 
 COLLECTION_NAME = "incidents"
 
 
+def _revisions() -> RevisionService:
+    return RevisionService(get_collection(REVISIONS_COLLECTION))
+
+
+def _archive() -> ArchiveService:
+    return ArchiveService(get_collection(COLLECTION_NAME), get_collection(ARCHIVE_COLLECTION))
+
+
 def _doc_to_incident(doc: dict) -> Incident:
-    """Converte un documento MongoDB in modello Incident"""
-    if "_id" in doc:
-        doc["id"] = doc.pop("_id")
-    return Incident(**doc)
+    """Converte un documento MongoDB in modello Incident (senza rivalidarlo)"""
+    return model_from_db(Incident, doc)
 
 
-@router.post("/", response_model=Incident)
-async def create_incident(incident: IncidentCreate):
-    """Crea un nuovo incidente"""
+async def _after_write(incident_id: str, doc: Optional[dict]) -> None:
+    """
+    Operazioni comuni dopo ogni scrittura su un incidente.
+
+    Args:
+        incident_id: ID dell'incidente scritto
+        doc: Documento aggiornato, None se l'incidente è stato eliminato
+    """
+    invalidate_stats_cache()
+    if doc is None:
+        unindex_incident(incident_id)
+        await incident_store.invalidate(incident_id, deleted=True)
+    else:
+        index_incident(doc)
+        await incident_store.put(doc)
+    await invalidation_bus.publish("incident", incident_id, deleted=doc is None)
+
+
+async def after_archive(incident_ids: List[str]) -> None:
+    """
+    Invalidazioni dopo l'archiviazione: gli incidenti escono dall'insieme caldo
+    (statistiche, cache) ma restano nell'indice di similarità
+    """
+    invalidate_stats_cache()
+    for incident_id in incident_ids:
+        await incident_store.invalidate(incident_id, deleted=True)
+        await invalidation_bus.publish("incident", incident_id, deleted=True, archived=True)
+
+
+async def apply_remote_write(event: dict) -> None:
+    """
+    Applica le invalidazioni per una scrittura avvenuta su un altro worker
+    (handler del bus di invalidazione).
+    """
+    incident_id = event["key"]
+    deleted = event.get("data", {}).get("deleted", False)
+    invalidate_stats_cache()
+    await incident_store.invalidate_local(incident_id, deleted=deleted)
+    if event.get("data", {}).get("archived"):
+        # Archiviato: i codici non cambiano, resta nell'indice di similarità
+        return
+
+    doc = None
+    if not deleted:
+        # Legge dal primario: l'indice di similarità deve riflettere l'ultima scrittura
+        doc = await get_collection(COLLECTION_NAME).find_one(
+            {"_id": incident_id}, {"all_codes": 1, "taxonomy_codes": 1}
+        )
+    if doc is None:
+        unindex_incident(incident_id)
+    else:
+        index_incident(doc)
+
+
+async def _similar_incidents(codes: List[str], k: int, metric: SimilarityMetric, exclude_id: Optional[str] = None) -> List[dict]:
+    """Cerca i k incidenti più simili e li arricchisce con titolo e data"""
+    matches = get_similarity_index().query(codes, k=k, metric=metric, exclude_id=exclude_id)
+    if not matches:
+        return []
+
+    ids = [m["id"] for m in matches]
+    projection = {"title": 1, "created_at": 1}
+    docs = {}
+    # Gli incidenti archiviati conservano in chiaro titolo e data
+    for name in (ARCHIVE_COLLECTION, COLLECTION_NAME):
+        async for doc in get_collection(name).find({"_id": {"$in": ids}}, projection):
+            docs[doc["_id"]] = doc
+
+    return [
+        {**m, "title": docs[m["id"]]["title"], "created_at": docs[m["id"]]["created_at"]}
+        for m in matches
+        if m["id"] in docs
+    ]
+
+
+async def _insert_incident(data: Dict[str, Any], author: Optional[str], incident_id: Optional[str] = None) -> dict:
+    """
+    Inserisce un nuovo incidente (creazione e import) e ritorna il documento salvato.
+
+    Raises:
+        DuplicateKeyError: import_hash già presente (import concorrente dello stesso contenuto)
+    """
     collection = get_collection(COLLECTION_NAME)
 
-    incident_id = str(uuid.uuid4())
+    incident_id = incident_id or str(uuid.uuid4())
     now = datetime.utcnow()
 
-    doc = incident.model_dump()
+    doc = dict(data)
+    doc.update(build_denormalized_fields(doc))
     doc["_id"] = incident_id
     doc["created_at"] = now
     doc["updated_at"] = now
+    doc["revision"] = 1
 
     await collection.insert_one(doc)
 
     inserted = await collection.find_one({"_id": incident_id})
-    return _doc_to_incident(inserted)
+    await _revisions().record_create(inserted, author)
+    await _after_write(incident_id, inserted)
+    return inserted
+
+
+async def _find_created(incident_id: str) -> Optional[dict]:
+    """Incidente creato con una Idempotency-Key (anche se poi archiviato)"""
+    doc = await get_collection(COLLECTION_NAME).find_one({"_id": incident_id})
+    if doc is None:
+        # Creato e poi archiviato: il replay resta identico
+        doc = await _archive().get(incident_id)
+    return doc
+
+
+def _replayed(doc: dict):
+    response = trusted_json_response(_doc_to_incident(doc))
+    response.headers["Idempotent-Replayed"] = "true"
+    return response
+
+
+@router.post("/", response_model=Incident)
+async def create_incident(
+    incident: IncidentCreate,
+    author: Optional[str] = Depends(get_author),
+    idempotency_key: Optional[str] = Header(None, max_length=200),
+):
+    """
+    Crea un nuovo incidente.
+
+    Con l'header Idempotency-Key un retry della stessa richiesta restituisce
+    l'incidente già creato (header Idempotent-Replayed) invece di duplicarlo.
+    """
+    data = incident.model_dump()
+    if not idempotency_key:
+        return trusted_json_response(_doc_to_incident(await _insert_incident(data, author)))
+
+    keys = IdempotencyStore(get_collection(IDEMPOTENCY_COLLECTION))
+    fingerprint = payload_fingerprint(data)
+    incident_id = str(uuid.uuid4())
+    existing = await keys.reserve(idempotency_key, fingerprint, incident_id)
+
+    if existing is not None:
+        if existing["fingerprint"] != fingerprint:
+            raise HTTPException(status_code=422, detail="Idempotency-Key già usata per una richiesta diversa")
+        incident_id = existing["incident_id"]
+        doc = await _find_created(incident_id)
+        if doc is not None:
+            return _replayed(doc)
+        if await _revisions().has_history(incident_id):
+            raise HTTPException(status_code=410, detail="L'incidente creato con questa Idempotency-Key è stato eliminato")
+        if not await keys.take_over(existing):
+            raise HTTPException(
+                status_code=409, detail="Richiesta con la stessa Idempotency-Key ancora in corso",
+                headers={"Retry-After": "1"},
+            )
+        # Lease scaduta senza incidente (richiesta interrotta): si riprende con lo stesso ID
+
+    try:
+        inserted = await _insert_incident(data, author, incident_id)
+    except DuplicateKeyError:
+        # La richiesta ripresa ha inserito l'incidente nel frattempo
+        doc = await _find_created(incident_id)
+        if doc is None:
+            raise
+        return _replayed(doc)
+    except Exception:
+        # La chiave torna libera solo se l'incidente non è stato salvato: se
+        # l'errore è successivo all'insert il retry deve restituirlo, non duplicarlo
+        if await get_collection(COLLECTION_NAME).find_one({"_id": incident_id}, {"_id": 1}) is None:
+            await keys.release(idempotency_key)
+        raise
+    return trusted_json_response(_doc_to_incident(inserted))
 
 
 @router.get("/", response_model=List[IncidentSummary])
-async def list_incidents():
+async def list_incidents(
+    code: Optional[List[str]] = Query(None, description="Filtra gli incidenti che contengono tutti i codici indicati"),
+    include_archived: bool = Query(False, description="Includi gli incidenti archiviati"),
+):
     """Lista tutti gli incidenti (summary)"""
-    collection = get_collection(COLLECTION_NAME)
+    collection = get_read_collection(COLLECTION_NAME)
+
+    query = {}
+    if code:
+        # Usa l'indice multikey su all_codes
+        query["all_codes"] = {"$all": code}
+
+    # Proietta solo i campi necessari al summary
+    projection = {"title": 1, "created_at": 1, "taxonomy_codes": 1, "macro_counts": 1}
+    with span("mongo"):
+        cursor = collection.find(query, projection).sort("created_at", -1)
+        incidents = await cursor.to_list(length=None)
+        if include_archived:
+            # L'archivio conserva in chiaro gli stessi campi del summary
+            archived = await get_read_collection(ARCHIVE_COLLECTION).find(query, projection).to_list(length=None)
+            incidents = sorted(incidents + archived, key=lambda doc: doc["created_at"], reverse=True)
+
+    with span("serialization"):
+        return trusted_json_response(_build_summaries(incidents), List[IncidentSummary])
 
-    cursor = collection.find().sort("created_at", -1)
-    incidents = await cursor.to_list(length=None)
 
+def _build_summaries(incidents: List[dict]) -> List[IncidentSummary]:
+    """
+    Costruisce i summary della lista a partire dai documenti proiettati.
+
+    I documenti provengono dal database: i summary sono costruiti senza validazione.
+    """
     summaries = []
     for inc in incidents:
-        # Calcola count per categoria usando helper
+        # Conteggi denormalizzati, con fallback per documenti non ancora migrati
         taxonomy_codes = inc.get("taxonomy_codes", {})
-        counts = count_codes_by_category(taxonomy_codes)
+        counts = inc.get("macro_counts")
+        if counts is None:
+            counts = count_codes_by_category(taxonomy_codes)
 
         # Estrai severity (primo codice BC:SE se presente)
         severity_code = None
@@ -57,7 +261,7 @@ async def list_incidents():
         if bc_se_codes:
             severity_code = bc_se_codes[0]
 
-        summaries.append(IncidentSummary(
+        summaries.append(IncidentSummary.model_construct(
             id=inc["_id"],
             title=inc["title"],
             created_at=inc["created_at"],
@@ -71,73 +275,252 @@ async def list_incidents():
     return summaries
 
 
+@router.get("/stats", response_model=IncidentStats)
+async def get_incident_stats(top: int = Query(10, ge=1, le=100)):
+    """Statistiche aggregate per dashboard (severity, threat type, mese, top codici)"""
+    collection = get_read_collection(COLLECTION_NAME)
+    return await compute_incident_stats(collection, top=top)
+
+
+@router.get("/search/text", response_model=TextSearchResult)
+async def search_incidents(
+    q: str = Query(..., min_length=2, description="Testo da cercare (supporta \"frasi\" e -esclusioni)"),
+    page: int = Query(1, ge=1),
+    page_size: int = Query(20, ge=1, le=100),
+):
+    """Ricerca full-text su titolo, descrizione, note, dettagli codici e label tassonomia"""
+    collection = get_read_collection(COLLECTION_NAME)
+    return await search_incidents_text(collection, q, page=page, page_size=page_size)
+
+
+@router.post("/similar", response_model=List[SimilarIncident])
+async def find_similar_by_codes(
+    query: SimilarityQuery,
+    k: int = Query(10, ge=1, le=100),
+    metric: SimilarityMetric = "jaccard",
+):
+    """Incidenti passati simili a un insieme di codici (es. incidente in fase di classificazione)"""
+    codes = extract_all_codes_from_taxonomy_dict(query.taxonomy_codes)
+    return await _similar_incidents(codes, k, metric)
+
+
+@router.get("/{incident_id}/similar", response_model=List[SimilarIncident])
+async def find_similar_incidents(
+    incident_id: str,
+    k: int = Query(10, ge=1, le=100),
+    metric: SimilarityMetric = "jaccard",
+):
+    """Incidenti più simili a uno esistente per codici tassonomia"""
+    collection = get_collection(COLLECTION_NAME)
+
+    incident = await collection.find_one({"_id": incident_id}, {"all_codes": 1, "taxonomy_codes": 1})
+    if not incident:
+        incident = await get_collection(ARCHIVE_COLLECTION).find_one({"_id": incident_id}, {"all_codes": 1})
+    if not incident:
+        raise HTTPException(status_code=404, detail="Incidente non trovato")
+
+    codes = incident.get("all_codes")
+    if codes is None:
+        codes = extract_all_codes_from_taxonomy_dict(incident.get("taxonomy_codes") or {})
+    return await _similar_incidents(codes, k, metric, exclude_id=incident_id)
+
+
+@router.get("/{incident_id}/revisions", response_model=List[IncidentRevision])
+async def list_incident_revisions(
+    incident_id: str,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=500),
+):
+    """Storico delle modifiche di un incidente, dalla più recente"""
+    revisions = await _revisions().list_revisions(incident_id, skip=skip, limit=limit)
+    return trusted_json_response(
+        [model_from_db(IncidentRevision, record) for record in revisions], List[IncidentRevision]
+    )
+
+
+@router.get("/{incident_id}/revisions/{revision}", response_model=Incident)
+async def get_incident_revision(incident_id: str, revision: int):
+    """Ricostruisce l'incidente com'era a una revisione"""
+    doc = await _revisions().reconstruct(incident_id, revision)
+    if doc is None:
+        raise HTTPException(status_code=404, detail="Revisione non trovata")
+    return trusted_json_response(_doc_to_incident(doc))
+
+
 @router.get("/{incident_id}", response_model=Incident)
 async def get_incident(incident_id: str):
     """Ottieni dettagli di un incidente"""
     collection = get_collection(COLLECTION_NAME)
 
-    incident = await collection.find_one({"_id": incident_id})
-    if not incident:
-        raise HTTPException(status_code=404, detail="Incidente non trovato")
+    incident = await incident_store.get(collection, incident_id)
+    if incident:
+        return trusted_json_response(_doc_to_incident(incident))
 
-    return _doc_to_incident(incident)
+    archived = await _archive().get(incident_id)
+    if not archived:
+        raise HTTPException(status_code=404, detail="Incidente non trovato")
+    response = trusted_json_response(_doc_to_incident(archived))
+    response.headers["X-ICE-Archived"] = "true"
+    return response
 
 
 @router.put("/{incident_id}", response_model=Incident)
-async def update_incident(incident_id: str, incident_update: IncidentUpdate):
+async def update_incident(
+    incident_id: str,
+    incident_update: IncidentUpdate,
+    author: Optional[str] = Depends(get_author),
+):
     """Aggiorna un incidente"""
     collection = get_collection(COLLECTION_NAME)
 
-    # Verifica che esista
-    existing = await collection.find_one({"_id": incident_id})
-    if not existing:
-        raise HTTPException(status_code=404, detail="Incidente non trovato")
-
     # Prepara update
     update_data = incident_update.model_dump(exclude_unset=True)
-    if update_data:
-        update_data["updated_at"] = datetime.utcnow()
-        await collection.update_one(
-            {"_id": incident_id},
-            {"$set": update_data}
-        )
+    update_data.update(build_denormalized_fields(update_data))
+    if not update_data:
+        existing = await collection.find_one({"_id": incident_id}) or await _archive().get(incident_id)
+        if not existing:
+            raise HTTPException(status_code=404, detail="Incidente non trovato")
+        return trusted_json_response(_doc_to_incident(existing))
+
+    # Precisione al millisecondo come i datetime BSON: la risposta coincide con il documento salvato
+    now = datetime.utcnow()
+    update_data["updated_at"] = now.replace(microsecond=now.microsecond // 1000 * 1000)
+    # Il numero di revisione è incrementato nello stesso update (atomico);
+    # il documento precedente serve per calcolare il diff dello storico
+    update = {"$set": update_data, "$inc": {"revision": 1}}
+    before = await collection.find_one_and_update({"_id": incident_id}, update, return_document=ReturnDocument.BEFORE)
+    if not before:
+        try:
+            restored = await _archive().restore(incident_id)
+        except DuplicateKeyError:
+            raise HTTPException(
+                status_code=409,
+                detail="Impossibile ripristinare l'incidente archiviato: contenuto già presente in un incidente attivo",
+            )
+        if restored:
+            # Incidente archiviato: una modifica lo riporta nella collezione principale
+            before = await collection.find_one_and_update(
+                {"_id": incident_id}, update, return_document=ReturnDocument.BEFORE
+            )
+    if not before:
+        raise HTTPException(status_code=404, detail="Incidente non trovato")
 
-    # Rileggi documento aggiornato
-    updated = await collection.find_one({"_id": incident_id})
-    return _doc_to_incident(updated)
+    updated = {**before, **update_data, "revision": before.get("revision", 0) + 1}
+    await _revisions().record_update(before, updated, author)
+    await _after_write(incident_id, updated)
+    return trusted_json_response(_doc_to_incident(updated))
 
 
 @router.delete("/{incident_id}")
-async def delete_incident(incident_id: str):
-    """Elimina un incidente"""
+async def delete_incident(incident_id: str, author: Optional[str] = Depends(get_author)):
+    """Elimina un incidente (lo storico revisioni viene conservato)"""
     collection = get_collection(COLLECTION_NAME)
 
-    result = await collection.delete_one({"_id": incident_id})
-    if result.deleted_count == 0:
+    deleted = await collection.find_one_and_delete({"_id": incident_id}) or await _archive().delete(incident_id)
+    if not deleted:
         raise HTTPException(status_code=404, detail="Incidente non trovato")
+    await _revisions().record_delete(deleted, author)
+    await _after_write(incident_id, None)
 
     return {"message": "Incidente eliminato con successo"}
 
 
+# Campi di sistema ignorati negli import
+_IMPORT_SYSTEM_FIELDS = ("id", "_id", "created_at", "updated_at", "revision", "import_hash")
+
+
+def _parse_import(payload: dict) -> Dict[str, Any]:
+    """Valida un incidente esportato e ritorna i dati da salvare (con import_hash)"""
+    if not isinstance(payload, dict) or not payload.get("title"):
+        raise ValueError("Titolo mancante nel JSON")
+    payload = {k: v for k, v in payload.items() if k not in _IMPORT_SYSTEM_FIELDS}
+    data = IncidentCreate(**payload).model_dump()
+    data["import_hash"] = compute_content_hash(data)
+    return data
+
+
+async def _find_imported(import_hash: str) -> Optional[dict]:
+    """Incidente già importato con lo stesso contenuto (anche se archiviato)"""
+    doc = await get_collection(COLLECTION_NAME).find_one({"import_hash": import_hash})
+    if doc is None:
+        archived = await get_collection(ARCHIVE_COLLECTION).find_one({"import_hash": import_hash}, {"_id": 1})
+        if archived is not None:
+            doc = await _archive().get(archived["_id"])
+    return doc
+
+
 @router.post("/import", response_model=Incident)
-async def import_incident(payload: dict = Body(...)):
+async def import_incident(payload: dict = Body(...), author: Optional[str] = Depends(get_author)):
     """
     Importa un incidente da un JSON esportato.
     Ignora campi di sistema (id, created_at, updated_at) e crea un nuovo record.
-    """
-    if not payload.get("title"):
-        raise HTTPException(status_code=400, detail="Titolo mancante nel JSON")
 
-    # Rimuovi campi di sistema se presenti
-    payload.pop("id", None)
-    payload.pop("_id", None)
-    payload.pop("created_at", None)
-    payload.pop("updated_at", None)
-
-    # Crea incidente con i dati importati
+    Se lo stesso contenuto (titolo, discovered_at, codici) è già stato
+    importato restituisce l'incidente esistente (header X-ICE-Duplicate).
+    """
     try:
-        create_data = IncidentCreate(**payload)
-    except Exception as e:
+        data = _parse_import(payload)
+    except ValueError as e:
         raise HTTPException(status_code=400, detail=f"Dati non validi: {str(e)}")
 
-    return await create_incident(create_data)
+    existing = await _find_imported(data["import_hash"])
+    # Al più due inserimenti: se il documento in conflitto è sparito (eliminato
+    # nel frattempo) il secondo tentativo di solito riesce
+    for _ in range(2):
+        if existing is not None:
+            break
+        try:
+            return trusted_json_response(_doc_to_incident(await _insert_incident(data, author)))
+        except DuplicateKeyError:
+            # Import concorrente dello stesso contenuto
+            existing = await _find_imported(data["import_hash"])
+    if existing is None:
+        raise HTTPException(
+            status_code=409, detail="Import in conflitto con una scrittura concorrente: riprovare",
+            headers={"Retry-After": "1"},
+        )
+
+    response = trusted_json_response(_doc_to_incident(existing))
+    response.headers["X-ICE-Duplicate"] = "true"
+    return response
+
+
+@router.post("/import/bulk", response_model=BulkImportResult)
+async def import_incidents_bulk(payload: List[dict] = Body(...), author: Optional[str] = Depends(get_author)):
+    """
+    Importa più incidenti esportati in una sola richiesta.
+
+    I duplicati (già importati o ripetuti nel payload) sono saltati con
+    un'unica query sull'indice import_hash (per collezione, archivio incluso).
+    """
+    parsed: List[tuple] = []
+    errors = []
+    for index, item in enumerate(payload):
+        try:
+            parsed.append((index, _parse_import(item)))
+        except ValueError as e:
+            errors.append({"index": index, "detail": str(e)})
+
+    hashes = {"import_hash": {"$in": [data["import_hash"] for _, data in parsed]}}
+    existing = {}
+    for name in (ARCHIVE_COLLECTION, COLLECTION_NAME):
+        async for doc in get_collection(name).find(hashes, {"import_hash": 1}):
+            existing[doc["import_hash"]] = doc["_id"]
+
+    created, skipped = [], []
+    for index, data in parsed:
+        import_hash = data["import_hash"]
+        if import_hash in existing:
+            skipped.append({"index": index, "id": existing[import_hash]})
+            continue
+        try:
+            inserted = await _insert_incident(data, author)
+        except DuplicateKeyError:
+            doc = await _find_imported(import_hash)
+            skipped.append({"index": index, "id": doc["_id"] if doc else None})
+            continue
+        # Ripetizioni successive nello stesso payload puntano a quello appena creato
+        existing[import_hash] = inserted["_id"]
+        created.append(inserted["_id"])
+
+    return {"created": created, "skipped": skipped, "errors": errors}
@@ -1,31 +1,151 @@
-from fastapi import APIRouter, HTTPException
-from typing import List, Dict, Any
-from app.services.taxonomy_service import taxonomy_service
+import gzip
+import os
+from fastapi import APIRouter, HTTPException, Depends, Query, Request, Response
+from fastapi.responses import JSONResponse
+from typing import Callable, List, Dict, Any, Optional
+from app.api.deps import require_admin
+from app.services import invalidation_bus
+from app.services.taxonomy_service import TAXONOMY_FIELDS, project_taxonomy, taxonomy_service
+from app.utils.cache import TTLCache
 
 router = APIRouter()
 
+# Payload serializzati per variante (versione tassonomia, vista, macro, campi):
+# la tassonomia cambia solo con un reload, che cambia anche la versione nella chiave
+TAXONOMY_PAYLOAD_CACHE_SIZE = int(os.getenv("TAXONOMY_PAYLOAD_CACHE_SIZE", "64"))
+_GZIP_MIN_SIZE = 1024
 
-@router.get("/")
-async def get_taxonomy():
-    """Ritorna l'intera tassonomia ACN"""
-    return taxonomy_service.get_taxonomy()
+_payloads = TTLCache(ttl=None, maxsize=TAXONOMY_PAYLOAD_CACHE_SIZE)
 
+_FIELDS_DESCRIPTION = f"Campi da includere per ogni nodo, separati da virgola ({', '.join(sorted(TAXONOMY_FIELDS))})"
 
-@router.get("/macrocategories")
-async def get_macrocategories():
-    """Ritorna tutte le macrocategorie"""
-    return taxonomy_service.get_macrocategories()
 
+def _parse_fields(fields: Optional[str]) -> Optional[frozenset]:
+    """Campi richiesti con ?fields=code,label (None = tutti)"""
+    if not fields:
+        return None
+    selected = frozenset(f.strip() for f in fields.split(",") if f.strip())
+    unknown = selected - TAXONOMY_FIELDS
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Campi non validi: {', '.join(sorted(unknown))}")
+    return selected
 
-@router.get("/macrocategories/{code}")
-async def get_macrocategory(code: str):
-    """Ritorna una specifica macrocategoria"""
+
+def _require_macrocategory(code: str) -> Dict[str, Any]:
     mc = taxonomy_service.get_macrocategory(code)
     if not mc:
         raise HTTPException(status_code=404, detail=f"Macrocategoria {code} non trovata")
     return mc
 
 
+def _cached_payload(request: Request, key: tuple, build: Callable[[], Any]) -> Response:
+    """
+    Risposta JSON da bytes già serializzati (e compressi con gzip) per la variante.
+
+    La versione gzip è calcolata una volta sola e inviata ai client che
+    dichiarano Accept-Encoding: gzip.
+    """
+    key = (taxonomy_service.version, *key)
+    cached = _payloads.get(key)
+    if cached is None:
+        body = JSONResponse(content=build()).body
+        cached = (body, gzip.compress(body) if len(body) >= _GZIP_MIN_SIZE else None)
+        _payloads.set(key, cached)
+
+    body, compressed = cached
+    headers = {"Vary": "Accept-Encoding"}
+    if compressed is not None and "gzip" in request.headers.get("accept-encoding", ""):
+        headers["Content-Encoding"] = "gzip"
+        body = compressed
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+@router.get("/")
+async def get_taxonomy(
+    request: Request,
+    fields: Optional[str] = Query(None, description=_FIELDS_DESCRIPTION),
+    macro: Optional[str] = Query(None, description="Solo la macrocategoria indicata (es. TT)"),
+):
+    """Ritorna l'intera tassonomia ACN (o il sottoalbero di una macrocategoria)"""
+    selected = _parse_fields(fields)
+    if macro:
+        _require_macrocategory(macro)
+
+    def build():
+        taxonomy = taxonomy_service.get_taxonomy()
+        root = taxonomy.get("taxonomy", {})
+        macrocategories = root.get("macrocategories", [])
+        if macro:
+            macrocategories = [mc for mc in macrocategories if mc["code"] == macro]
+        return {**taxonomy, "taxonomy": {**root, "macrocategories": project_taxonomy(macrocategories, selected)}}
+
+    return _cached_payload(request, ("taxonomy", macro, selected), build)
+
+
+@router.get("/version")
+async def get_taxonomy_version():
+    """Ritorna la versione (hash dei file sorgente) della tassonomia caricata"""
+    return {
+        "version": taxonomy_service.version,
+        "loaded_at": taxonomy_service.loaded_at,
+        "source": taxonomy_service.source,
+    }
+
+
+@router.post("/reload", dependencies=[Depends(require_admin)])
+async def reload_taxonomy(force: bool = False):
+    """Ricarica la tassonomia dai file senza riavviare il worker"""
+    try:
+        changed = await taxonomy_service.reload_async(force=force)
+    except (OSError, ValueError) as e:
+        raise HTTPException(status_code=500, detail=f"Reload tassonomia fallito: {e}")
+    # Gli altri worker ricaricano a loro volta (stessi file montati)
+    await invalidation_bus.publish("taxonomy", taxonomy_service.version, force=force)
+    return {"reloaded": changed, "version": taxonomy_service.version}
+
+
+@router.get("/search")
+async def search_taxonomy(
+    q: str = Query(..., min_length=1, description="Testo da cercare (codice, label o descrizione, anche parziale)"),
+    limit: int = Query(10, ge=1, le=100),
+    macro: Optional[str] = Query(None, description="Limita alla macrocategoria indicata (es. TT)"),
+):
+    """Cerca i valori della tassonomia (autocompletamento)"""
+    return taxonomy_service.search(q, limit=limit, macro=macro)
+
+
+@router.get("/macrocategories")
+async def get_macrocategories(
+    request: Request,
+    fields: Optional[str] = Query(None, description=_FIELDS_DESCRIPTION),
+    macro: Optional[str] = Query(None, description="Solo la macrocategoria indicata (es. TT)"),
+):
+    """Ritorna tutte le macrocategorie (es. ?fields=code,name,label per il builder)"""
+    selected = _parse_fields(fields)
+    if macro:
+        _require_macrocategory(macro)
+
+    def build():
+        macrocategories = taxonomy_service.get_macrocategories()
+        if macro:
+            macrocategories = [mc for mc in macrocategories if mc["code"] == macro]
+        return project_taxonomy(macrocategories, selected)
+
+    return _cached_payload(request, ("macrocategories", macro, selected), build)
+
+
+@router.get("/macrocategories/{code}")
+async def get_macrocategory(
+    code: str,
+    request: Request,
+    fields: Optional[str] = Query(None, description=_FIELDS_DESCRIPTION),
+):
+    """Ritorna una specifica macrocategoria"""
+    selected = _parse_fields(fields)
+    mc = _require_macrocategory(code)
+    return _cached_payload(request, ("macrocategory", code, selected), lambda: project_taxonomy(mc, selected))
+
+
 @router.get("/macrocategories/{mc_code}/predicates/{pred_code}")
 async def get_predicate(mc_code: str, pred_code: str):
     """Ritorna un predicato specifico"""
@@ -0,0 +1,218 @@
+"""
+Comandi di amministrazione ICE
+
+Uso:
+    python -m app.cli backfill-codes [--force]
+    python -m app.cli build-taxonomy-snapshot [--output PATH]
+    python -m app.cli profile-startup [--module app.main] [--top 25] [--check]
+    python -m app.cli misp-feed [--output DIR] [--full]
+    python -m app.cli export-table --output FILE [--layout long|wide] [--format csv|parquet]
+    python -m app.cli archive-incidents [--older-than-days N] [--dry-run]
+"""
+import argparse
+import asyncio
+import re
+import subprocess
+import sys
+from collections import defaultdict
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from app import db
+
+
+async def _backfill_codes(args: argparse.Namespace) -> None:
+    from app.migrations import backfill_code_index_fields
+
+    await db.connect_to_mongo()
+    try:
+        await db.ensure_indexes()
+        updated = await backfill_code_index_fields(
+            db.get_collection("incidents"),
+            batch_size=args.batch_size,
+            force=args.force,
+        )
+        print(f"Aggiornati {updated} incidenti (campi derivati)")
+    finally:
+        await db.close_mongo_connection()
+
+
+async def _build_taxonomy_snapshot(args: argparse.Namespace) -> None:
+    from app.services.taxonomy_service import taxonomy_service
+
+    output = Path(args.output) if args.output else taxonomy_service.snapshot_path
+    size = taxonomy_service.build_snapshot(output)
+    print(f"Snapshot tassonomia {taxonomy_service.version} scritto in {output} ({size} byte)")
+
+
+# Pacchetti importati solo al primo utilizzo: non devono comparire all'avvio
+LAZY_PACKAGES = ("reportlab", "pyarrow")
+
+_IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)")
+
+
+async def _profile_startup(args: argparse.Namespace) -> None:
+    # Processo separato: l'import deve partire a freddo
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {args.module}"],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        print(result.stderr)
+        raise SystemExit(result.returncode)
+
+    modules = []
+    for line in result.stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, _, name = match.groups()
+            modules.append((name, int(self_us), int(cumulative_us)))
+
+    by_package = defaultdict(int)
+    for name, self_us, _ in modules:
+        by_package[name.split(".")[0]] += self_us
+    total_us = sum(by_package.values())
+
+    print(f"Import di {args.module}: {total_us / 1000:.1f} ms totali, {len(modules)} moduli\n")
+    print(f"{'Pacchetto':<30} {'ms':>9} {'%':>6}")
+    for package, self_us in sorted(by_package.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"{package:<30} {self_us / 1000:>9.1f} {100 * self_us / total_us:>5.1f}%")
+
+    print(f"\n{'Modulo (cumulativo)':<50} {'ms':>9}")
+    for name, _, cumulative_us in sorted(modules, key=lambda item: -item[2])[:args.top]:
+        print(f"{name:<50} {cumulative_us / 1000:>9.1f}")
+
+    eager = sorted({name.split(".")[0] for name, _, _ in modules} & set(LAZY_PACKAGES))
+    if eager:
+        print(f"\nPacchetti a import differito caricati all'avvio: {', '.join(eager)}")
+        if args.check:
+            raise SystemExit(1)
+
+
+async def _misp_feed(args: argparse.Namespace) -> None:
+    from app.services.archive_service import ARCHIVE_COLLECTION
+    from app.services.misp_feed_service import MISP_FEED_DIR, run_misp_feed
+
+    feed_dir = Path(args.output) if args.output else MISP_FEED_DIR
+    await db.connect_to_mongo()
+    try:
+        stats = await run_misp_feed(
+            db.get_read_collection("incidents"), feed_dir, full=args.full,
+            archive=db.get_read_collection(ARCHIVE_COLLECTION),
+        )
+    finally:
+        await db.close_mongo_connection()
+
+    if stats is None:
+        print(f"Feed in {feed_dir} già in aggiornamento da un altro processo")
+        raise SystemExit(1)
+    print(
+        f"Feed MISP in {feed_dir}: {stats['written']} eventi scritti, "
+        f"{stats['deleted']} rimossi, {stats['unchanged']} invariati"
+    )
+
+
+async def _export_table(args: argparse.Namespace) -> None:
+    from app.services.table_export_service import stream_incident_table
+    from app.services.taxonomy_service import taxonomy_service
+
+    output = Path(args.output)
+    await db.connect_to_mongo()
+    try:
+        try:
+            chunks = stream_incident_table(
+                db.get_read_collection("incidents"), args.layout, args.format,
+                taxonomy_service.get_code_index(), args.code,
+            )
+        except RuntimeError as exc:
+            print(exc)
+            raise SystemExit(1)
+        size = 0
+        with open(output, "wb") as f:
+            async for chunk in chunks:
+                f.write(chunk)
+                size += len(chunk)
+    finally:
+        await db.close_mongo_connection()
+    print(f"Tabella {args.layout} ({args.format}) scritta in {output} ({size} byte)")
+
+
+async def _archive_incidents(args: argparse.Namespace) -> None:
+    from app.services import invalidation_bus
+    from app.services.archive_service import ARCHIVE_AFTER_DAYS, ARCHIVE_COLLECTION, ArchiveService
+
+    days = args.older_than_days if args.older_than_days is not None else ARCHIVE_AFTER_DAYS
+    if days <= 0:
+        print("Indicare --older-than-days (o ARCHIVE_AFTER_DAYS) maggiore di zero")
+        raise SystemExit(1)
+
+    async def notify_workers(incident_ids):
+        # I worker in esecuzione invalidano le cache (l'indice di similarità include l'archivio)
+        for incident_id in incident_ids:
+            await invalidation_bus.publish("incident", incident_id, deleted=True, archived=True)
+
+    await db.connect_to_mongo()
+    try:
+        await db.ensure_indexes()
+        if invalidation_bus.INVALIDATION_BUS_ENABLED:
+            await invalidation_bus.ensure_bus_collection(db.get_database())
+        service = ArchiveService(db.get_collection("incidents"), db.get_collection(ARCHIVE_COLLECTION))
+        cutoff = datetime.utcnow() - timedelta(days=days)
+        count = await service.archive_older_than(
+            cutoff, batch_size=args.batch_size, dry_run=args.dry_run, on_archived=notify_workers,
+        )
+    finally:
+        await db.close_mongo_connection()
+
+    verb = "da archiviare" if args.dry_run else "archiviati"
+    print(f"Incidenti non modificati da {days} giorni {verb}: {count}")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m app.cli", description="Comandi di amministrazione ICE")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    backfill = commands.add_parser("backfill-codes", help="Popola i campi derivati (all_codes, macro_counts, ...) sugli incidenti esistenti")
+    backfill.add_argument("--batch-size", type=int, default=500)
+    backfill.add_argument("--force", action="store_true", help="Ricalcola anche i documenti già migrati")
+    backfill.set_defaults(handler=_backfill_codes)
+
+    snapshot = commands.add_parser("build-taxonomy-snapshot", help="Compila tassonomia e indici in uno snapshot per avvii rapidi")
+    snapshot.add_argument("--output", help="Percorso dello snapshot (default: TAXONOMY_SNAPSHOT_PATH)")
+    snapshot.set_defaults(handler=_build_taxonomy_snapshot)
+
+    profile = commands.add_parser("profile-startup", help="Report dei tempi di import all'avvio (python -X importtime)")
+    profile.add_argument("--module", default="app.main", help="Modulo da importare (default: app.main)")
+    profile.add_argument("--top", type=int, default=25, help="Numero di righe per sezione")
+    profile.add_argument("--check", action="store_true", help="Esce con codice 1 se all'avvio vengono importati reportlab o pyarrow")
+    profile.set_defaults(handler=_profile_startup)
+
+    feed = commands.add_parser("misp-feed", help="Genera/aggiorna il feed MISP statico (manifest.json, hashes.csv, eventi)")
+    feed.add_argument("--output", help="Cartella del feed (default: MISP_FEED_DIR)")
+    feed.add_argument("--full", action="store_true", help="Riscrive tutti gli eventi invece dei soli modificati")
+    feed.set_defaults(handler=_misp_feed)
+
+    table = commands.add_parser("export-table", help="Esporta gli incidenti in forma tabellare (CSV/Parquet) per analisi")
+    table.add_argument("--output", required=True, help="File di destinazione")
+    table.add_argument("--layout", choices=["long", "wide"], default="long", help="long: riga per incidente/codice; wide: colonne one-hot")
+    table.add_argument("--format", choices=["csv", "parquet"], default="csv", help="parquet richiede pyarrow")
+    table.add_argument("--code", action="append", help="Solo gli incidenti con questo codice (ripetibile)")
+    table.set_defaults(handler=_export_table)
+
+    archive = commands.add_parser("archive-incidents", help="Sposta nell'archivio compresso gli incidenti non modificati da tempo")
+    archive.add_argument("--older-than-days", type=int, help="Età minima dall'ultima modifica (default: ARCHIVE_AFTER_DAYS)")
+    archive.add_argument("--batch-size", type=int, default=200)
+    archive.add_argument("--dry-run", action="store_true", help="Conta soltanto gli incidenti archiviabili")
+    archive.set_defaults(handler=_archive_incidents)
+
+    return parser
+
+
+def main(argv=None) -> None:
+    args = build_parser().parse_args(argv)
+    asyncio.run(args.handler(args))
+
+
+if __name__ == "__main__":
+    main()
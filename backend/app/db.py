@@ -1,15 +1,120 @@
+import asyncio
 import os
 from motor.motor_asyncio import AsyncIOMotorClient
-from typing import Optional
+from pymongo import ASCENDING, DESCENDING, TEXT, monitoring
+from pymongo.errors import OperationFailure
+from pymongo.read_preferences import read_pref_mode_from_name, make_read_preference
+from typing import Any, Dict, Optional
+from app.metrics import MongoCommandMetrics
+from app.services.idempotency_service import IDEMPOTENCY_COLLECTION, IDEMPOTENCY_TTL_SECONDS
 
 # MongoDB connection URL
 MONGODB_URL = os.getenv("MONGODB_URL", "mongodb://mongo:27017")
 DATABASE_NAME = os.getenv("DATABASE_NAME", "ice_db")
 
+# Pool di connessioni e timeout (i valori nell'URL hanno comunque la precedenza)
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "10"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "30000"))
+# Compressione del protocollo: "zlib" è sempre disponibile, "zstd"/"snappy"
+# richiedono i pacchetti zstandard/python-snappy. Vuoto = nessuna compressione
+MONGO_COMPRESSORS = os.getenv("MONGO_COMPRESSORS", "")
+
+# Read preference per le letture pesanti (lista, ricerca, statistiche, export).
+# Con "secondaryPreferred" su un replica set queste letture possono restituire
+# dati in ritardo di qualche istante rispetto all'ultima scrittura
+MONGO_READ_PREFERENCE = os.getenv("MONGO_READ_PREFERENCE", "primary")
+MONGO_MAX_STALENESS_SECONDS = int(os.getenv("MONGO_MAX_STALENESS_SECONDS", "-1"))
+
+# Connessioni aperte allo startup (default: MONGO_MIN_POOL_SIZE)
+MONGO_WARMUP_CONNECTIONS = int(os.getenv("MONGO_WARMUP_CONNECTIONS", str(MONGO_MIN_POOL_SIZE)))
+
 # Global MongoDB client
 client: Optional[AsyncIOMotorClient] = None
 
 
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    """Contatori del pool di connessioni per server, esposti su /health"""
+
+    def __init__(self):
+        self.pools: Dict[str, Dict[str, int]] = {}
+
+    def _pool(self, address) -> Dict[str, int]:
+        key = "%s:%s" % address
+        pool = self.pools.get(key)
+        if pool is None:
+            pool = self.pools[key] = {
+                "open": 0, "in_use": 0, "created": 0, "closed": 0,
+                "checked_out": 0, "checkout_failed": 0,
+            }
+        return pool
+
+    def pool_created(self, event):
+        self._pool(event.address)
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        self.pools.pop("%s:%s" % event.address, None)
+
+    def connection_created(self, event):
+        pool = self._pool(event.address)
+        pool["open"] += 1
+        pool["created"] += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        pool = self._pool(event.address)
+        pool["open"] -= 1
+        pool["closed"] += 1
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        self._pool(event.address)["checkout_failed"] += 1
+
+    def connection_checked_out(self, event):
+        pool = self._pool(event.address)
+        pool["in_use"] += 1
+        pool["checked_out"] += 1
+
+    def connection_checked_in(self, event):
+        self._pool(event.address)["in_use"] -= 1
+
+
+pool_stats = PoolStatsListener()
+
+
+def _read_preference():
+    """Read preference configurata per le letture pesanti"""
+    mode = read_pref_mode_from_name(MONGO_READ_PREFERENCE)
+    return make_read_preference(mode, None, max_staleness=MONGO_MAX_STALENESS_SECONDS)
+
+
+def _client_options() -> Dict[str, Any]:
+    options: Dict[str, Any] = {
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "maxIdleTimeMS": MONGO_MAX_IDLE_TIME_MS,
+        "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS,
+        "socketTimeoutMS": MONGO_SOCKET_TIMEOUT_MS,
+    }
+    if MONGO_COMPRESSORS:
+        options["compressors"] = MONGO_COMPRESSORS
+    return options
+
+
 def get_database():
     """Get MongoDB database instance"""
     return client[DATABASE_NAME]
@@ -18,10 +123,102 @@ def get_database():
 async def connect_to_mongo():
     """Connect to MongoDB on startup"""
     global client
-    client = AsyncIOMotorClient(MONGODB_URL)
+    # I listener misurano la durata dei comandi (/metrics) e lo stato del pool (/health)
+    client = AsyncIOMotorClient(
+        MONGODB_URL,
+        event_listeners=[MongoCommandMetrics(), pool_stats],
+        **_client_options(),
+    )
     print(f"Connected to MongoDB at {MONGODB_URL}")
 
 
+async def warm_up_pool(connections: int = MONGO_WARMUP_CONNECTIONS):
+    """
+    Apre le connessioni del pool allo startup, così le prime richieste dopo
+    un deploy non pagano handshake, autenticazione e server selection.
+
+    I ping concorrenti costringono il driver ad aprire una connessione ciascuno;
+    con una read preference non primaria viene preparato anche il pool verso
+    i secondari usati dalle letture pesanti.
+    """
+    if connections <= 0:
+        return
+
+    db = get_database()
+    await asyncio.gather(*(db.command("ping") for _ in range(connections)))
+    if MONGO_READ_PREFERENCE != "primary":
+        read_preference = _read_preference()
+        await asyncio.gather(*(db.command("ping", read_preference=read_preference) for _ in range(connections)))
+    print(f"MongoDB pool warm-up: {connections} connessioni")
+
+
+def get_pool_stats() -> Dict[str, Any]:
+    """Stato del pool per server (connessioni aperte, in uso, errori di checkout)"""
+    return {
+        "max_pool_size": MONGO_MAX_POOL_SIZE,
+        "min_pool_size": MONGO_MIN_POOL_SIZE,
+        "read_preference": MONGO_READ_PREFERENCE,
+        "servers": {address: dict(stats) for address, stats in pool_stats.pools.items()},
+    }
+
+
+async def ensure_indexes():
+    """Crea gli indici necessari (idempotente, eseguito allo startup)"""
+    incidents = get_collection("incidents")
+    # Indice multikey sull'array denormalizzato dei codici
+    await incidents.create_index([("all_codes", ASCENDING)], name="all_codes")
+    await incidents.create_index([("created_at", DESCENDING)], name="created_at")
+    # Indice full-text; default_language "none" perché i testi mescolano
+    # italiano e inglese e lo stemming di una sola lingua peggiora i risultati
+    await incidents.create_index(
+        [
+            ("title", TEXT),
+            ("description", TEXT),
+            ("notes", TEXT),
+            ("code_details_text", TEXT),
+            ("tags", TEXT),
+        ],
+        name="incident_text",
+        weights={"title": 10, "tags": 5, "description": 3, "code_details_text": 2, "notes": 1},
+        default_language="none",
+    )
+
+    # Hash del contenuto importato: un reimport dello stesso JSON trova il record esistente.
+    # Parziale: gli incidenti creati dall'interfaccia non hanno il campo
+    await incidents.create_index(
+        [("import_hash", ASCENDING)], name="import_hash", unique=True,
+        partialFilterExpression={"import_hash": {"$type": "string"}},
+    )
+
+    # Chiavi di idempotenza delle creazioni, rimosse da MongoDB alla scadenza
+    idempotency = get_collection(IDEMPOTENCY_COLLECTION)
+    try:
+        await idempotency.create_index(
+            [("created_at", ASCENDING)], name="expires", expireAfterSeconds=IDEMPOTENCY_TTL_SECONDS,
+        )
+    except OperationFailure:
+        # Indice già presente con un'altra scadenza (IDEMPOTENCY_TTL_SECONDS cambiato)
+        await get_database().command(
+            "collMod", IDEMPOTENCY_COLLECTION,
+            index={"name": "expires", "expireAfterSeconds": IDEMPOTENCY_TTL_SECONDS},
+        )
+
+    # Archivio: lista con include_archived, filtro per codice e dedup degli import
+    archive = get_collection("incidents_archive")
+    await archive.create_index([("created_at", DESCENDING)], name="created_at")
+    await archive.create_index([("all_codes", ASCENDING)], name="all_codes")
+    await archive.create_index(
+        [("import_hash", ASCENDING)], name="import_hash", unique=True,
+        partialFilterExpression={"import_hash": {"$type": "string"}},
+    )
+
+    # Storico revisioni: lookup per incidente e numero di revisione
+    revisions = get_collection("incident_revisions")
+    await revisions.create_index(
+        [("incident_id", ASCENDING), ("revision", ASCENDING)], name="incident_revision", unique=True,
+    )
+
+
 async def close_mongo_connection():
     """Close MongoDB connection on shutdown"""
     global client
@@ -34,3 +231,15 @@ def get_collection(collection_name: str):
     """Get a specific collection"""
     db = get_database()
     return db[collection_name]
+
+
+def get_read_collection(collection_name: str):
+    """
+    Collezione per le letture pesanti (lista, ricerca, statistiche, export),
+    con la read preference MONGO_READ_PREFERENCE.
+
+    Da non usare per riletture subito dopo una scrittura.
+    """
+    if MONGO_READ_PREFERENCE == "primary":
+        return get_collection(collection_name)
+    return get_database().get_collection(collection_name, read_preference=_read_preference())
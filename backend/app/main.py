@@ -1,22 +1,86 @@
+import asyncio
 import os
 from pathlib import Path
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from dotenv import load_dotenv
 from contextlib import asynccontextmanager
-from app.api import incidents, taxonomy, export
-from app.db import connect_to_mongo, close_mongo_connection
+from app.admission import ADMISSION_ENABLED, AdmissionMiddleware
+from app.api import incidents, taxonomy, export, admin
+from app.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, MetricsMiddleware, registry as metrics_registry
+from app.profiling import ProfilingMiddleware
+from app.db import (
+    connect_to_mongo, close_mongo_connection, ensure_indexes, get_collection, get_database, get_pool_stats,
+    get_read_collection, warm_up_pool,
+)
+from app.services import invalidation_bus
+from app.services.archive_service import (
+    ARCHIVE_AFTER_DAYS, ARCHIVE_COLLECTION, ARCHIVE_INTERVAL, ArchiveService, schedule_archiving,
+)
+from app.services.misp_feed_service import MISP_FEED_INTERVAL, schedule_misp_feed
+from app.services.similarity_service import load_similarity_index
+from app.services.taxonomy_service import taxonomy_service, watch_taxonomy_files
 
 load_dotenv(dotenv_path=Path(".env"))
 
+# Intervallo (secondi) di controllo dei file tassonomia; 0 = watcher disabilitato
+TAXONOMY_WATCH_INTERVAL = float(os.getenv("TAXONOMY_WATCH_INTERVAL", "0"))
+
+# Metriche Prometheus su /metrics (middleware a basso overhead)
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# Carica i renderer di export (ReportLab) all'avvio invece che al primo export
+EXPORT_PRELOAD = os.getenv("EXPORT_PRELOAD", "false").lower() in ("1", "true", "yes")
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Gestisce startup e shutdown dell'applicazione"""
     # Startup
     await connect_to_mongo()
+    await warm_up_pool()
+    await ensure_indexes()
+    await load_similarity_index(get_collection("incidents"), get_collection(ARCHIVE_COLLECTION))
+    if EXPORT_PRELOAD:
+        export.preload_renderers()
+
+    # L'universo dei codici dipende dalla tassonomia: ricostruisci l'indice dopo un reload
+    taxonomy_service.add_reload_listener(
+        lambda version: load_similarity_index(get_collection("incidents"), get_collection(ARCHIVE_COLLECTION))
+    )
+    background = []
+    if TAXONOMY_WATCH_INTERVAL > 0:
+        background.append(asyncio.create_task(watch_taxonomy_files(TAXONOMY_WATCH_INTERVAL)))
+
+    # Invalidazioni pubblicate dagli altri worker
+    if invalidation_bus.INVALIDATION_BUS_ENABLED:
+        invalidation_bus.add_handler("incident", incidents.apply_remote_write)
+        invalidation_bus.add_handler(
+            "taxonomy", lambda event: taxonomy_service.reload_async(force=event["data"].get("force", False))
+        )
+        await invalidation_bus.ensure_bus_collection(get_database())
+        background.append(asyncio.create_task(invalidation_bus.listen()))
+
+    # Feed MISP statico (con più worker lo aggiorna uno alla volta, lock su file)
+    if MISP_FEED_INTERVAL > 0:
+        background.append(asyncio.create_task(
+            schedule_misp_feed(
+                get_read_collection("incidents"), MISP_FEED_INTERVAL, archive=get_read_collection(ARCHIVE_COLLECTION)
+            )
+        ))
+
+    # Archiviazione automatica degli incidenti non più modificati
+    if ARCHIVE_AFTER_DAYS > 0 and ARCHIVE_INTERVAL > 0:
+        archive = ArchiveService(get_collection("incidents"), get_collection(ARCHIVE_COLLECTION))
+        background.append(asyncio.create_task(
+            schedule_archiving(archive, ARCHIVE_AFTER_DAYS, ARCHIVE_INTERVAL, on_archived=incidents.after_archive)
+        ))
+
     yield
     # Shutdown
+    for task in background:
+        task.cancel()
     await close_mongo_connection()
 
 
@@ -38,6 +102,11 @@ else:
 # Se è presente "*" disattiviamo i credentials (richiesto dallo standard CORS)
 allow_credentials = "*" not in allowed_origins
 
+# Admission control (rate limit per client e concorrenza per classe di route).
+# Registrato prima di CORS così anche le risposte 429/503 hanno gli header CORS
+if ADMISSION_ENABLED:
+    app.add_middleware(AdmissionMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=allowed_origins,
@@ -46,10 +115,17 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Profilazione opt-in (header/query con token admin, o campionamento PROFILE_SAMPLE_RATE)
+app.add_middleware(ProfilingMiddleware)
+
+if METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+
 # Routes
 app.include_router(incidents.router, prefix="/api/incidents", tags=["incidents"])
 app.include_router(taxonomy.router, prefix="/api/taxonomy", tags=["taxonomy"])
 app.include_router(export.router, prefix="/api/export", tags=["export"])
+app.include_router(admin.router, prefix="/api/admin", tags=["admin"])
 
 
 @app.get("/")
@@ -64,4 +140,10 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy", "database": "MongoDB"}
+    return {"status": "healthy", "database": "MongoDB", "mongo_pool": get_pool_stats()}
+
+
+if METRICS_ENABLED:
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics():
+        return PlainTextResponse(metrics_registry.render(), media_type=METRICS_CONTENT_TYPE)
@@ -0,0 +1,248 @@
+"""
+Metriche in formato Prometheus (text exposition format 0.0.4)
+
+Implementazione minimale e senza dipendenze: contatori, gauge e istogrammi
+con label, aggiornati con un lock per metrica (i listener Mongo girano nei
+thread del driver) e serializzati solo quando viene letto /metrics.
+"""
+import bisect
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from pymongo import monitoring
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1_000, 10_000, 50_000, 100_000, 250_000, 500_000, 1_000_000, 5_000_000)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Contatore monotono"""
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return self._header() + [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+            for labels, value in items
+        ]
+
+
+class Gauge(Counter):
+    """Valore che può salire e scendere"""
+    type_name = "gauge"
+
+    def dec(self, *labels: str, amount: float = 1.0) -> None:
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels: str, value: float) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(_Metric):
+    """Istogramma a bucket fissi (conteggi cumulati solo in fase di render)"""
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Iterable[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [conteggi per bucket (+Inf in coda), somma, totale]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = [(labels, (list(e[0]), e[1], e[2])) for labels, e in self._values.items()]
+
+        lines = self._header()
+        for labels, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                bucket_labels = _format_labels(self.labelnames, labels, 'le="%s"' % le)
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {count}")
+        return lines
+
+
+class Registry:
+    """Insieme di metriche esposte su /metrics"""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+HTTP_REQUESTS = registry.register(Counter(
+    "ice_http_requests_total", "Richieste HTTP completate", ("method", "route", "status"),
+))
+HTTP_LATENCY = registry.register(Histogram(
+    "ice_http_request_duration_seconds", "Latenza delle richieste HTTP per route", ("method", "route"),
+))
+HTTP_IN_PROGRESS = registry.register(Gauge(
+    "ice_http_requests_in_progress", "Richieste HTTP in corso",
+))
+MONGO_LATENCY = registry.register(Histogram(
+    "ice_mongo_command_duration_seconds", "Durata dei comandi MongoDB", ("command", "collection"),
+))
+MONGO_FAILURES = registry.register(Counter(
+    "ice_mongo_command_failures_total", "Comandi MongoDB falliti", ("command", "collection"),
+))
+PDF_RENDER_LATENCY = registry.register(Histogram(
+    "ice_pdf_render_duration_seconds", "Durata della generazione dei report PDF",
+))
+EXPORT_PAYLOAD_BYTES = registry.register(Histogram(
+    "ice_export_payload_bytes", "Dimensione dei payload di export", ("format",), buckets=SIZE_BUCKETS,
+))
+EXPORT_CACHE_REQUESTS = registry.register(Counter(
+    "ice_export_cache_requests_total", "Letture della cache degli export storici", ("format", "result"),
+))
+EXPORT_COALESCED = registry.register(Counter(
+    "ice_export_coalesced_total", "Export serviti da una generazione concorrente già in corso", ("format",),
+))
+INCIDENT_CACHE_REQUESTS = registry.register(Counter(
+    "ice_incident_cache_requests_total", "Letture della cache incidenti", ("result",),
+))
+ADMISSION_REJECTED = registry.register(Counter(
+    "ice_admission_rejected_total", "Richieste rifiutate dall'admission control", ("route_class", "reason"),
+))
+ADMISSION_IN_PROGRESS = registry.register(Gauge(
+    "ice_admission_in_progress", "Richieste in corso per classe con limite di concorrenza", ("route_class",),
+))
+
+
+class MetricsMiddleware:
+    """
+    Middleware ASGI che registra conteggi, latenze e richieste in corso.
+
+    La route è il template del path (es. /api/incidents/{incident_id}),
+    ricavato dall'endpoint risolto dal router: la cardinalità resta fissa.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._routes: Optional[Dict[object, str]] = None
+
+    def _route_template(self, scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        if self._routes is None:
+            self._routes = {
+                getattr(route, "endpoint", None): getattr(route, "path_format", route.path)
+                for route in scope["app"].routes
+            }
+        return self._routes.get(endpoint, "unmatched")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        HTTP_IN_PROGRESS.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            HTTP_IN_PROGRESS.dec()
+            route = self._route_template(scope)
+            HTTP_LATENCY.observe(elapsed, scope["method"], route)
+            HTTP_REQUESTS.inc(scope["method"], route, str(status["code"]))
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Listener pymongo: misura la durata di ogni comando inviato al server"""
+
+    def __init__(self):
+        self._collections: Dict[int, str] = {}
+
+    def started(self, event):
+        # find/insert/aggregate...: {"<comando>": "<collezione>"}; getMore: {"collection": ...}
+        collection = event.command.get(event.command_name)
+        if not isinstance(collection, str):
+            collection = event.command.get("collection", "")
+        self._collections[event.request_id] = collection if isinstance(collection, str) else ""
+
+    def succeeded(self, event):
+        collection = self._collections.pop(event.request_id, "")
+        MONGO_LATENCY.observe(event.duration_micros / 1_000_000, event.command_name, collection)
+
+    def failed(self, event):
+        collection = self._collections.pop(event.request_id, "")
+        MONGO_LATENCY.observe(event.duration_micros / 1_000_000, event.command_name, collection)
+        MONGO_FAILURES.inc(event.command_name, collection)
@@ -0,0 +1,44 @@
+"""
+Migrazioni dati una tantum sulla collezione incidenti
+"""
+from pymongo import UpdateOne
+
+from app.utils.incident_helpers import build_denormalized_fields
+
+
+async def backfill_code_index_fields(collection, batch_size: int = 500, force: bool = False) -> int:
+    """
+    Popola i campi derivati (all_codes, macro_counts, code_details_text) sui documenti esistenti.
+
+    Args:
+        collection: Collezione MongoDB degli incidenti
+        batch_size: Numero di update per ogni bulk_write
+        force: Se True ricalcola anche i documenti già migrati
+
+    Returns:
+        Numero di documenti aggiornati
+    """
+    query = {} if force else {"$or": [
+        {"all_codes": {"$exists": False}},
+        {"code_details_text": {"$exists": False}},
+    ]}
+    cursor = collection.find(query, {"taxonomy_codes": 1, "code_details": 1})
+
+    updated = 0
+    batch = []
+    async for doc in cursor:
+        fields = build_denormalized_fields({
+            "taxonomy_codes": doc.get("taxonomy_codes") or {},
+            "code_details": doc.get("code_details") or {},
+        })
+        batch.append(UpdateOne({"_id": doc["_id"]}, {"$set": fields}))
+        if len(batch) >= batch_size:
+            result = await collection.bulk_write(batch, ordered=False)
+            updated += result.modified_count
+            batch = []
+
+    if batch:
+        result = await collection.bulk_write(batch, ordered=False)
+        updated += result.modified_count
+
+    return updated
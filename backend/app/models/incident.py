@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import Optional, List, Dict
+from typing import Any, Optional, List, Dict
 from pydantic import BaseModel, Field
 
 
@@ -53,6 +53,7 @@ class Incident(IncidentBase):
     id: str
     created_at: datetime
     updated_at: datetime
+    revision: Optional[int] = Field(None, description="Numero di revisione (storico modifiche)")
 
     class Config:
         json_schema_extra = {
@@ -111,3 +112,98 @@ class IncidentSummary(BaseModel):
                 "severity_code": "BC:SE_HI"
             }
         }
+
+
+class CodeCount(BaseModel):
+    """Conteggio incidenti per codice tassonomia"""
+    code: Optional[str] = Field(None, description="Codice tassonomia (None = non valorizzato)")
+    label: Optional[str] = None
+    macro: Optional[str] = None
+    count: int
+
+
+class MonthCount(BaseModel):
+    """Conteggio incidenti per mese di creazione"""
+    month: str = Field(description="Mese nel formato YYYY-MM")
+    count: int
+
+
+class IncidentStats(BaseModel):
+    """Statistiche aggregate per dashboard"""
+    total: int
+    by_severity: List[CodeCount]
+    by_threat_type: List[CodeCount]
+    by_month: List[MonthCount]
+    top_codes: List[CodeCount]
+    generated_at: datetime
+
+
+class SearchSnippet(BaseModel):
+    """Frammento di testo con i termini cercati evidenziati"""
+    field: str = Field(description="Campo di origine (es. 'description', 'code_details.TT:MA_RA')")
+    text: str = Field(description="Snippet con i match racchiusi in <mark>")
+
+
+class TextSearchHit(BaseModel):
+    """Singolo risultato della ricerca full-text"""
+    id: str
+    title: str
+    created_at: datetime
+    score: float = Field(description="Rilevanza testuale (0 se il match è solo su label tassonomia)")
+    snippets: List[SearchSnippet]
+    matched_codes: List[str] = Field(description="Codici la cui label corrisponde alla ricerca")
+
+
+class TextSearchResult(BaseModel):
+    """Pagina di risultati della ricerca full-text"""
+    query: str
+    total: int
+    page: int
+    page_size: int
+    results: List[TextSearchHit]
+
+
+class SimilarityQuery(BaseModel):
+    """Codici di un incidente (anche non ancora salvato) da confrontare"""
+    taxonomy_codes: Dict[str, List[str]] = Field(default_factory=dict)
+
+
+class SimilarIncident(BaseModel):
+    """Incidente simile con punteggio di similarità"""
+    id: str
+    title: str
+    created_at: datetime
+    score: float = Field(description="Similarità (Jaccard o coseno) in [0, 1]")
+    shared_codes: List[str] = Field(description="Codici in comune con l'incidente di riferimento")
+
+
+class IncidentRevision(BaseModel):
+    """Revisione di un incidente con le sole differenze rispetto alla precedente"""
+    revision: int
+    operation: str = Field(description="create, update, delete o baseline (stato pre-storico)")
+    author: Optional[str] = None
+    created_at: datetime
+    changes: Dict[str, Any] = Field(
+        default_factory=dict,
+        description="Per campo: {'set': valore}; taxonomy_codes: added/removed per chiave; "
+                    "code_details: set/unset",
+    )
+
+
+class BulkImportSkipped(BaseModel):
+    """Elemento di un import già presente (stesso contenuto di un incidente importato o del payload)"""
+    index: int = Field(description="Posizione nel payload")
+    id: Optional[str] = Field(None, description="ID dell'incidente esistente")
+
+
+class BulkImportError(BaseModel):
+    """Elemento di un import non valido"""
+    index: int
+    detail: str
+
+
+class BulkImportResult(BaseModel):
+    """Esito di un import multiplo"""
+    created: List[str] = Field(description="ID degli incidenti creati")
+    skipped: List[BulkImportSkipped]
+    errors: List[BulkImportError]
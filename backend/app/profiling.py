@@ -0,0 +1,188 @@
+"""
+Profilazione opt-in delle richieste
+
+Una richiesta viene profilata se lo chiede esplicitamente (header
+X-ICE-Profile: 1 oppure query ?_profile=1, sempre con X-Admin-Token valido)
+oppure se rientra nella percentuale campionata PROFILE_SAMPLE_RATE.
+
+Per ogni richiesta profilata si salvano:
+- un profilo CPU cProfile (.prof, apribile con pstats/snakeviz)
+- il breakdown degli span applicativi (mongo, taxonomy, serialization, reportlab)
+
+Nota: cProfile misura il thread dell'event loop, quindi durante la richiesta
+può includere anche coroutine di altre richieste concorrenti; gli span
+invece sono legati alla singola richiesta tramite contextvars.
+"""
+import asyncio
+import cProfile
+import io
+import json
+import os
+import pstats
+import random
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qs
+
+from app.api.deps import is_admin_token
+
+PROFILE_DIR = Path(os.getenv("PROFILE_DIR", "/tmp/ice-profiles"))
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "50"))
+
+_current_spans: ContextVar[Optional[Dict[str, List[float]]]] = ContextVar("ice_profile_spans", default=None)
+
+# Un solo cProfile attivo per volta sul thread dell'event loop
+_cpu_profiler_busy = False
+
+
+@contextmanager
+def span(name: str):
+    """
+    Misura la durata di un blocco nella richiesta profilata corrente.
+
+    Fuori da una richiesta profilata è un no-op (costo: una lettura di contextvar).
+    """
+    spans = _current_spans.get()
+    if spans is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        entry = spans.setdefault(name, [0.0, 0])
+        entry[0] += time.perf_counter() - start
+        entry[1] += 1
+
+
+def _should_profile(scope) -> bool:
+    """Decide se profilare la richiesta (richiesta esplicita autorizzata o campionamento)"""
+    # Percorso veloce: nessun parsing completo di header/query per le richieste normali
+    requested = False
+    admin_token = None
+    for key, value in scope.get("headers", []):
+        if key == b"x-ice-profile":
+            requested = value == b"1"
+        elif key == b"x-admin-token":
+            admin_token = value.decode("latin-1")
+
+    query_string = scope.get("query_string", b"")
+    if not requested and b"_profile=" in query_string:
+        requested = parse_qs(query_string.decode("latin-1")).get("_profile") == ["1"]
+
+    if requested:
+        return is_admin_token(admin_token)
+
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def _write_profile(profile_id: str, profiler: Optional[cProfile.Profile], metadata: Dict[str, Any]) -> None:
+    """Salva profilo e metadati, mantenendo solo gli ultimi PROFILE_MAX_FILES"""
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    if profiler is not None:
+        profiler.dump_stats(PROFILE_DIR / f"{profile_id}.prof")
+    (PROFILE_DIR / f"{profile_id}.json").write_text(json.dumps(metadata, default=str), encoding="utf-8")
+
+    entries = sorted(PROFILE_DIR.glob("*.json"), key=lambda p: p.stat().st_mtime)
+    for old in entries[:-PROFILE_MAX_FILES]:
+        old.unlink(missing_ok=True)
+        old.with_suffix(".prof").unlink(missing_ok=True)
+
+
+def list_profiles() -> List[Dict[str, Any]]:
+    """Metadati dei profili salvati, dal più recente"""
+    if not PROFILE_DIR.exists():
+        return []
+    entries = sorted(PROFILE_DIR.glob("*.json"), key=lambda p: p.stat().st_mtime, reverse=True)
+    return [json.loads(p.read_text(encoding="utf-8")) for p in entries]
+
+
+def _profile_path(profile_id: str, suffix: str) -> Optional[Path]:
+    # L'ID è generato da noi (uuid hex): rifiuta qualsiasi altro formato
+    if not profile_id.isalnum():
+        return None
+    path = PROFILE_DIR / f"{profile_id}{suffix}"
+    return path if path.exists() else None
+
+
+def get_profile(profile_id: str, top: int = 30) -> Optional[Dict[str, Any]]:
+    """Metadati di un profilo più le funzioni con tempo cumulativo più alto"""
+    meta_path = _profile_path(profile_id, ".json")
+    if meta_path is None:
+        return None
+
+    metadata = json.loads(meta_path.read_text(encoding="utf-8"))
+    prof_path = _profile_path(profile_id, ".prof")
+    if prof_path is not None:
+        out = io.StringIO()
+        pstats.Stats(str(prof_path), stream=out).sort_stats("cumulative").print_stats(top)
+        metadata["cpu_top"] = out.getvalue()
+    return metadata
+
+
+def get_profile_file(profile_id: str) -> Optional[Path]:
+    """Percorso del file .prof di un profilo"""
+    return _profile_path(profile_id, ".prof")
+
+
+class ProfilingMiddleware:
+    """Middleware ASGI che profila le richieste selezionate"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not _should_profile(scope):
+            await self.app(scope, receive, send)
+            return
+
+        global _cpu_profiler_busy
+        profile_id = uuid.uuid4().hex
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(b"x-ice-profile-id", profile_id.encode())]
+            await send(message)
+
+        profiler = None
+        if not _cpu_profiler_busy:
+            _cpu_profiler_busy = True
+            profiler = cProfile.Profile()
+
+        spans: Dict[str, List[float]] = {}
+        token = _current_spans.set(spans)
+        start = time.perf_counter()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                _cpu_profiler_busy = False
+            elapsed = time.perf_counter() - start
+            _current_spans.reset(token)
+
+            metadata = {
+                "id": profile_id,
+                "created_at": datetime.utcnow().isoformat(),
+                "method": scope["method"],
+                "path": scope["path"],
+                "status": status["code"],
+                "duration_ms": round(elapsed * 1000, 3),
+                "cpu_profile": profiler is not None,
+                "spans": {
+                    name: {"total_ms": round(total * 1000, 3), "count": count}
+                    for name, (total, count) in spans.items()
+                },
+            }
+            await asyncio.to_thread(_write_profile, profile_id, profiler, metadata)
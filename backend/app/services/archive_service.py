@@ -0,0 +1,170 @@
+"""
+Archiviazione a freddo degli incidenti non più modificati
+
+Gli incidenti non aggiornati da ARCHIVE_AFTER_DAYS giorni vengono spostati
+dalla collezione incidents a incidents_archive, salvati come blob BSON
+compresso con zlib. Nell'archivio restano in chiaro solo i campi necessari
+a lista, filtro per codice e deduplicazione degli import.
+
+Lista, ricerca, statistiche ed export multipli (STIX, tabelle) lavorano sul
+solo insieme "caldo"; lettura per ID, replay di Idempotency-Key, export del
+singolo incidente, feed MISP e similarità includono l'archivio in modo
+trasparente (decompressione su richiesta). Una modifica riporta
+l'incidente nella collezione principale.
+"""
+import asyncio
+import os
+import zlib
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import bson
+from bson.binary import Binary
+from pymongo import DeleteOne, ReplaceOne
+from pymongo.errors import DuplicateKeyError
+
+ARCHIVE_COLLECTION = "incidents_archive"
+# Età (giorni dall'ultima modifica) oltre la quale un incidente viene archiviato; 0 = mai
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "0"))
+# Intervallo (secondi) dell'archiviazione automatica; 0 = solo da CLI
+ARCHIVE_INTERVAL = float(os.getenv("ARCHIVE_INTERVAL", "0"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "200"))
+ARCHIVE_COMPRESSION_LEVEL = int(os.getenv("ARCHIVE_COMPRESSION_LEVEL", "6"))
+
+# Campi in chiaro nel documento di archivio (lista, filtro per codice, dedup import)
+_SUMMARY_FIELDS = ("title", "created_at", "updated_at", "all_codes", "macro_counts", "import_hash")
+
+
+def pack_incident(doc: Dict[str, Any], archived_at: Optional[datetime] = None) -> Dict[str, Any]:
+    """Documento di archivio: incidente completo compresso più i campi di riepilogo"""
+    archived = {"_id": doc["_id"]}
+    archived.update({field: doc[field] for field in _SUMMARY_FIELDS if field in doc})
+    # Solo la severity: basta a _build_summaries per il badge della lista
+    severity = (doc.get("taxonomy_codes") or {}).get("BC:SE")
+    if severity:
+        archived["taxonomy_codes"] = {"BC:SE": severity}
+    archived["archived_at"] = archived_at or datetime.utcnow()
+    archived["blob"] = Binary(zlib.compress(bson.encode(doc), ARCHIVE_COMPRESSION_LEVEL))
+    return archived
+
+
+def unpack_incident(archived: Dict[str, Any]) -> Dict[str, Any]:
+    """Documento incidente originale da un documento di archivio"""
+    return bson.decode(zlib.decompress(archived["blob"]))
+
+
+class ArchiveService:
+    """Spostamento degli incidenti tra collezione principale e archivio"""
+
+    def __init__(self, incidents, archive):
+        self.incidents = incidents
+        self.archive = archive
+
+    async def get(self, incident_id: str) -> Optional[Dict[str, Any]]:
+        """Incidente archiviato (decompresso), None se non è in archivio"""
+        archived = await self.archive.find_one({"_id": incident_id}, {"blob": 1})
+        return unpack_incident(archived) if archived is not None else None
+
+    async def archive_older_than(
+        self,
+        cutoff: datetime,
+        batch_size: int = ARCHIVE_BATCH_SIZE,
+        dry_run: bool = False,
+        on_archived: Optional[Callable[[List[str]], Awaitable[None]]] = None,
+    ) -> int:
+        """
+        Archivia gli incidenti con updated_at precedente a cutoff.
+
+        Ogni batch viene prima scritto nell'archivio e poi rimosso dalla
+        collezione principale solo se nel frattempo non è stato modificato
+        (stesso updated_at); le copie di quelli modificati vengono scartate.
+        Più worker possono archiviare in parallelo senza perdere documenti.
+
+        Args:
+            cutoff: Istante (UTC naive) di riferimento
+            batch_size: Incidenti per batch
+            dry_run: Conta soltanto, senza spostare nulla
+            on_archived: Callback con gli ID archiviati di ogni batch (invalidazione cache)
+
+        Returns:
+            Numero di incidenti archiviati (o archiviabili con dry_run)
+        """
+        query = {"updated_at": {"$lt": cutoff}}
+        if dry_run:
+            return await self.incidents.count_documents(query)
+
+        total = 0
+        while True:
+            docs = await self.incidents.find(query).limit(batch_size).to_list(length=batch_size)
+            if not docs:
+                return total
+
+            now = datetime.utcnow()
+            await self.archive.bulk_write(
+                [ReplaceOne({"_id": doc["_id"]}, pack_incident(doc, now), upsert=True) for doc in docs],
+                ordered=False,
+            )
+            moved, skipped = [], []
+            for doc in docs:
+                result = await self.incidents.delete_one({"_id": doc["_id"], "updated_at": doc["updated_at"]})
+                (moved if result.deleted_count else skipped).append(doc["_id"])
+            if skipped:
+                # Ancora presenti = modificati durante l'archiviazione: restano (solo) nella
+                # collezione principale. Gli assenti li ha già spostati un altro worker
+                changed = await self.incidents.distinct("_id", {"_id": {"$in": skipped}})
+                if changed:
+                    await self.archive.bulk_write([DeleteOne({"_id": incident_id}) for incident_id in changed])
+
+            if moved and on_archived is not None:
+                await on_archived(moved)
+            total += len(moved)
+            if len(docs) < batch_size:
+                return total
+
+    async def restore(self, incident_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Riporta un incidente archiviato nella collezione principale.
+
+        Returns:
+            Il documento ripristinato, None se non era in archivio
+
+        Raises:
+            DuplicateKeyError: conflitto su un altro indice univoco (es. import_hash
+                di un incidente attivo); la copia in archivio resta intatta
+        """
+        doc = await self.get(incident_id)
+        if doc is None:
+            return None
+        try:
+            await self.incidents.insert_one(doc)
+        except DuplicateKeyError:
+            # Già ripristinato da una richiesta concorrente solo se l'_id è nella collezione principale
+            if await self.incidents.find_one({"_id": incident_id}, {"_id": 1}) is None:
+                raise
+        await self.archive.delete_one({"_id": incident_id})
+        return doc
+
+    async def delete(self, incident_id: str) -> Optional[Dict[str, Any]]:
+        """Elimina un incidente archiviato e ne ritorna il documento (None se assente)"""
+        archived = await self.archive.find_one_and_delete({"_id": incident_id})
+        return unpack_incident(archived) if archived is not None else None
+
+
+async def schedule_archiving(
+    service: ArchiveService,
+    older_than_days: int,
+    interval: float,
+    on_archived: Optional[Callable[[List[str]], Awaitable[None]]] = None,
+) -> None:
+    """Archiviazione periodica (task in background avviato nel lifespan)"""
+    while True:
+        try:
+            cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+            archived = await service.archive_older_than(cutoff, on_archived=on_archived)
+            if archived:
+                print(f"Archiviati {archived} incidenti non modificati da {older_than_days} giorni")
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            print(f"Archiviazione incidenti fallita: {exc}")
+        await asyncio.sleep(interval)
@@ -0,0 +1,85 @@
+"""
+Chiavi di idempotenza per la creazione degli incidenti (header Idempotency-Key)
+
+Un retry del client con la stessa chiave restituisce l'incidente già
+creato invece di crearne un altro. Ogni chiave è salvata con:
+- l'impronta del payload (la stessa chiave con un payload diverso è un errore)
+- l'ID dell'incidente, riservato prima dell'inserimento
+- una lease (reserved_until): se la richiesta che ha riservato la chiave
+  muore prima di inserire l'incidente, un retry dopo la scadenza della lease
+  riprende la creazione con lo stesso ID invece di ricevere 409 fino alla
+  scadenza della chiave
+
+Le chiavi scadono dopo IDEMPOTENCY_TTL_SECONDS (indice TTL su created_at).
+"""
+import hashlib
+import json
+import os
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from pymongo.errors import DuplicateKeyError
+
+IDEMPOTENCY_COLLECTION = "idempotency_keys"
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", str(24 * 3600)))
+# Durata massima attesa di una creazione; oltre, un retry può riprenderla
+IDEMPOTENCY_LEASE_SECONDS = float(os.getenv("IDEMPOTENCY_LEASE_SECONDS", "30"))
+
+
+def payload_fingerprint(payload: Dict[str, Any]) -> str:
+    """Impronta SHA-256 di un payload (JSON canonico, chiavi ordinate)"""
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class IdempotencyStore:
+    """Registro delle chiavi di idempotenza su una collezione MongoDB"""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def reserve(self, key: str, fingerprint: str, incident_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Riserva la chiave per una nuova creazione.
+
+        Returns:
+            None se la chiave è stata riservata ora, altrimenti il record
+            esistente ({"fingerprint", "incident_id", ...})
+        """
+        now = datetime.utcnow()
+        try:
+            await self.collection.insert_one({
+                "_id": key,
+                "fingerprint": fingerprint,
+                "incident_id": incident_id,
+                "created_at": now,
+                "reserved_until": now + timedelta(seconds=IDEMPOTENCY_LEASE_SECONDS),
+            })
+            return None
+        except DuplicateKeyError:
+            existing = await self.collection.find_one({"_id": key})
+            if existing is None:
+                # Scaduta tra l'insert e la lettura: si riprova una volta
+                return await self.reserve(key, fingerprint, incident_id)
+            return existing
+
+    async def take_over(self, record: Dict[str, Any]) -> bool:
+        """
+        Riprende una creazione rimasta a metà (incidente mai inserito).
+
+        Riesce solo se la lease è scaduta e nessun altro l'ha già ripresa;
+        la creazione riparte con lo stesso incident_id del record.
+        """
+        now = datetime.utcnow()
+        reserved_until = record.get("reserved_until")
+        if reserved_until is not None and reserved_until > now:
+            return False
+        result = await self.collection.update_one(
+            {"_id": record["_id"], "reserved_until": reserved_until},
+            {"$set": {"reserved_until": now + timedelta(seconds=IDEMPOTENCY_LEASE_SECONDS)}},
+        )
+        return result.modified_count == 1
+
+    async def release(self, key: str) -> None:
+        """Libera la chiave dopo una creazione fallita, così il retry può ripeterla"""
+        await self.collection.delete_one({"_id": key})
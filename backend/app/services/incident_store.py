@@ -0,0 +1,195 @@
+"""
+Cache read-through dei documenti incidente
+
+Dettaglio, export JSON/PDF/MISP e similarità leggono spesso lo stesso
+incidente a pochi secondi di distanza: la cache evita di rileggerlo ogni
+volta da MongoDB.
+
+- Backend di default in-process (LRU + TTL), uno per worker
+- Backend condiviso opzionale (Redis, INCIDENT_CACHE_BACKEND=redis) per i
+  deployment multi-worker, oppure qualsiasi oggetto con get/set/delete async
+- Le scritture aggiornano la cache (write-through) e le eliminazioni lasciano
+  un tombstone; ogni voce porta la versione del documento (revision,
+  incrementata con $inc a ogni modifica), così né una lettura lenta né la
+  write-through di un update concorrente più vecchio sovrascrivono il dato
+  nuovo. Il tombstone blocca le letture ma non le scritture (es. il
+  ripristino dall'archivio)
+- La cache si popola solo da letture sul primario: un secondario in ritardo
+  vi metterebbe una versione vecchia visibile a tutti i lettori
+
+Con il backend locale gli altri worker vengono avvisati tramite il bus di
+invalidazione; se il bus non è attivo vedono le modifiche al più dopo
+INCIDENT_CACHE_TTL secondi.
+"""
+import os
+from typing import Any, Dict, Optional, Protocol
+
+from pymongo import ReadPreference
+
+from app.metrics import INCIDENT_CACHE_REQUESTS
+from app.utils.cache import TTLCache
+
+INCIDENT_CACHE_BACKEND = os.getenv("INCIDENT_CACHE_BACKEND", "local").lower()
+INCIDENT_CACHE_TTL = float(os.getenv("INCIDENT_CACHE_TTL", "60"))
+INCIDENT_CACHE_MAXSIZE = int(os.getenv("INCIDENT_CACHE_MAXSIZE", "1000"))
+REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
+
+_KEY_PREFIX = "ice:incident:"
+
+
+class CacheBackend(Protocol):
+    """Interfaccia minima di un backend di cache (valori: dict serializzabili BSON)"""
+
+    # True se il backend è condiviso tra i worker (nessuna invalidazione remota necessaria)
+    shared: bool
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]: ...
+
+    async def set(self, key: str, value: Dict[str, Any], ttl: float) -> None: ...
+
+    async def delete(self, key: str) -> None: ...
+
+
+class LocalCacheBackend:
+    """Backend in-process basato su TTLCache"""
+
+    shared = False
+
+    def __init__(self, ttl: float = INCIDENT_CACHE_TTL, maxsize: int = INCIDENT_CACHE_MAXSIZE):
+        self._cache = TTLCache(ttl=ttl, maxsize=maxsize)
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        return self._cache.get(key)
+
+    async def set(self, key: str, value: Dict[str, Any], ttl: float) -> None:
+        self._cache.set(key, value)
+
+    async def delete(self, key: str) -> None:
+        self._cache.invalidate(key)
+
+    def clear(self) -> None:
+        self._cache.invalidate()
+
+
+class RedisCacheBackend:
+    """Backend condiviso su Redis (richiede il pacchetto opzionale redis)"""
+
+    shared = True
+
+    def __init__(self, url: str = REDIS_URL):
+        try:
+            import redis.asyncio as redis
+        except ImportError as exc:
+            raise RuntimeError("INCIDENT_CACHE_BACKEND=redis richiede il pacchetto 'redis'") from exc
+        import bson
+
+        self._bson = bson
+        self._client = redis.from_url(url)
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        raw = await self._client.get(key)
+        return self._bson.decode(raw) if raw is not None else None
+
+    async def set(self, key: str, value: Dict[str, Any], ttl: float) -> None:
+        # Redis rifiuta px <= 0: con TTL nullo la cache è disattivata
+        if ttl * 1000 < 1:
+            return
+        await self._client.set(key, self._bson.encode(value), px=int(ttl * 1000))
+
+    async def delete(self, key: str) -> None:
+        await self._client.delete(key)
+
+
+def _document_version(doc: Dict[str, Any]) -> int:
+    """Numero di revisione (0 per i documenti precedenti allo storico revisioni)"""
+    return doc.get("revision") or 0
+
+
+class IncidentStore:
+    """
+    Accesso agli incidenti per ID con cache read-through.
+
+    I documenti restituiti sono copie: il chiamante può modificarli
+    (es. _id -> id) senza alterare la cache.
+    """
+
+    def __init__(self, backend: Optional[CacheBackend], ttl: float = INCIDENT_CACHE_TTL):
+        self.backend = backend
+        self.ttl = ttl
+
+    async def get(self, collection, incident_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Ritorna il documento dalla cache o, se assente, da MongoDB.
+
+        Il documento letto viene messo in cache solo se collection legge dal
+        primario (get_collection, non get_read_collection).
+        """
+        if self.backend is None:
+            return await collection.find_one({"_id": incident_id})
+
+        key = _KEY_PREFIX + incident_id
+        entry = await self.backend.get(key)
+        if entry is not None:
+            INCIDENT_CACHE_REQUESTS.inc("hit")
+            doc = entry.get("doc")
+            return dict(doc) if doc is not None else None
+
+        INCIDENT_CACHE_REQUESTS.inc("miss")
+        doc = await collection.find_one({"_id": incident_id})
+        if doc is not None and collection.read_preference == ReadPreference.PRIMARY:
+            await self._store(key, doc, from_write=False)
+        return dict(doc) if doc is not None else None
+
+    async def put(self, doc: Dict[str, Any]) -> None:
+        """Aggiorna la cache dopo una scrittura"""
+        if self.backend is not None:
+            await self._store(_KEY_PREFIX + doc["_id"], doc, from_write=True)
+
+    async def invalidate(self, incident_id: str, deleted: bool = False) -> None:
+        """
+        Rimuove un incidente dalla cache.
+
+        Con deleted=True lascia un tombstone per la durata del TTL, così una
+        lettura concorrente non reinserisce il documento appena eliminato.
+        """
+        if self.backend is None:
+            return
+        key = _KEY_PREFIX + incident_id
+        if deleted:
+            await self.backend.set(key, {"doc": None, "version": None}, self.ttl)
+        else:
+            await self.backend.delete(key)
+
+    async def invalidate_local(self, incident_id: str, deleted: bool = False) -> None:
+        """Invalidazione ricevuta da un altro worker: serve solo con backend non condiviso"""
+        if self.backend is not None and not self.backend.shared:
+            await self.invalidate(incident_id, deleted=deleted)
+
+    async def _store(self, key: str, doc: Dict[str, Any], from_write: bool) -> None:
+        """Salva il documento solo se più recente della voce in cache"""
+        version = _document_version(doc)
+        current = await self.backend.get(key)
+        if current is not None:
+            if current["doc"] is None:
+                # Tombstone: una lettura concorrente non reinserisce il documento eliminato
+                if not from_write:
+                    return
+            elif isinstance(current["version"], int) and current["version"] >= version:
+                return
+        await self.backend.set(key, {"doc": dict(doc), "version": version}, self.ttl)
+
+
+def _create_backend(name: str) -> Optional[CacheBackend]:
+    if name in ("none", "off", "disabled"):
+        return None
+    if name == "redis":
+        return RedisCacheBackend()
+    return LocalCacheBackend()
+
+
+incident_store = IncidentStore(_create_backend(INCIDENT_CACHE_BACKEND))
+
+
+def set_cache_backend(backend: Optional[CacheBackend]) -> None:
+    """Sostituisce il backend di cache (None = cache disattivata)"""
+    incident_store.backend = backend
@@ -0,0 +1,131 @@
+"""
+Bus di invalidazione delle cache tra worker e container
+
+Ogni worker mantiene cache in-process (statistiche, incidenti, indice di
+similarità, tassonomia). Quando un worker scrive, pubblica un evento nella
+capped collection cache_invalidations; tutti gli altri la seguono con un
+cursore tailable e applicano le stesse invalidazioni localmente.
+
+Nessun servizio esterno: basta MongoDB (anche standalone). Gli eventi
+pubblicati dal worker stesso vengono ignorati, perché già applicati dal
+percorso di scrittura.
+"""
+import asyncio
+import inspect
+import os
+import socket
+import uuid
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Union
+
+from pymongo import CursorType
+from pymongo.errors import CollectionInvalid, PyMongoError
+
+INVALIDATION_BUS_ENABLED = os.getenv("INVALIDATION_BUS_ENABLED", "true").lower() in ("1", "true", "yes")
+INVALIDATION_COLLECTION = os.getenv("INVALIDATION_COLLECTION", "cache_invalidations")
+# Dimensione della capped collection: gli eventi sono piccoli (~150 byte)
+INVALIDATION_BUS_SIZE = int(os.getenv("INVALIDATION_BUS_SIZE", str(4 * 1024 * 1024)))
+
+# Identificativo di questo processo (host:pid:random)
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+Handler = Callable[[Dict[str, Any]], Union[None, Awaitable[None]]]
+
+_handlers: Dict[str, List[Handler]] = {}
+_collection = None
+
+
+def add_handler(kind: str, handler: Handler) -> None:
+    """
+    Registra un handler per gli eventi di un tipo ("incident", "taxonomy", ...).
+
+    L'handler riceve il documento evento (kind, key, data, origin, ts)
+    e può essere sincrono o una coroutine.
+    """
+    _handlers.setdefault(kind, []).append(handler)
+
+
+async def ensure_bus_collection(db) -> None:
+    """Crea la capped collection se non esiste (idempotente)"""
+    global _collection
+    try:
+        await db.create_collection(INVALIDATION_COLLECTION, capped=True, size=INVALIDATION_BUS_SIZE)
+    except CollectionInvalid:
+        pass
+    _collection = db[INVALIDATION_COLLECTION]
+
+
+async def publish(kind: str, key: Optional[str] = None, **data: Any) -> None:
+    """
+    Pubblica un evento di invalidazione per gli altri worker.
+
+    Un errore di pubblicazione non fa fallire la scrittura che l'ha generato:
+    gli altri worker vedranno il dato aggiornato alla scadenza dei TTL.
+    """
+    if _collection is None:
+        return
+    try:
+        await _collection.insert_one({
+            "kind": kind,
+            "key": key,
+            "data": data,
+            "origin": WORKER_ID,
+            "ts": datetime.utcnow(),
+        })
+    except PyMongoError as exc:
+        print(f"Invalidation bus: pubblicazione fallita ({kind} {key}): {exc}")
+
+
+async def _dispatch(event: Dict[str, Any]) -> None:
+    for handler in _handlers.get(event.get("kind"), []):
+        try:
+            result = handler(event)
+            if inspect.isawaitable(result):
+                await result
+        except Exception as exc:
+            print(f"Invalidation bus: handler {event.get('kind')} fallito: {exc}")
+
+
+async def listen(retry_interval: float = 1.0) -> None:
+    """
+    Segue la capped collection e applica gli eventi degli altri worker.
+
+    Parte dall'ultimo evento esistente (quelli precedenti all'avvio sono già
+    riflessi nei dati caricati allo startup) e ricrea il cursore se muore,
+    ad esempio quando la collection è ancora vuota.
+
+    La ripresa segue l'ordine naturale (di inserimento) e non l'_id: gli
+    ObjectId di processi diversi non sono ordinati nello stesso secondo, quindi
+    un filtro {"_id": {"$gt": ultimo}} perderebbe gli eventi con _id minore
+    inseriti dopo. Il nuovo cursore riparte dall'inizio della collection e
+    salta gli eventi fino all'ultimo già visto compreso.
+    """
+    if _collection is None:
+        return
+
+    last = await _collection.find_one({}, sort=[("$natural", -1)])
+    last_id = last["_id"] if last else None
+
+    while True:
+        try:
+            skipping = last_id is not None
+            if skipping and await _collection.find_one({"_id": last_id}, {"_id": 1}) is None:
+                # Sovrascritto dalla capped collection: possibili eventi persi,
+                # si riapplicano tutti quelli presenti (le invalidazioni sono idempotenti)
+                print("Invalidation bus: ultimo evento visto non più presente, riapplico gli eventi")
+                skipping = False
+
+            cursor = _collection.find({}, cursor_type=CursorType.TAILABLE_AWAIT)
+            while cursor.alive:
+                async for event in cursor:
+                    if skipping:
+                        skipping = event["_id"] != last_id
+                        continue
+                    last_id = event["_id"]
+                    if event.get("origin") != WORKER_ID:
+                        await _dispatch(event)
+        except asyncio.CancelledError:
+            raise
+        except PyMongoError as exc:
+            print(f"Invalidation bus: cursore interrotto: {exc}")
+        await asyncio.sleep(retry_interval)
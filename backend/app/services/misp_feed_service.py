@@ -0,0 +1,223 @@
+"""
+Generazione di un feed MISP statico dagli incidenti
+
+Struttura standard di un feed MISP:
+- <uuid>.json   un file per evento (uuid = ID dell'incidente)
+- manifest.json indice degli eventi con metadati e timestamp
+- hashes.csv    hash MD5 dei valori degli attributi, per evento
+
+Gli aggiornamenti sono incrementali: si confronta updated_at di ogni
+incidente con il timestamp registrato nel manifest e si riscrivono solo
+gli eventi cambiati; gli eventi di incidenti eliminati vengono rimossi.
+Gli incidenti archiviati restano nel feed (updated_at è in chiaro
+nell'archivio, il documento completo si decomprime solo se va riscritto).
+Ogni file è scritto su un temporaneo e sostituito con os.replace, quindi
+chi legge il feed non vede mai file parziali; il manifest è scritto per
+ultimo.
+"""
+import asyncio
+import csv
+import fcntl
+import hashlib
+import io
+import json
+import os
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from app.services.archive_service import unpack_incident
+from app.services.misp_service import create_misp_event
+from app.services.taxonomy_service import taxonomy_service
+
+MISP_FEED_DIR = Path(os.getenv("MISP_FEED_DIR", "/app/misp-feed"))
+# Intervallo (secondi) di rigenerazione automatica; 0 = solo da CLI
+MISP_FEED_INTERVAL = float(os.getenv("MISP_FEED_INTERVAL", "0"))
+MISP_FEED_ORG_NAME = os.getenv("MISP_FEED_ORG_NAME", "ICE")
+MISP_FEED_ORG_UUID = os.getenv(
+    "MISP_FEED_ORG_UUID", str(uuid.uuid5(uuid.NAMESPACE_DNS, f"{MISP_FEED_ORG_NAME}.ice"))
+)
+
+_FETCH_BATCH = 200
+_LOCK_FILE = ".lock"
+
+
+def _epoch(value: Optional[datetime]) -> str:
+    """Timestamp MISP (secondi epoch, stringa) da un datetime UTC naive"""
+    if value is None:
+        return "0"
+    return str(int(value.replace(tzinfo=timezone.utc).timestamp()))
+
+
+def _org() -> Dict[str, str]:
+    return {"name": MISP_FEED_ORG_NAME, "uuid": MISP_FEED_ORG_UUID}
+
+
+def build_feed_event(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Evento MISP completo per il feed a partire da un documento incidente.
+
+    Riusa create_misp_event e aggiunge i campi richiesti dai feed
+    (uuid, timestamp, Orgc); gli UUID degli attributi sono deterministici,
+    così un evento riscritto mantiene gli stessi attributi.
+    """
+    event_uuid = doc["_id"]
+    timestamp = _epoch(doc.get("updated_at"))
+    event = create_misp_event(doc, taxonomy_service)["Event"]
+    event.update({
+        "uuid": event_uuid,
+        "date": (doc.get("created_at") or datetime.utcnow()).strftime("%Y-%m-%d"),
+        "timestamp": timestamp,
+        "publish_timestamp": timestamp,
+        "published": True,
+        "Orgc": _org(),
+    })
+    for index, attribute in enumerate(event["Attribute"]):
+        attribute["uuid"] = str(uuid.uuid5(uuid.UUID(event_uuid), f"attribute-{index}"))
+        attribute["timestamp"] = timestamp
+    return {"Event": event}
+
+
+def _manifest_entry(event: Dict[str, Any]) -> Dict[str, Any]:
+    data = event["Event"]
+    return {
+        "Orgc": data["Orgc"],
+        "Tag": data["Tag"],
+        "info": data["info"],
+        "date": data["date"],
+        "analysis": data["analysis"],
+        "threat_level_id": data["threat_level_id"],
+        "timestamp": data["timestamp"],
+    }
+
+
+def _event_hashes(event: Dict[str, Any]) -> List[List[str]]:
+    event_uuid = event["Event"]["uuid"]
+    return [
+        [hashlib.md5(str(attribute["value"]).encode("utf-8")).hexdigest(), event_uuid]
+        for attribute in event["Event"]["Attribute"]
+    ]
+
+
+def _write_atomic(path: Path, data: bytes) -> None:
+    tmp = path.with_name(f".{path.name}.tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+
+def _read_manifest(feed_dir: Path) -> Dict[str, Any]:
+    try:
+        return json.loads((feed_dir / "manifest.json").read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+
+
+def _read_hashes(feed_dir: Path) -> List[List[str]]:
+    try:
+        with open(feed_dir / "hashes.csv", newline="", encoding="utf-8") as f:
+            return [row for row in csv.reader(f) if len(row) == 2]
+    except OSError:
+        return []
+
+
+def _hashes_csv(rows: List[List[str]]) -> bytes:
+    out = io.StringIO()
+    csv.writer(out, quoting=csv.QUOTE_ALL, lineterminator="\n").writerows(rows)
+    return out.getvalue().encode("utf-8")
+
+
+async def generate_misp_feed(
+    collection, feed_dir: Path = MISP_FEED_DIR, full: bool = False, archive=None,
+) -> Dict[str, int]:
+    """
+    Aggiorna il feed MISP nella cartella indicata.
+
+    Args:
+        collection: Collezione MongoDB degli incidenti
+        feed_dir: Cartella del feed
+        full: Se True riscrive tutti gli eventi
+        archive: Collezione degli incidenti archiviati (inclusi nel feed)
+
+    Returns:
+        Conteggi {"written", "deleted", "unchanged"}
+    """
+    feed_dir.mkdir(parents=True, exist_ok=True)
+    manifest = {} if full else _read_manifest(feed_dir)
+
+    # Solo ID e updated_at per capire cosa è cambiato
+    sources = [collection] if archive is None else [archive, collection]
+    current = {}
+    for source in sources:
+        async for doc in source.find({}, {"updated_at": 1}):
+            current[doc["_id"]] = _epoch(doc.get("updated_at"))
+    changed = [
+        incident_id for incident_id, timestamp in current.items()
+        if manifest.get(incident_id, {}).get("timestamp") != timestamp
+        or not (feed_dir / f"{incident_id}.json").exists()
+    ]
+    deleted = [event_uuid for event_uuid in manifest if event_uuid not in current]
+
+    stale = set(changed) | set(deleted)
+    hashes = [] if full else [row for row in _read_hashes(feed_dir) if row[1] not in stale]
+
+    for start in range(0, len(changed), _FETCH_BATCH):
+        batch = changed[start:start + _FETCH_BATCH]
+        docs = {doc["_id"]: doc async for doc in collection.find({"_id": {"$in": batch}})}
+        missing = [incident_id for incident_id in batch if incident_id not in docs]
+        if missing and archive is not None:
+            async for archived in archive.find({"_id": {"$in": missing}}, {"blob": 1}):
+                docs[archived["_id"]] = unpack_incident(archived)
+        for doc in docs.values():
+            event = build_feed_event(doc)
+            data = json.dumps(event, ensure_ascii=False, default=str).encode("utf-8")
+            await asyncio.to_thread(_write_atomic, feed_dir / f"{doc['_id']}.json", data)
+            manifest[doc["_id"]] = _manifest_entry(event)
+            hashes.extend(_event_hashes(event))
+
+    for event_uuid in deleted:
+        manifest.pop(event_uuid, None)
+        (feed_dir / f"{event_uuid}.json").unlink(missing_ok=True)
+
+    _write_atomic(feed_dir / "hashes.csv", _hashes_csv(hashes))
+    _write_atomic(
+        feed_dir / "manifest.json",
+        json.dumps(manifest, ensure_ascii=False, sort_keys=True).encode("utf-8"),
+    )
+    return {"written": len(changed), "deleted": len(deleted), "unchanged": len(current) - len(changed)}
+
+
+async def run_misp_feed(
+    collection, feed_dir: Path = MISP_FEED_DIR, full: bool = False, archive=None,
+) -> Optional[Dict[str, int]]:
+    """
+    Come generate_misp_feed, ma con un lock sul file .lock della cartella:
+    con più worker o container un solo processo alla volta aggiorna il feed.
+
+    Returns:
+        Conteggi, oppure None se un altro processo sta già aggiornando il feed
+    """
+    feed_dir.mkdir(parents=True, exist_ok=True)
+    with open(feed_dir / _LOCK_FILE, "w") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return None
+        try:
+            return await generate_misp_feed(collection, feed_dir, full=full, archive=archive)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+async def schedule_misp_feed(collection, interval: float = MISP_FEED_INTERVAL, archive=None) -> None:
+    """Rigenera periodicamente il feed (task in background avviato nel lifespan)"""
+    while True:
+        try:
+            stats = await run_misp_feed(collection, archive=archive)
+            if stats and (stats["written"] or stats["deleted"]):
+                print(f"Feed MISP aggiornato: {stats['written']} eventi scritti, {stats['deleted']} rimossi")
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            print(f"Feed MISP: aggiornamento fallito: {exc}")
+        await asyncio.sleep(interval)
@@ -0,0 +1,258 @@
+"""
+Storico delle revisioni degli incidenti
+
+Ogni scrittura registra una revisione nella collezione incident_revisions
+con le sole differenze rispetto alla revisione precedente:
+
+- campi semplici (title, description, ...): {"set": nuovo_valore}
+- taxonomy_codes: codici aggiunti/rimossi per chiave di predicato
+- code_details: note impostate e codici rimossi
+
+Ogni REVISION_CHECKPOINT_INTERVAL revisioni (e alla creazione) viene salvato
+anche uno snapshot completo dei campi: una versione passata si ricostruisce
+dal checkpoint più vicino applicando al massimo INTERVAL - 1 diff.
+
+Gli incidenti creati prima dello storico ricevono una revisione 0 di
+riferimento (checkpoint dello stato corrente) alla prima modifica.
+"""
+import copy
+import os
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from app.utils.incident_helpers import build_denormalized_fields
+
+REVISIONS_COLLECTION = "incident_revisions"
+REVISION_CHECKPOINT_INTERVAL = int(os.getenv("REVISION_CHECKPOINT_INTERVAL", "10"))
+
+# Campi inseriti dall'utente; i campi derivati vengono ricalcolati in ricostruzione
+TRACKED_FIELDS = ("title", "description", "discovered_at", "taxonomy_codes", "code_details", "tags", "notes")
+
+
+def _tracked_state(doc: Dict[str, Any]) -> Dict[str, Any]:
+    return {field: copy.deepcopy(doc.get(field)) for field in TRACKED_FIELDS}
+
+
+def diff_taxonomy_codes(old: Dict[str, List[str]], new: Dict[str, List[str]]) -> Dict[str, Any]:
+    """
+    Differenze per codice tra due dizionari taxonomy_codes.
+
+    Example:
+        >>> diff_taxonomy_codes({"TT:MA": ["TT:MA_RA"]}, {"TT:MA": ["TT:MA_WO"]})
+        {'added': {'TT:MA': ['TT:MA_WO']}, 'removed': {'TT:MA': ['TT:MA_RA']}}
+    """
+    added: Dict[str, List[str]] = {}
+    removed: Dict[str, List[str]] = {}
+    replaced: Dict[str, List[str]] = {}
+    keys_removed: List[str] = []
+
+    for key in list(old) + [k for k in new if k not in old]:
+        before = old.get(key, [])
+        after = new.get(key, [])
+        if key in old and key in new and before == after:
+            continue
+
+        plus = [code for code in after if code not in before]
+        minus = [code for code in before if code not in after]
+        if plus:
+            added[key] = plus
+        if minus:
+            removed[key] = minus
+        if key not in new:
+            keys_removed.append(key)
+        elif [code for code in before if code not in minus] + plus != after:
+            # Riordino o duplicati: la lista completa garantisce una ricostruzione esatta
+            replaced[key] = list(after)
+
+    diff: Dict[str, Any] = {}
+    if added:
+        diff["added"] = added
+    if removed:
+        diff["removed"] = removed
+    if replaced:
+        diff["replaced"] = replaced
+    if keys_removed:
+        diff["keys_removed"] = keys_removed
+    return diff
+
+
+def diff_code_details(old: Dict[str, str], new: Dict[str, str]) -> Dict[str, Any]:
+    """Note per codice impostate/modificate e codici le cui note sono state rimosse"""
+    diff: Dict[str, Any] = {}
+    changed = {code: text for code, text in new.items() if old.get(code) != text}
+    unset = [code for code in old if code not in new]
+    if changed:
+        diff["set"] = changed
+    if unset:
+        diff["unset"] = unset
+    return diff
+
+
+def diff_states(old: Dict[str, Any], new: Dict[str, Any]) -> Dict[str, Any]:
+    """Diff compatto tra due stati (solo i campi cambiati)"""
+    changes: Dict[str, Any] = {}
+    for field in TRACKED_FIELDS:
+        before, after = old.get(field), new.get(field)
+        if field == "taxonomy_codes":
+            diff = diff_taxonomy_codes(before or {}, after or {})
+        elif field == "code_details":
+            diff = diff_code_details(before or {}, after or {})
+        else:
+            diff = {"set": after} if before != after else {}
+        if diff:
+            changes[field] = diff
+    return changes
+
+
+def apply_changes(state: Dict[str, Any], changes: Dict[str, Any]) -> Dict[str, Any]:
+    """Applica un diff prodotto da diff_states a uno stato (in place)"""
+    for field, diff in changes.items():
+        if field == "taxonomy_codes":
+            codes = state.get(field) or {}
+            for key, minus in diff.get("removed", {}).items():
+                codes[key] = [code for code in codes.get(key, []) if code not in minus]
+            for key, plus in diff.get("added", {}).items():
+                codes[key] = codes.get(key, []) + plus
+            for key, full in diff.get("replaced", {}).items():
+                codes[key] = list(full)
+            for key in diff.get("keys_removed", []):
+                codes.pop(key, None)
+            state[field] = codes
+        elif field == "code_details":
+            details = state.get(field) or {}
+            details.update(diff.get("set", {}))
+            for code in diff.get("unset", []):
+                details.pop(code, None)
+            state[field] = details
+        else:
+            state[field] = diff["set"]
+    return state
+
+
+class RevisionService:
+    """Registrazione e ricostruzione delle revisioni di un incidente"""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def _insert(
+        self,
+        incident_id: str,
+        revision: int,
+        operation: str,
+        changes: Dict[str, Any],
+        author: Optional[str],
+        created_at: datetime,
+        state: Optional[Dict[str, Any]] = None,
+        doc_created_at: Optional[datetime] = None,
+    ) -> None:
+        record: Dict[str, Any] = {
+            "_id": f"{incident_id}:{revision}",
+            "incident_id": incident_id,
+            "revision": revision,
+            "operation": operation,
+            "changes": changes,
+            "author": author,
+            "created_at": created_at,
+        }
+        if state is not None:
+            record["checkpoint"] = {**state, "created_at": doc_created_at}
+        await self.collection.insert_one(record)
+
+    async def record_create(self, doc: Dict[str, Any], author: Optional[str] = None) -> None:
+        """Revisione 1: il checkpoint contiene già tutto lo stato, nessun diff"""
+        state = _tracked_state(doc)
+        await self._insert(
+            doc["_id"], doc.get("revision", 1), "create", {}, author,
+            doc["updated_at"], state=state, doc_created_at=doc["created_at"],
+        )
+
+    async def record_update(self, before: Dict[str, Any], after: Dict[str, Any], author: Optional[str] = None) -> None:
+        """Registra il diff tra il documento prima e dopo un update"""
+        incident_id = after["_id"]
+        revision = after["revision"]
+        if "revision" not in before:
+            # Incidente precedente allo storico: revisione 0 di riferimento
+            await self._insert(
+                incident_id, 0, "baseline", {}, None, before.get("updated_at") or before["created_at"],
+                state=_tracked_state(before), doc_created_at=before["created_at"],
+            )
+
+        old_state, new_state = _tracked_state(before), _tracked_state(after)
+        checkpoint = new_state if revision % REVISION_CHECKPOINT_INTERVAL == 0 else None
+        await self._insert(
+            incident_id, revision, "update", diff_states(old_state, new_state), author,
+            after["updated_at"], state=checkpoint, doc_created_at=after["created_at"],
+        )
+
+    async def record_delete(self, before: Dict[str, Any], author: Optional[str] = None) -> None:
+        """Registra l'eliminazione (lo stato precedente resta ricostruibile)"""
+        incident_id = before["_id"]
+        if "revision" not in before:
+            await self._insert(
+                incident_id, 0, "baseline", {}, None, before.get("updated_at") or before["created_at"],
+                state=_tracked_state(before), doc_created_at=before["created_at"],
+            )
+        await self._insert(
+            incident_id, before.get("revision", 0) + 1, "delete", {}, author, datetime.utcnow(),
+        )
+
+    async def list_revisions(self, incident_id: str, skip: int = 0, limit: int = 50) -> List[Dict[str, Any]]:
+        """Revisioni di un incidente, dalla più recente, senza i checkpoint"""
+        cursor = (
+            self.collection.find({"incident_id": incident_id}, {"checkpoint": 0})
+            .sort("revision", -1).skip(skip).limit(limit)
+        )
+        return await cursor.to_list(length=None)
+
+    async def resolve_revision(self, incident_id: str, as_of: datetime) -> Optional[Dict[str, Any]]:
+        """Ultima revisione registrata entro as_of ({revision, operation}), None se nessuna"""
+        return await self.collection.find_one(
+            {"incident_id": incident_id, "created_at": {"$lte": as_of}},
+            {"revision": 1, "operation": 1},
+            sort=[("revision", -1)],
+        )
+
+    async def has_history(self, incident_id: str) -> bool:
+        """True se per l'incidente è stata registrata almeno una revisione"""
+        return await self.collection.find_one({"incident_id": incident_id}, {"_id": 1}) is not None
+
+    async def reconstruct(self, incident_id: str, revision: int) -> Optional[Dict[str, Any]]:
+        """
+        Ricostruisce il documento incidente a una revisione.
+
+        Per una revisione di eliminazione ritorna lo stato immediatamente
+        precedente. None se la revisione non esiste.
+
+        Returns:
+            Documento nel formato MongoDB (_id, campi, derivati, revision)
+        """
+        checkpoint = await self.collection.find_one(
+            {"incident_id": incident_id, "revision": {"$lte": revision}, "checkpoint": {"$exists": True}},
+            sort=[("revision", -1)],
+        )
+        if checkpoint is None:
+            return None
+
+        records = await self.collection.find(
+            {"incident_id": incident_id, "revision": {"$gt": checkpoint["revision"], "$lte": revision}},
+            {"checkpoint": 0},
+        ).sort("revision", 1).to_list(length=None)
+        if revision != checkpoint["revision"] and (not records or records[-1]["revision"] != revision):
+            return None
+
+        snapshot = checkpoint["checkpoint"]
+        state = {field: snapshot.get(field) for field in TRACKED_FIELDS}
+        updated_at = checkpoint["created_at"]
+        for record in records:
+            if record["operation"] == "delete":
+                break
+            apply_changes(state, record["changes"])
+            updated_at = record["created_at"]
+
+        doc = {"_id": incident_id, **state}
+        doc.update(build_denormalized_fields(doc))
+        doc["created_at"] = snapshot.get("created_at") or checkpoint["created_at"]
+        doc["updated_at"] = updated_at
+        doc["revision"] = revision
+        return doc
@@ -0,0 +1,143 @@
+"""
+Ricerca full-text sugli incidenti (indice testuale MongoDB + label tassonomia)
+"""
+import html
+import re
+from typing import Any, Dict, List, Optional
+
+from app.services.taxonomy_service import taxonomy_service
+
+# Ampiezza (caratteri) del contesto attorno al primo match negli snippet
+SNIPPET_CONTEXT = 60
+
+# Campi proiettati: solo ciò che serve per ranking e snippet
+SEARCH_PROJECTION = {
+    "title": 1,
+    "description": 1,
+    "notes": 1,
+    "code_details": 1,
+    "all_codes": 1,
+    "created_at": 1,
+    "score": {"$meta": "textScore"},
+}
+
+
+def build_text_query(q: str, label_codes: List[str]) -> Dict[str, Any]:
+    """
+    Costruisce la query di ricerca.
+
+    Combina l'indice testuale con i codici la cui label corrisponde ai
+    termini cercati (via indice multikey su all_codes): entrambe le
+    clausole del $or sono indicizzate, requisito di MongoDB per $text.
+
+    Args:
+        q: Testo cercato
+        label_codes: Codici tassonomia le cui label corrispondono alla ricerca
+
+    Returns:
+        Filtro MongoDB
+    """
+    text_clause = {"$text": {"$search": q}}
+    if not label_codes:
+        return text_clause
+    return {"$or": [text_clause, {"all_codes": {"$in": label_codes}}]}
+
+
+def _search_terms(q: str) -> List[str]:
+    """Estrae i termini da evidenziare (frasi tra virgolette incluse, negazioni escluse)"""
+    phrases = re.findall(r'"([^"]+)"', q)
+    words = [w for w in re.sub(r'"[^"]*"', " ", q).split() if not w.startswith("-")]
+    return [t for t in phrases + words if t]
+
+
+def _highlight(text: str, terms: List[str]) -> Optional[str]:
+    """Ritorna uno snippet attorno al primo termine trovato, con i match in <mark>"""
+    if not text or not terms:
+        return None
+
+    pattern = re.compile("|".join(re.escape(t) for t in terms), re.IGNORECASE)
+    match = pattern.search(text)
+    if not match:
+        return None
+
+    start = max(0, match.start() - SNIPPET_CONTEXT)
+    end = min(len(text), match.end() + SNIPPET_CONTEXT)
+    fragment = html.escape(text[start:end])
+    fragment = re.sub(
+        "|".join(re.escape(html.escape(t)) for t in terms),
+        lambda m: f"<mark>{m.group(0)}</mark>",
+        fragment,
+        flags=re.IGNORECASE,
+    )
+    prefix = "…" if start > 0 else ""
+    suffix = "…" if end < len(text) else ""
+    return f"{prefix}{fragment}{suffix}"
+
+
+def build_search_hit(doc: Dict[str, Any], q: str, label_codes: List[str]) -> Dict[str, Any]:
+    """
+    Trasforma un documento in un risultato di ricerca con snippet evidenziati.
+
+    Args:
+        doc: Documento proiettato con SEARCH_PROJECTION
+        q: Testo cercato
+        label_codes: Codici tassonomia le cui label corrispondono alla ricerca
+
+    Returns:
+        Dict con id, titolo, score, snippet e codici corrispondenti
+    """
+    terms = _search_terms(q)
+
+    snippets = []
+    for field in ("title", "description", "notes"):
+        snippet = _highlight(doc.get(field) or "", terms)
+        if snippet:
+            snippets.append({"field": field, "text": snippet})
+    for code, detail in (doc.get("code_details") or {}).items():
+        snippet = _highlight(detail or "", terms)
+        if snippet:
+            snippets.append({"field": f"code_details.{code}", "text": snippet})
+
+    label_set = set(label_codes)
+    return {
+        "id": doc["_id"],
+        "title": doc["title"],
+        "created_at": doc["created_at"],
+        "score": round(doc.get("score") or 0.0, 4),
+        "snippets": snippets,
+        "matched_codes": [c for c in doc.get("all_codes") or [] if c in label_set],
+    }
+
+
+async def search_incidents_text(collection, q: str, page: int = 1, page_size: int = 20) -> Dict[str, Any]:
+    """
+    Esegue la ricerca full-text paginata, ordinata per rilevanza.
+
+    Args:
+        collection: Collezione MongoDB degli incidenti
+        q: Testo cercato (sintassi $text: frasi tra virgolette, -esclusioni)
+        page: Pagina (1-based)
+        page_size: Risultati per pagina
+
+    Returns:
+        Dict con totale e risultati della pagina richiesta
+    """
+    label_codes = taxonomy_service.find_codes_by_label(q)
+    query = build_text_query(q, label_codes)
+
+    total = await collection.count_documents(query)
+    cursor = (
+        collection.find(query, SEARCH_PROJECTION)
+        .sort([("score", {"$meta": "textScore"}), ("created_at", -1)])
+        .skip((page - 1) * page_size)
+        .limit(page_size)
+    )
+    docs = await cursor.to_list(length=page_size)
+
+    return {
+        "query": q,
+        "total": total,
+        "page": page,
+        "page_size": page_size,
+        "results": [build_search_hit(doc, q, label_codes) for doc in docs],
+    }
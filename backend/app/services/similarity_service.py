@@ -0,0 +1,233 @@
+"""
+Ricerca di incidenti simili sui vettori di codici tassonomia
+
+Ogni incidente è codificato come bitset (un bit per codice dell'universo ACN)
+e le righe sono impacchettate in una matrice NumPy: una ricerca è un AND
+vettoriale + popcount su tutte le righe, pochi millisecondi anche con
+centinaia di migliaia di incidenti.
+"""
+import asyncio
+from typing import Any, Dict, Iterable, List, Literal, Optional
+
+import numpy as np
+
+from app.services.taxonomy_service import taxonomy_service
+from app.utils.taxonomy_helpers import extract_all_codes_from_taxonomy_dict
+
+SimilarityMetric = Literal["jaccard", "cosine"]
+
+if hasattr(np, "bitwise_count"):
+    def _popcount_rows(bits: np.ndarray) -> np.ndarray:
+        return np.bitwise_count(bits).sum(axis=1, dtype=np.int32)
+else:
+    _POPCOUNT_LUT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+    def _popcount_rows(bits: np.ndarray) -> np.ndarray:
+        return _POPCOUNT_LUT[bits].sum(axis=1, dtype=np.int32)
+
+
+class SimilarityIndex:
+    """
+    Indice in memoria di bitset di codici, aggiornato in modo incrementale.
+
+    Le righe occupate sono sempre le prime len(self) della matrice: la
+    rimozione sposta l'ultima riga nel buco lasciato libero.
+    """
+
+    def __init__(self, universe: Iterable[str], initial_capacity: int = 1024):
+        self.universe: List[str] = sorted(universe)
+        self._position = {code: i for i, code in enumerate(self.universe)}
+        self._n_bytes = max(1, (len(self.universe) + 7) // 8)
+        self._bits = np.zeros((initial_capacity, self._n_bytes), dtype=np.uint8)
+        self._sizes = np.zeros(initial_capacity, dtype=np.int32)
+        self._ids: List[str] = []
+        self._row_of: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def encode(self, codes: Iterable[str]) -> np.ndarray:
+        """Codifica un insieme di codici come bitset impacchettato (codici sconosciuti ignorati)"""
+        dense = np.zeros(self._n_bytes * 8, dtype=bool)
+        for code in codes:
+            pos = self._position.get(code)
+            if pos is not None:
+                dense[pos] = True
+        return np.packbits(dense)
+
+    def decode(self, bits: np.ndarray) -> List[str]:
+        """Ritorna i codici corrispondenti ai bit impostati"""
+        dense = np.unpackbits(bits)[:len(self.universe)]
+        return [self.universe[i] for i in np.flatnonzero(dense)]
+
+    def _grow(self) -> None:
+        capacity = self._bits.shape[0] * 2
+        bits = np.zeros((capacity, self._n_bytes), dtype=np.uint8)
+        bits[:len(self)] = self._bits[:len(self)]
+        sizes = np.zeros(capacity, dtype=np.int32)
+        sizes[:len(self)] = self._sizes[:len(self)]
+        self._bits, self._sizes = bits, sizes
+
+    def upsert(self, incident_id: str, codes: Iterable[str]) -> None:
+        """Inserisce o aggiorna il vettore di un incidente"""
+        row = self._row_of.get(incident_id)
+        if row is None:
+            if len(self) == self._bits.shape[0]:
+                self._grow()
+            row = len(self)
+            self._ids.append(incident_id)
+            self._row_of[incident_id] = row
+
+        vector = self.encode(codes)
+        self._bits[row] = vector
+        self._sizes[row] = int(_popcount_rows(vector[np.newaxis, :])[0])
+
+    def remove(self, incident_id: str) -> None:
+        """Rimuove un incidente dall'indice (no-op se assente)"""
+        row = self._row_of.pop(incident_id, None)
+        if row is None:
+            return
+
+        last = len(self) - 1
+        if row != last:
+            moved_id = self._ids[last]
+            self._bits[row] = self._bits[last]
+            self._sizes[row] = self._sizes[last]
+            self._ids[row] = moved_id
+            self._row_of[moved_id] = row
+        self._ids.pop()
+        self._bits[last] = 0
+        self._sizes[last] = 0
+
+    def query(
+        self,
+        codes: Iterable[str],
+        k: int = 10,
+        metric: SimilarityMetric = "jaccard",
+        exclude_id: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Ritorna i k incidenti più simili all'insieme di codici.
+
+        Args:
+            codes: Codici dell'incidente di riferimento
+            k: Numero massimo di risultati
+            metric: "jaccard" o "cosine"
+            exclude_id: Incidente da escludere (tipicamente quello di riferimento)
+
+        Returns:
+            Lista di {id, score, shared_codes} ordinata per score decrescente
+        """
+        n = len(self)
+        vector = self.encode(codes)
+        query_size = int(_popcount_rows(vector[np.newaxis, :])[0])
+        if n == 0 or query_size == 0:
+            return []
+
+        common = self._bits[:n] & vector
+        intersection = _popcount_rows(common)
+        sizes = self._sizes[:n]
+
+        if metric == "cosine":
+            denominator = np.sqrt(sizes.astype(np.float64) * query_size)
+        else:
+            denominator = (sizes + query_size - intersection).astype(np.float64)
+        scores = np.divide(
+            intersection, denominator,
+            out=np.zeros(n, dtype=np.float64), where=denominator > 0,
+        )
+
+        if exclude_id is not None and exclude_id in self._row_of:
+            scores[self._row_of[exclude_id]] = 0.0
+
+        k = min(k, n)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+
+        return [
+            {
+                "id": self._ids[row],
+                "score": round(float(scores[row]), 4),
+                "shared_codes": self.decode(common[row]),
+            }
+            for row in top
+            if scores[row] > 0
+        ]
+
+
+def _doc_codes(doc: Dict[str, Any]) -> List[str]:
+    """Codici di un documento: all_codes denormalizzato o flatten di taxonomy_codes"""
+    if doc.get("all_codes") is not None:
+        return doc["all_codes"]
+    return extract_all_codes_from_taxonomy_dict(doc.get("taxonomy_codes") or {})
+
+
+async def build_similarity_index(collection, archive=None) -> SimilarityIndex:
+    """
+    Costruisce l'indice leggendo i soli codici di tutti gli incidenti.
+
+    Con archive include anche gli incidenti archiviati (all_codes è in chiaro
+    nel documento di archivio).
+    """
+    index = SimilarityIndex(taxonomy_service.get_code_index().keys())
+    if archive is not None:
+        async for doc in archive.find({}, {"all_codes": 1}):
+            index.upsert(doc["_id"], _doc_codes(doc))
+    async for doc in collection.find({}, {"all_codes": 1, "taxonomy_codes": 1}):
+        index.upsert(doc["_id"], _doc_codes(doc))
+    return index
+
+
+# Indice del processo corrente, costruito nel lifespan dell'app
+similarity_index = SimilarityIndex(taxonomy_service.get_code_index().keys())
+
+# Scritture avvenute durante una ricostruzione, da riapplicare al nuovo indice
+_pending_writes: Optional[List[tuple]] = None
+
+# Una ricostruzione alla volta: due ricostruzioni concorrenti si
+# sostituirebbero a vicenda la lista delle scritture in sospeso
+_rebuild_lock = asyncio.Lock()
+
+
+async def load_similarity_index(collection, archive=None) -> None:
+    """
+    (Ri)costruisce l'indice a parte e lo sostituisce in blocco a quello corrente.
+
+    Le scritture arrivate durante la costruzione vengono riapplicate al nuovo
+    indice subito prima dello scambio, senza await in mezzo: nessuna scrittura
+    può finire solo nell'indice vecchio.
+    """
+    global similarity_index, _pending_writes
+    async with _rebuild_lock:
+        _pending_writes = []
+        try:
+            index = await build_similarity_index(collection, archive)
+            for incident_id, codes in _pending_writes:
+                if codes is None:
+                    index.remove(incident_id)
+                else:
+                    index.upsert(incident_id, codes)
+            similarity_index = index
+        finally:
+            _pending_writes = None
+    print(f"Similarity index: {len(similarity_index)} incidenti")
+
+
+def get_similarity_index() -> SimilarityIndex:
+    """Ritorna l'indice corrente"""
+    return similarity_index
+
+
+def index_incident(doc: Dict[str, Any]) -> None:
+    """Aggiorna l'indice dopo la scrittura di un incidente"""
+    codes = _doc_codes(doc)
+    similarity_index.upsert(doc["_id"], codes)
+    if _pending_writes is not None:
+        _pending_writes.append((doc["_id"], codes))
+
+
+def unindex_incident(incident_id: str) -> None:
+    """Rimuove un incidente eliminato dall'indice"""
+    similarity_index.remove(incident_id)
+    if _pending_writes is not None:
+        _pending_writes.append((incident_id, None))
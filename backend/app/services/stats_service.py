@@ -0,0 +1,156 @@
+"""
+Statistiche aggregate sugli incidenti per dashboard e reportistica
+"""
+import os
+from datetime import datetime
+from typing import Any, Dict, List
+
+from app.services.taxonomy_service import taxonomy_service
+from app.utils.cache import TTLCache
+
+# TTL breve: le dashboard restano economiche anche con molti utenti,
+# le scritture invalidano comunque la cache esplicitamente
+STATS_CACHE_TTL = float(os.getenv("STATS_CACHE_TTL", "30"))
+
+_stats_cache = TTLCache(ttl=STATS_CACHE_TTL, maxsize=32)
+
+# Incrementata a ogni invalidazione: un calcolo iniziato prima non salva il risultato
+_generation = 0
+
+
+def _flatten_codes_expression() -> Dict[str, Any]:
+    """
+    Espressione di aggregazione che ritorna la lista piatta dei codici.
+
+    Usa il campo denormalizzato all_codes; per i documenti non ancora
+    migrati appiattisce taxonomy_codes al volo.
+    """
+    return {
+        "$ifNull": [
+            "$all_codes",
+            {
+                "$reduce": {
+                    "input": {"$objectToArray": {"$ifNull": ["$taxonomy_codes", {}]}},
+                    "initialValue": [],
+                    "in": {"$concatArrays": ["$$value", "$$this.v"]},
+                }
+            },
+        ]
+    }
+
+
+def build_stats_pipeline(top: int = 10) -> List[Dict[str, Any]]:
+    """
+    Costruisce la pipeline di aggregazione per le statistiche.
+
+    Un unico passaggio sulla collezione: i codici vengono appiattiti una sola
+    volta e le diverse viste sono calcolate in parallelo con $facet.
+
+    Args:
+        top: Numero massimo di codici da ritornare in top_codes
+
+    Returns:
+        Pipeline MongoDB
+    """
+    return [
+        {"$project": {"created_at": 1, "codes": _flatten_codes_expression()}},
+        {"$addFields": {
+            # Severity = primo codice BC:SE (stessa regola di IncidentSummary)
+            "severity": {"$arrayElemAt": [
+                {"$filter": {
+                    "input": "$codes",
+                    "cond": {"$eq": [{"$substrCP": ["$$this", 0, 6]}, "BC:SE_"]},
+                }},
+                0,
+            ]},
+        }},
+        {"$facet": {
+            "total": [{"$count": "count"}],
+            "by_severity": [
+                {"$group": {"_id": "$severity", "count": {"$sum": 1}}},
+                {"$sort": {"count": -1, "_id": 1}},
+            ],
+            "by_threat_type": [
+                {"$unwind": "$codes"},
+                {"$match": {"codes": {"$regex": "^TT:"}}},
+                {"$group": {"_id": "$codes", "count": {"$sum": 1}}},
+                {"$sort": {"count": -1, "_id": 1}},
+            ],
+            "by_month": [
+                {"$group": {
+                    "_id": {"$dateToString": {"format": "%Y-%m", "date": "$created_at"}},
+                    "count": {"$sum": 1},
+                }},
+                {"$sort": {"_id": 1}},
+            ],
+            "top_codes": [
+                {"$unwind": "$codes"},
+                {"$group": {"_id": "$codes", "count": {"$sum": 1}}},
+                {"$sort": {"count": -1, "_id": 1}},
+                {"$limit": top},
+            ],
+        }},
+    ]
+
+
+def _with_labels(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Arricchisce i conteggi per codice con label e macrocategoria dalla tassonomia"""
+    enriched = []
+    for row in rows:
+        code = row["_id"]
+        info = taxonomy_service.get_code_info(code) if code else None
+        enriched.append({
+            "code": code,
+            "label": info.get("label") if info else None,
+            "macro": info.get("macro") if info else None,
+            "count": row["count"],
+        })
+    return enriched
+
+
+async def compute_incident_stats(collection, top: int = 10) -> Dict[str, Any]:
+    """
+    Calcola (o ritorna dalla cache) le statistiche aggregate sugli incidenti.
+
+    Args:
+        collection: Collezione MongoDB degli incidenti
+        top: Numero massimo di codici in top_codes
+
+    Returns:
+        Dict con totale, conteggi per severity, threat type, mese e top codici
+    """
+    # La versione della tassonomia è nella chiave: le label cambiano con un reload
+    cache_key = ("stats", top, taxonomy_service.version)
+    cached = _stats_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    generation = _generation
+    cursor = collection.aggregate(build_stats_pipeline(top))
+    result = (await cursor.to_list(length=1) or [{}])[0]
+
+    total = result.get("total") or [{"count": 0}]
+    stats = {
+        "total": total[0]["count"],
+        "by_severity": _with_labels(result.get("by_severity", [])),
+        "by_threat_type": _with_labels(result.get("by_threat_type", [])),
+        "by_month": [
+            {"month": row["_id"], "count": row["count"]}
+            for row in result.get("by_month", [])
+            if row["_id"]
+        ],
+        "top_codes": _with_labels(result.get("top_codes", [])),
+        "generated_at": datetime.utcnow(),
+    }
+
+    # Una scrittura durante l'aggregazione rende il risultato potenzialmente vecchio
+    if generation == _generation:
+        _stats_cache.set(cache_key, stats)
+    return stats
+
+
+def invalidate_stats_cache() -> None:
+    """Invalida le statistiche in cache (da chiamare dopo ogni scrittura)"""
+    global _generation
+    _generation += 1
+    _stats_cache.invalidate()
@@ -0,0 +1,157 @@
+"""
+Export STIX 2.1 degli incidenti
+
+Ogni incidente diventa:
+- un oggetto incident (codici ACN come labels e external_references)
+- una note con note generali e dettagli per codice (se presenti)
+- un grouping che raccoglie incident e note
+
+Gli ID STIX sono deterministici (derivati dall'ID incidente), così
+export successivi dello stesso incidente aggiornano gli stessi oggetti
+nella piattaforma che li importa.
+
+Per l'export multi-incidente il bundle è prodotto a pezzi da un cursore
+MongoDB (stream_stix_bundle), senza tenerlo tutto in memoria.
+"""
+import json
+import os
+import uuid
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List
+
+STIX_IDENTITY_NAME = os.getenv("STIX_IDENTITY_NAME", os.getenv("MISP_FEED_ORG_NAME", "ICE"))
+
+_NAMESPACE = uuid.UUID("5b3b5c2e-7c7a-4b8e-9f61-0d3f0a6e1c2a")
+_SOURCE_NAME = "ACN Taxonomy"
+
+
+def _stix_id(object_type: str, *parts: str) -> str:
+    return f"{object_type}--{uuid.uuid5(_NAMESPACE, ':'.join(parts))}"
+
+
+def _timestamp(value: datetime) -> str:
+    """Timestamp STIX (UTC, millisecondi, suffisso Z)"""
+    return value.strftime("%Y-%m-%dT%H:%M:%S.") + f"{value.microsecond // 1000:03d}Z"
+
+
+def identity_object() -> Dict[str, Any]:
+    """Identity del produttore, referenziata da created_by_ref"""
+    return {
+        "type": "identity",
+        "spec_version": "2.1",
+        "id": _stix_id("identity", STIX_IDENTITY_NAME),
+        "created": "2024-01-01T00:00:00.000Z",
+        "modified": "2024-01-01T00:00:00.000Z",
+        "name": STIX_IDENTITY_NAME,
+        "identity_class": "organization",
+    }
+
+
+def incident_to_stix(incident: Dict[str, Any], taxonomy_service) -> List[Dict[str, Any]]:
+    """
+    Converte un incidente negli oggetti STIX (incident, note, grouping).
+
+    Args:
+        incident: Documento o dump dell'incidente (id o _id)
+        taxonomy_service: Servizio tassonomia per label e gerarchia dei codici
+
+    Returns:
+        Lista di oggetti STIX, senza identity
+    """
+    incident_id = incident.get("id") or incident["_id"]
+    created = _timestamp(incident["created_at"])
+    modified = _timestamp(incident.get("updated_at") or incident["created_at"])
+    identity_id = _stix_id("identity", STIX_IDENTITY_NAME)
+    code_index = taxonomy_service.get_code_index()
+    taxonomy_codes = incident.get("taxonomy_codes") or {}
+
+    labels: List[str] = []
+    references: List[Dict[str, str]] = []
+    for codes in taxonomy_codes.values():
+        for code in codes:
+            info = code_index.get(code, {})
+            labels.append(code)
+            reference = {"source_name": _SOURCE_NAME, "external_id": code}
+            if info.get("label"):
+                hierarchy = " / ".join(
+                    part for part in (info.get("macro_name"), info.get("predicate_name"), info.get("subpredicate_name"))
+                    if part
+                )
+                reference["description"] = f"{hierarchy}: {info['label']}" if hierarchy else info["label"]
+            references.append(reference)
+
+    common = {
+        "spec_version": "2.1",
+        "created": created,
+        "modified": modified,
+        "created_by_ref": identity_id,
+    }
+    incident_object: Dict[str, Any] = {
+        "type": "incident",
+        "id": f"incident--{incident_id}",
+        **common,
+        "name": incident.get("title") or "Incident",
+        "labels": labels,
+        "external_references": references,
+        "x_acn_taxonomy_codes": taxonomy_codes,
+    }
+    if incident.get("description"):
+        incident_object["description"] = incident["description"]
+    if incident.get("tags"):
+        incident_object["x_ice_tags"] = incident["tags"]
+    objects = [incident_object]
+
+    note_lines = []
+    if incident.get("notes"):
+        note_lines.append(incident["notes"])
+    for code, detail in (incident.get("code_details") or {}).items():
+        if detail:
+            note_lines.append(f"{code}: {detail}")
+    if note_lines:
+        objects.append({
+            "type": "note",
+            "id": _stix_id("note", incident_id),
+            **common,
+            "abstract": "Note e dettagli per codice",
+            "content": "\n".join(note_lines),
+            "object_refs": [incident_object["id"]],
+        })
+
+    objects.append({
+        "type": "grouping",
+        "id": _stix_id("grouping", incident_id),
+        **common,
+        "name": incident_object["name"],
+        "context": "suspicious-activity",
+        "object_refs": [obj["id"] for obj in objects],
+    })
+    return objects
+
+
+def build_stix_bundle(incident: Dict[str, Any], taxonomy_service) -> Dict[str, Any]:
+    """Bundle STIX completo per un singolo incidente"""
+    objects = incident_to_stix(incident, taxonomy_service)
+    return {
+        "type": "bundle",
+        # Deterministico: lo stesso stato dell'incidente produce lo stesso bundle
+        "id": _stix_id("bundle", objects[0]["id"], objects[0]["modified"]),
+        "objects": [identity_object(), *objects],
+    }
+
+
+async def stream_stix_bundle(cursor, taxonomy_service) -> AsyncIterator[bytes]:
+    """
+    Produce un bundle STIX a pezzi a partire da un cursore di incidenti.
+
+    Ogni incidente viene serializzato appena letto dal cursore: la memoria
+    usata non dipende dal numero di incidenti esportati.
+    """
+    yield f'{{"type":"bundle","id":"bundle--{uuid.uuid4()}","objects":['.encode("utf-8")
+    yield json.dumps(identity_object(), ensure_ascii=False).encode("utf-8")
+    async for doc in cursor:
+        chunk = "".join(
+            "," + json.dumps(obj, ensure_ascii=False, default=str)
+            for obj in incident_to_stix(doc, taxonomy_service)
+        )
+        yield chunk.encode("utf-8")
+    yield b"]}"
@@ -0,0 +1,233 @@
+"""
+Export tabellare degli incidenti per analisi (pandas, strumenti BI)
+
+Due layout:
+- long: una riga per coppia incidente/codice, con macro, predicato,
+  subpredicato e label dalla tassonomia
+- wide: una riga per incidente, una colonna 0/1 per ogni codice della
+  tassonomia (one-hot)
+
+Due formati:
+- CSV, prodotto a blocchi di righe
+- Parquet, scritto a row group (richiede il pacchetto opzionale pyarrow)
+
+In entrambi i casi le righe sono generate man mano dal cursore MongoDB.
+pyarrow viene importato solo al primo export Parquet: pesa sull'avvio dei
+worker che non lo usano.
+"""
+import csv
+import importlib.util
+import io
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Tuple
+
+TABLE_LAYOUTS = ("long", "wide")
+TABLE_FORMATS = ("csv", "parquet")
+
+CSV_CHUNK_ROWS = 1000
+PARQUET_ROW_GROUP_ROWS = 10_000
+
+_INCIDENT_COLUMNS = ["incident_id", "title", "created_at", "updated_at", "severity"]
+LONG_COLUMNS = _INCIDENT_COLUMNS + [
+    "taxonomy_key", "code", "label", "macro", "macro_name",
+    "predicate", "predicate_name", "subpredicate", "subpredicate_name", "detail",
+]
+
+# Solo i campi necessari alla tabella
+TABLE_PROJECTION = {"title": 1, "created_at": 1, "updated_at": 1, "taxonomy_codes": 1, "code_details": 1}
+
+
+def parquet_available() -> bool:
+    """pyarrow è installato (verificato senza importarlo)"""
+    return importlib.util.find_spec("pyarrow") is not None
+
+
+def _pyarrow():
+    """Ritorna (pyarrow, pyarrow.parquet) importandoli al primo utilizzo"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("L'export Parquet richiede il pacchetto 'pyarrow'")
+    return pa, pq
+
+
+def _incident_values(doc: Dict[str, Any]) -> List[Any]:
+    severity = (doc.get("taxonomy_codes") or {}).get("BC:SE") or [None]
+    return [doc["_id"], doc.get("title"), doc.get("created_at"), doc.get("updated_at"), severity[0]]
+
+
+class TableLayout:
+    """Colonne e righe di un layout, a partire dall'indice dei codici della tassonomia"""
+
+    def __init__(self, layout: str, code_index: Dict[str, Dict[str, Any]]):
+        if layout not in TABLE_LAYOUTS:
+            raise ValueError(f"Layout non supportato: {layout}")
+        self.layout = layout
+        self.code_index = code_index
+        if layout == "long":
+            self.columns = LONG_COLUMNS
+        else:
+            self.codes = sorted(code_index)
+            self._positions = {code: i for i, code in enumerate(self.codes)}
+            self.columns = _INCIDENT_COLUMNS + self.codes
+
+    def rows(self, doc: Dict[str, Any]) -> Iterable[List[Any]]:
+        """Righe della tabella per un documento incidente"""
+        base = _incident_values(doc)
+        taxonomy_codes = doc.get("taxonomy_codes") or {}
+
+        if self.layout == "wide":
+            flags = [0] * len(self.codes)
+            for codes in taxonomy_codes.values():
+                for code in codes:
+                    position = self._positions.get(code)
+                    if position is not None:
+                        flags[position] = 1
+            yield base + flags
+            return
+
+        details = doc.get("code_details") or {}
+        for taxonomy_key, codes in taxonomy_codes.items():
+            for code in codes:
+                info = self.code_index.get(code, {})
+                yield base + [
+                    taxonomy_key, code, info.get("label"), info.get("macro"), info.get("macro_name"),
+                    info.get("predicate"), info.get("predicate_name"),
+                    info.get("subpredicate"), info.get("subpredicate_name"), details.get(code),
+                ]
+
+    def arrow_schema(self):
+        """Schema Parquet (timestamp per le date, bool per le colonne one-hot)"""
+        pa, _ = _pyarrow()
+        fields = [
+            pa.field("incident_id", pa.string()),
+            pa.field("title", pa.string()),
+            pa.field("created_at", pa.timestamp("ms")),
+            pa.field("updated_at", pa.timestamp("ms")),
+            pa.field("severity", pa.string()),
+        ]
+        if self.layout == "long":
+            fields += [pa.field(name, pa.string()) for name in LONG_COLUMNS[len(_INCIDENT_COLUMNS):]]
+        else:
+            fields += [pa.field(code, pa.bool_()) for code in self.codes]
+        return pa.schema(fields)
+
+
+async def _row_batches(cursor, layout: TableLayout, size: int) -> AsyncIterator[List[List[Any]]]:
+    batch: List[List[Any]] = []
+    async for doc in cursor:
+        batch.extend(layout.rows(doc))
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def stream_csv(cursor, layout: TableLayout, chunk_rows: int = CSV_CHUNK_ROWS) -> AsyncIterator[bytes]:
+    """CSV con intestazione, prodotto a blocchi di chunk_rows righe"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(layout.columns)
+    async for batch in _row_batches(cursor, layout, chunk_rows):
+        writer.writerows(batch)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+class _ChunkSink(io.RawIOBase):
+    """File-like di sola scrittura che accumula i byte fino al drain successivo"""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _arrow_table(schema, batch: List[List[Any]]):
+    pa, _ = _pyarrow()
+    columns = list(zip(*batch))
+    arrays = []
+    for field, values in zip(schema, columns):
+        if pa.types.is_boolean(field.type):
+            values = [bool(v) for v in values]
+        arrays.append(pa.array(values, type=field.type))
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+async def stream_parquet(
+    cursor, layout: TableLayout, row_group_rows: int = PARQUET_ROW_GROUP_ROWS,
+) -> AsyncIterator[bytes]:
+    """
+    Parquet scritto un row group alla volta; i byte di ogni row group sono
+    inviati appena scritti (il footer con i metadati arriva alla fine).
+    """
+    _, pq = _pyarrow()
+    schema = layout.arrow_schema()
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression="zstd")
+    try:
+        async for batch in _row_batches(cursor, layout, row_group_rows):
+            writer.write_table(_arrow_table(schema, batch))
+            data = sink.drain()
+            if data:
+                yield data
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def table_media_type(fmt: str) -> Tuple[str, str]:
+    """(media type, estensione) di un formato tabellare"""
+    if fmt == "parquet":
+        return "application/vnd.apache.parquet", "parquet"
+    return "text/csv", "csv"
+
+
+def stream_incident_table(
+    collection, layout: str, fmt: str, code_index: Dict[str, Dict[str, Any]],
+    code: Optional[List[str]] = None,
+) -> AsyncIterator[bytes]:
+    """
+    Tabella degli incidenti nel layout e formato richiesti (usata da endpoint e CLI).
+
+    Args:
+        collection: Collezione MongoDB degli incidenti
+        layout: "long" o "wide"
+        fmt: "csv" o "parquet"
+        code_index: Indice dei codici della tassonomia (TaxonomyService.get_code_index)
+        code: Solo gli incidenti che contengono tutti i codici indicati
+
+    Raises:
+        ValueError: layout o formato non supportati
+        RuntimeError: formato parquet senza pyarrow installato
+    """
+    if fmt not in TABLE_FORMATS:
+        raise ValueError(f"Formato non supportato: {fmt}")
+    table = TableLayout(layout, code_index)
+    if fmt == "parquet" and not parquet_available():
+        raise RuntimeError("L'export Parquet richiede il pacchetto 'pyarrow'")
+
+    query = {"all_codes": {"$all": code}} if code else {}
+    cursor = collection.find(query, TABLE_PROJECTION).sort("created_at", 1).batch_size(500)
+    if fmt == "parquet":
+        return stream_parquet(cursor, table)
+    return stream_csv(cursor, table)
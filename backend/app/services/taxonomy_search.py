@@ -0,0 +1,176 @@
+"""
+Indice di ricerca in memoria sui valori della tassonomia ACN
+
+Costruito una volta per revisione di tassonomia (fa parte dello snapshot
+compilato) e usato per l'autocompletamento del builder:
+
+- termini normalizzati: minuscolo, senza accenti ("sicurezza", "perchè" -> "perche")
+- codici indicizzati per intero ("tt:ma_ra") e senza macrocategoria ("ma_ra")
+- prefissi: per ogni prefisso di ogni termine l'elenco dei termini completi
+  (trie appiattito in un dict), così una ricerca costa un lookup per token
+
+Ranking: ogni campo ha un peso (codice > label > nomi di predicato e
+macrocategoria > descrizione), raddoppiato se il token coincide con il
+termine invece di esserne un prefisso. Tutti i token devono trovare
+corrispondenza.
+
+Lo stesso indice risolve i codici citati da una ricerca full-text sugli
+incidenti (label_codes): operatori $text rimossi, match per termine intero
+o prefisso sulla sola label.
+"""
+import re
+import unicodedata
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+# Peso di un termine in base al campo da cui proviene
+FIELD_WEIGHTS = {
+    "code": 16,
+    "label": 8,
+    "subpredicate_name": 4,
+    "predicate_name": 3,
+    "macro_name": 2,
+    "description": 1,
+}
+
+_TOKEN = re.compile(r"[\w:]+")
+# Esclusioni della sintassi $text: -termine oppure -"frase"
+_TEXT_NEGATION = re.compile(r'(?:^|(?<=\s))-(?:"[^"]*"?|\S+)')
+
+# Lunghezza minima di un token per il match per prefisso in label_codes
+LABEL_PREFIX_MIN_LENGTH = 4
+
+# Parole frequenti nelle descrizioni (italiano/inglese) che non aiutano la ricerca
+STOPWORDS = frozenset("""
+    a ad al alla alle allo agli ai che con da dal dalla dei del della delle dello degli di e ed
+    il in la le lo gli i nel nella nelle nei o per su sul sulla tra fra un una uno non come
+    cui sono essere include identifica eventi evento
+    an and as at by for from in is of on or the to with
+""".split())
+
+
+def fold(text: str) -> str:
+    """Minuscolo e senza accenti (NFKD senza segni diacritici)"""
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+
+def tokenize(text: str) -> List[str]:
+    """Token normalizzati di un testo libero (stopword escluse)"""
+    return [
+        token.strip(":") for token in _TOKEN.findall(fold(text))
+        if token.strip(":") and token not in STOPWORDS
+    ]
+
+
+def text_query_terms(query: str) -> List[str]:
+    """Token positivi di una query $text (esclusioni rimosse, virgolette ignorate)"""
+    return tokenize(_TEXT_NEGATION.sub(" ", query).replace('"', " "))
+
+
+class TaxonomySearchIndex:
+    """
+    Indice termini/prefissi sui codici della tassonomia.
+
+    Example:
+        >>> index = TaxonomySearchIndex(code_index)
+        >>> index.search("ransom")[0]["code"]
+        'TT:MA_RA'
+    """
+
+    def __init__(self, code_index: Dict[str, Dict[str, Any]]):
+        self._entries = code_index
+        # termine -> {codice: peso massimo}
+        self._postings: Dict[str, Dict[str, int]] = {}
+        # termine di label -> codici
+        self._label_terms: Dict[str, Set[str]] = {}
+        for code, info in code_index.items():
+            folded = fold(code)
+            self._add(folded, code, FIELD_WEIGHTS["code"])
+            self._add(folded.split(":", 1)[-1], code, FIELD_WEIGHTS["code"])
+            for field, weight in FIELD_WEIGHTS.items():
+                if field != "code":
+                    for term in tokenize(info.get(field) or ""):
+                        self._add(term, code, weight)
+            for term in tokenize(info.get("label") or ""):
+                self._label_terms.setdefault(term, set()).add(code)
+
+        # prefisso -> termini completi che lo estendono (incluso il termine stesso)
+        prefixes: Dict[str, List[str]] = {}
+        for term in self._postings:
+            for end in range(1, len(term) + 1):
+                prefixes.setdefault(term[:end], []).append(term)
+        self._prefixes: Dict[str, Tuple[str, ...]] = {key: tuple(terms) for key, terms in prefixes.items()}
+
+    def _add(self, term: str, code: str, weight: int) -> None:
+        postings = self._postings.setdefault(term, {})
+        if postings.get(code, 0) < weight:
+            postings[code] = weight
+
+    def _token_scores(self, token: str) -> Dict[str, int]:
+        """Punteggio per codice di un singolo token (match esatto o per prefisso)"""
+        scores: Dict[str, int] = {}
+        for term in self._prefixes.get(token, ()):
+            factor = 2 if term == token else 1
+            for code, weight in self._postings[term].items():
+                score = weight * factor
+                if scores.get(code, 0) < score:
+                    scores[code] = score
+        return scores
+
+    def search(self, query: str, limit: int = 10, macro: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Cerca i valori della tassonomia che corrispondono alla query.
+
+        Args:
+            query: Testo libero, anche parziale (es. "ranso", "tt:ma", "vulnerabilità")
+            limit: Numero massimo di risultati
+            macro: Limita la ricerca a una macrocategoria (es. "TT")
+
+        Returns:
+            Risultati ordinati per punteggio, con le informazioni del codice
+        """
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+
+        totals: Optional[Dict[str, int]] = None
+        for token in dict.fromkeys(tokens):
+            scores = self._token_scores(token)
+            if totals is None:
+                totals = scores
+            else:
+                totals = {code: total + scores[code] for code, total in totals.items() if code in scores}
+            if not totals:
+                return []
+
+        if macro:
+            totals = {code: score for code, score in totals.items() if self._entries[code]["macro"] == macro}
+
+        ranked = sorted(
+            totals.items(),
+            key=lambda item: (-item[1], len(self._entries[item[0]].get("label") or ""), item[0]),
+        )
+        return [
+            {"code": code, "score": score, **self._entries[code]}
+            for code, score in ranked[:limit]
+        ]
+
+    def label_codes(self, query: str, min_length: int = 3) -> List[str]:
+        """
+        Codici la cui label contiene un termine della query $text.
+
+        Ogni token (almeno min_length caratteri) corrisponde a un termine
+        della label uguale o, da LABEL_PREFIX_MIN_LENGTH caratteri, che lo
+        estende: "ransom" -> "ransomware", ma "web" non trova "website".
+        """
+        codes: Set[str] = set()
+        for token in dict.fromkeys(text_query_terms(query)):
+            if len(token) < min_length:
+                continue
+            terms = self._prefixes.get(token, ()) if len(token) >= LABEL_PREFIX_MIN_LENGTH else (token,)
+            for term in terms:
+                codes.update(self._label_terms.get(term, ()))
+        return sorted(codes)
+
+    def __len__(self) -> int:
+        return len(self._postings)
@@ -1,33 +1,273 @@
+import asyncio
+import hashlib
+import inspect
 import json
-from typing import Dict, List, Optional, Any
+import os
+import pickle
+from dataclasses import dataclass, field, fields, replace
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Any
 from pathlib import Path
 
+from app.services.taxonomy_search import TaxonomySearchIndex
+
+
+@dataclass(frozen=True)
+class TaxonomySnapshot:
+    """
+    Stato immutabile della tassonomia caricata (dati + indici + versione).
+
+    Un reload costruisce un nuovo snapshot a parte e lo sostituisce in un
+    solo assegnamento: le richieste in corso continuano a vedere il vecchio.
+    """
+    taxonomy_data: Dict[str, Any]
+    misp_taxonomy_data: Dict[str, Any]
+    code_index: Dict[str, Dict[str, Any]]
+    search_index: TaxonomySearchIndex
+    version: str
+    loaded_at: datetime = field(default_factory=datetime.utcnow)
+    source: str = "json"
+
+
+def _build_code_index(taxonomy_data: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """Crea la lookup codice -> label, descrizione e posizione nella gerarchia"""
+    index: Dict[str, Dict[str, Any]] = {}
+    for mc in taxonomy_data.get("taxonomy", {}).get("macrocategories", []):
+        mc_code = mc.get("code")
+        mc_name = mc.get("name", mc_code)
+        for predicate in mc.get("predicates", []):
+            pred_code = predicate.get("code")
+            pred_name = predicate.get("name", pred_code)
+            groups = [(None, None, predicate.get("values", []))]
+            for subpred in predicate.get("subpredicates", []):
+                sub_code = subpred.get("code")
+                groups.append((sub_code, subpred.get("name", sub_code), subpred.get("values", [])))
+
+            for sub_code, sub_name, values in groups:
+                for value in values:
+                    index[value["code"]] = {
+                        "label": value.get("label", ""),
+                        "description": value.get("description", ""),
+                        "macro": mc_code,
+                        "macro_name": mc_name,
+                        "predicate": pred_code,
+                        "predicate_name": pred_name,
+                        "subpredicate": sub_code,
+                        "subpredicate_name": sub_name,
+                    }
+    return index
+
+
+# Campi selezionabili con ?fields= sui nodi della tassonomia (a ogni livello)
+TAXONOMY_FIELDS = frozenset({"code", "name", "label", "description", "has_subpredicates"})
+
+# Chiavi che contengono i nodi figli: mantenute sempre nelle proiezioni
+_CHILD_KEYS = ("predicates", "subpredicates", "values")
+
+# Descrizioni brevi degli step del wizard (le descrizioni della tassonomia sono lunghe)
+WIZARD_STEP_DESCRIPTIONS = {
+    "BC": "Caratterizzazione dell'incidente",
+    "TT": "Tipologia di minaccia",
+    "TA": "Attore della minaccia",
+    "AC": "Contesto aggiuntivo",
+}
+
+
+def project_taxonomy(node: Any, fields: Optional[frozenset] = None) -> Any:
+    """
+    Copia di un nodo (o lista di nodi) della tassonomia con i soli campi indicati.
+
+    I figli (predicates, subpredicates, values) sono sempre inclusi e
+    proiettati con gli stessi campi. Con fields=None ritorna il nodo.
+    """
+    if fields is None:
+        return node
+    if isinstance(node, list):
+        return [project_taxonomy(item, fields) for item in node]
+    if not isinstance(node, dict):
+        return node
+    return {
+        key: project_taxonomy(value, fields) if key in _CHILD_KEYS else value
+        for key, value in node.items()
+        if key in fields or key in _CHILD_KEYS
+    }
+
+
+# Formato dello snapshot compilato: incrementare quando cambiano gli indici
+SNAPSHOT_FORMAT = 3
+
+# Campi runtime dello snapshot che non vengono persistiti
+_RUNTIME_FIELDS = {"loaded_at", "source"}
+
+
+def compile_taxonomy(taxonomy_raw: bytes, misp_raw: bytes, version: str) -> TaxonomySnapshot:
+    """Compila i JSON sorgente in uno snapshot con tutti gli indici"""
+    taxonomy_data = json.loads(taxonomy_raw)
+    code_index = _build_code_index(taxonomy_data)
+    return TaxonomySnapshot(
+        taxonomy_data=taxonomy_data,
+        misp_taxonomy_data=json.loads(misp_raw),
+        code_index=code_index,
+        search_index=TaxonomySearchIndex(code_index),
+        version=version,
+    )
+
+
+def write_compiled_snapshot(snapshot: TaxonomySnapshot, path: Path) -> int:
+    """
+    Salva lo snapshot compilato (pickle) con sostituzione atomica del file.
+
+    Returns:
+        Dimensione in byte del file scritto
+    """
+    payload = {"format": SNAPSHOT_FORMAT}
+    payload.update({
+        f.name: getattr(snapshot, f.name)
+        for f in fields(snapshot)
+        if f.name not in _RUNTIME_FIELDS
+    })
+    data = pickle.dumps(payload, protocol=pickle.HIGHEST_PROTOCOL)
+
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.write_bytes(data)
+    os.replace(tmp_path, path)
+    return len(data)
+
+
+def read_compiled_snapshot(path: Path, version: str) -> Optional[TaxonomySnapshot]:
+    """
+    Carica uno snapshot compilato se esiste ed è allineato ai sorgenti.
+
+    Il file è generato in fase di build (python -m app.cli build-taxonomy-snapshot)
+    e deve trovarsi in un percorso fidato, essendo un pickle.
+
+    Args:
+        path: Percorso dello snapshot
+        version: Hash dei sorgenti attuali; se diverso lo snapshot è obsoleto
+
+    Returns:
+        Snapshot, oppure None se assente, obsoleto o illeggibile
+    """
+    try:
+        payload = pickle.loads(path.read_bytes())
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"Taxonomy snapshot {path} non leggibile: {e}")
+        return None
+
+    if payload.pop("format", None) != SNAPSHOT_FORMAT or payload.get("version") != version:
+        return None
+    return replace(TaxonomySnapshot(**payload), source="snapshot")
+
 
 class TaxonomyService:
     """Servizio per gestire la tassonomia ACN"""
 
     def __init__(self):
-        self.taxonomy_path = Path("/app/ACN_Taxonomy.json")
-        self.misp_taxonomy_path = Path("/app/MISP_ACN_Taxonomy.json")
-        self._taxonomy_data = None
-        self._misp_taxonomy_data = None
-        self._load_taxonomy()
+        self.taxonomy_path = Path(os.getenv("TAXONOMY_PATH", "/app/ACN_Taxonomy.json"))
+        self.misp_taxonomy_path = Path(os.getenv("MISP_TAXONOMY_PATH", "/app/MISP_ACN_Taxonomy.json"))
+        self.snapshot_path = Path(os.getenv("TAXONOMY_SNAPSHOT_PATH", "/app/taxonomy.snapshot"))
+        self._reload_listeners: List[Callable[[str], Any]] = []
+        self._reload_lock: Optional[asyncio.Lock] = None
+        self._snapshot: TaxonomySnapshot = self._load_taxonomy()
+
+    def _read_sources(self) -> tuple[bytes, bytes]:
+        """Legge i file sorgente della tassonomia"""
+        return self.taxonomy_path.read_bytes(), self.misp_taxonomy_path.read_bytes()
+
+    @staticmethod
+    def _compute_version(taxonomy_raw: bytes, misp_raw: bytes) -> str:
+        """Hash del contenuto dei file sorgente: identifica la revisione della tassonomia"""
+        digest = hashlib.sha256()
+        digest.update(taxonomy_raw)
+        digest.update(b"\0")
+        digest.update(misp_raw)
+        return digest.hexdigest()[:16]
+
+    def _load_taxonomy(self) -> TaxonomySnapshot:
+        """
+        Carica la tassonomia: dallo snapshot compilato se allineato ai
+        sorgenti (checksum), altrimenti compilando i JSON.
+        """
+        taxonomy_raw, misp_raw = self._read_sources()
+        version = self._compute_version(taxonomy_raw, misp_raw)
+
+        compiled = read_compiled_snapshot(self.snapshot_path, version)
+        if compiled is not None:
+            return compiled
+        return compile_taxonomy(taxonomy_raw, misp_raw, version)
+
+    def build_snapshot(self, path: Optional[Path] = None) -> int:
+        """Compila la tassonomia dai JSON e salva lo snapshot (ritorna i byte scritti)"""
+        taxonomy_raw, misp_raw = self._read_sources()
+        snapshot = compile_taxonomy(taxonomy_raw, misp_raw, self._compute_version(taxonomy_raw, misp_raw))
+        return write_compiled_snapshot(snapshot, path or self.snapshot_path)
+
+    @property
+    def version(self) -> str:
+        """Hash della revisione di tassonomia attualmente caricata"""
+        return self._snapshot.version
+
+    @property
+    def loaded_at(self) -> datetime:
+        """Istante (UTC) in cui la revisione corrente è stata caricata"""
+        return self._snapshot.loaded_at
+
+    @property
+    def source(self) -> str:
+        """Origine della revisione corrente: snapshot compilato o JSON"""
+        return self._snapshot.source
+
+    def reload(self, force: bool = False) -> bool:
+        """
+        Ricarica la tassonomia dai file e sostituisce atomicamente lo snapshot.
+
+        Non notifica i listener: usare reload_async dall'event loop.
+
+        Args:
+            force: Ricostruisce anche se il contenuto dei file non è cambiato
 
-    def _load_taxonomy(self):
-        """Carica i dati della tassonomia"""
-        with open(self.taxonomy_path, 'r', encoding='utf-8') as f:
-            self._taxonomy_data = json.load(f)
+        Returns:
+            True se la versione caricata è cambiata (o force)
+        """
+        if not force:
+            taxonomy_raw, misp_raw = self._read_sources()
+            if self._compute_version(taxonomy_raw, misp_raw) == self._snapshot.version:
+                return False
 
-        with open(self.misp_taxonomy_path, 'r', encoding='utf-8') as f:
-            self._misp_taxonomy_data = json.load(f)
+        self._snapshot = self._load_taxonomy()
+        return True
+
+    async def reload_async(self, force: bool = False) -> bool:
+        """
+        Ricarica la tassonomia in un thread (senza bloccare le richieste)
+        e notifica i listener registrati se la versione è cambiata.
+        """
+        if self._reload_lock is None:
+            self._reload_lock = asyncio.Lock()
+
+        async with self._reload_lock:
+            changed = await asyncio.to_thread(self.reload, force)
+            if changed:
+                print(f"Taxonomy reloaded: version {self.version}")
+                for listener in self._reload_listeners:
+                    result = listener(self.version)
+                    if inspect.isawaitable(result):
+                        await result
+        return changed
+
+    def add_reload_listener(self, listener: Callable[[str], Any]) -> None:
+        """Registra una callback (sync o async) chiamata con la nuova versione dopo un reload"""
+        self._reload_listeners.append(listener)
 
     def get_taxonomy(self) -> Dict[str, Any]:
         """Ritorna l'intera tassonomia"""
-        return self._taxonomy_data
+        return self._snapshot.taxonomy_data
 
     def get_macrocategories(self) -> List[Dict[str, Any]]:
         """Ritorna tutte le macrocategorie"""
-        return self._taxonomy_data.get("taxonomy", {}).get("macrocategories", [])
+        return self._snapshot.taxonomy_data.get("taxonomy", {}).get("macrocategories", [])
 
     def get_macrocategory(self, code: str) -> Optional[Dict[str, Any]]:
         """Ritorna una specifica macrocategoria"""
@@ -58,37 +298,42 @@ class TaxonomyService:
             return pred.get("values", [])
         return []
 
+    def get_code_index(self) -> Dict[str, Dict[str, Any]]:
+        """Ritorna la lookup completa codice -> informazioni tassonomia"""
+        return self._snapshot.code_index
+
+    def get_code_info(self, code: str) -> Optional[Dict[str, Any]]:
+        """Ritorna le informazioni di un codice (label, macro, predicato...)"""
+        return self._snapshot.code_index.get(code)
+
+    def find_codes_by_label(self, text: str, min_length: int = 3) -> List[str]:
+        """
+        Ritorna i codici la cui label contiene uno dei termini del testo.
+
+        Usato dalla ricerca incidenti: "ransomware" -> ["TT:MA_RA"]. Il testo
+        segue la sintassi $text: esclusioni (-termine) e virgolette non
+        vengono confrontate con le label.
+        """
+        return self._snapshot.search_index.label_codes(text, min_length=min_length)
+
+    def search(self, query: str, limit: int = 10, macro: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Ricerca per codice, label e descrizione (autocompletamento del builder)"""
+        return self._snapshot.search_index.search(query, limit=limit, macro=macro)
+
     def get_wizard_structure(self) -> List[Dict[str, Any]]:
-        """Ritorna la struttura per il wizard step-by-step"""
+        """
+        Ritorna la struttura per il wizard step-by-step: uno step per
+        macrocategoria, con i predicati nell'ordine della tassonomia caricata.
+        """
         return [
             {
-                "step": 1,
-                "title": "Baseline Characterization",
-                "description": "Caratterizzazione dell'incidente",
-                "macrocategory": "BC",
-                "predicates": ["IM", "RO", "SE", "VG"]
-            },
-            {
-                "step": 2,
-                "title": "Threat Type",
-                "description": "Tipologia di minaccia",
-                "macrocategory": "TT",
-                "predicates": ["AC", "AV", "BA", "FR", "DE", "IG", "MA", "SO", "VU"]
-            },
-            {
-                "step": 3,
-                "title": "Threat Actor",
-                "description": "Attore della minaccia",
-                "macrocategory": "TA",
-                "predicates": ["AM", "AD"]
-            },
-            {
-                "step": 4,
-                "title": "Additional Context",
-                "description": "Contesto aggiuntivo",
-                "macrocategory": "AC",
-                "predicates": ["AB", "AS", "IN", "OU", "PH", "VE"]
+                "step": step,
+                "title": mc.get("name", mc["code"]),
+                "description": WIZARD_STEP_DESCRIPTIONS.get(mc["code"], mc.get("description", "")),
+                "macrocategory": mc["code"],
+                "predicates": [pred["code"] for pred in mc.get("predicates", [])],
             }
+            for step, mc in enumerate(self.get_macrocategories(), start=1)
         ]
 
     def validate_code(self, code: str) -> bool:
@@ -126,7 +371,7 @@ class TaxonomyService:
 
     def get_misp_taxonomy(self) -> Dict[str, Any]:
         """Ritorna la tassonomia MISP"""
-        return self._misp_taxonomy_data
+        return self._snapshot.misp_taxonomy_data
 
     def map_to_misp_format(self, incident_data: Dict[str, Any]) -> Dict[str, Any]:
         """Mappa un incidente nel formato MISP"""
@@ -169,5 +414,31 @@ class TaxonomyService:
         return mapping.get(severity, "4")
 
 
+async def watch_taxonomy_files(interval: float) -> None:
+    """
+    Controlla periodicamente i file della tassonomia e ricarica se cambiano.
+
+    Ogni worker esegue il proprio watcher, quindi tutti i processi
+    convergono sulla nuova revisione senza restart.
+    """
+    def _mtimes():
+        return (
+            taxonomy_service.taxonomy_path.stat().st_mtime_ns,
+            taxonomy_service.misp_taxonomy_path.stat().st_mtime_ns,
+        )
+
+    last = _mtimes()
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            current = _mtimes()
+            if current != last:
+                last = current
+                await taxonomy_service.reload_async()
+        except Exception as e:
+            # File in scrittura o JSON non valido: si mantiene la versione corrente
+            print(f"Taxonomy reload failed: {e}")
+
+
 # Singleton
 taxonomy_service = TaxonomyService()
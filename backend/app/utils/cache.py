@@ -0,0 +1,66 @@
+"""
+Cache in-process con scadenza (TTL) e limite di dimensione (LRU)
+"""
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    Cache LRU con TTL per singolo processo.
+
+    Pensata per memoizzare risultati costosi (aggregazioni, lookup) che
+    possono essere invalidati esplicitamente dai percorsi di scrittura.
+    ttl=None: nessuna scadenza (solo LRU); ttl <= 0: cache disattivata.
+
+    Example:
+        >>> cache = TTLCache(ttl=30, maxsize=2)
+        >>> cache.set("a", 1)
+        >>> cache.get("a")
+        1
+        >>> cache.get("b") is None
+        True
+    """
+
+    def __init__(self, ttl: Optional[float], maxsize: int = 128):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data: "OrderedDict[Hashable, tuple[Optional[float], Any]]" = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Ritorna il valore in cache o default se assente/scaduto"""
+        entry = self._data.get(key, _MISSING)
+        if entry is _MISSING:
+            return default
+
+        expires_at, value = entry
+        if expires_at is not None and expires_at < time.monotonic():
+            self._data.pop(key, None)
+            return default
+
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """Inserisce un valore, espellendo il meno usato se si supera maxsize"""
+        if self.ttl is not None and self.ttl <= 0:
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        self._data[key] = (expires_at, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key: Optional[Hashable] = None) -> None:
+        """Invalida una chiave, oppure tutta la cache se key è None"""
+        if key is None:
+            self._data.clear()
+        else:
+            self._data.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._data)
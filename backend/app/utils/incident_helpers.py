@@ -0,0 +1,65 @@
+"""
+Helper per i campi derivati salvati accanto ai documenti incidente
+"""
+import hashlib
+import json
+from datetime import datetime, timezone
+from typing import Any, Dict
+
+from app.utils.taxonomy_helpers import build_code_index_fields, extract_all_codes_from_taxonomy_dict
+
+
+def build_denormalized_fields(data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Calcola i campi derivati (indici e ricerca) a partire dai campi modificati.
+
+    Ricalcola solo ciò che dipende dai campi presenti in data, così può
+    essere usato sia per documenti completi che per update parziali.
+
+    Example:
+        >>> build_denormalized_fields({'code_details': {'TT:MA_RA': 'LockBit'}})
+        {'code_details_text': ['LockBit']}
+
+    Args:
+        data: Documento o dati di update
+
+    Returns:
+        Dict con i campi derivati da impostare
+    """
+    fields: Dict[str, Any] = {}
+
+    if data.get("taxonomy_codes") is not None:
+        fields.update(build_code_index_fields(data["taxonomy_codes"]))
+
+    if data.get("code_details") is not None:
+        # Le note per codice sono sotto chiavi dinamiche: l'indice testuale
+        # ha bisogno di un campo a percorso fisso
+        fields["code_details_text"] = [v for v in data["code_details"].values() if v]
+
+    return fields
+
+
+def compute_content_hash(data: Dict[str, Any]) -> str:
+    """
+    Hash canonico del contenuto di un incidente, per riconoscere i duplicati.
+
+    Considera titolo (spazi e maiuscole normalizzati), discovered_at
+    (UTC, al millisecondo) e l'insieme dei codici: lo stesso incidente
+    esportato e reimportato più volte produce sempre lo stesso hash.
+
+    Example:
+        >>> compute_content_hash({"title": " Data  breach"}) == compute_content_hash({"title": "data breach"})
+        True
+    """
+    discovered_at = data.get("discovered_at")
+    if isinstance(discovered_at, datetime):
+        if discovered_at.tzinfo is not None:
+            discovered_at = discovered_at.astimezone(timezone.utc).replace(tzinfo=None)
+        discovered_at = discovered_at.isoformat(timespec="milliseconds")
+
+    canonical = json.dumps({
+        "title": " ".join((data.get("title") or "").split()).casefold(),
+        "discovered_at": discovered_at,
+        "codes": sorted(set(extract_all_codes_from_taxonomy_dict(data.get("taxonomy_codes") or {}))),
+    }, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
@@ -0,0 +1,55 @@
+"""
+Percorso di lettura "fidato" per i documenti letti da MongoDB
+
+I documenti salvati sono già stati validati in scrittura (IncidentCreate /
+IncidentUpdate): rivalidarli con Incident(**doc) e poi di nuovo tramite il
+response_model di FastAPI costa CPU senza aggiungere garanzie.
+
+- model_from_db: costruisce il modello senza validazione (model_construct)
+- trusted_json_response: serializza direttamente con pydantic-core e
+  restituisce una Response, così FastAPI non rivalida il response_model
+  (che resta dichiarato sulle route per la documentazione OpenAPI)
+
+Da usare solo per dati letti dal database, mai per input del client.
+"""
+from functools import lru_cache
+from typing import Any, Dict, Type, TypeVar
+
+from fastapi import Response
+from pydantic import BaseModel, TypeAdapter
+
+ModelT = TypeVar("ModelT", bound=BaseModel)
+
+
+def model_from_db(model: Type[ModelT], doc: Dict[str, Any]) -> ModelT:
+    """
+    Costruisce un modello da un documento MongoDB senza validazione.
+
+    Rinomina _id in id senza modificare il documento originale (che può
+    provenire dalla cache incidenti); i campi extra vengono ignorati.
+    """
+    if "_id" in doc:
+        doc = {**doc, "id": doc["_id"]}
+    return model.model_construct(**doc)
+
+
+@lru_cache(maxsize=None)
+def _adapter(tp: Any) -> TypeAdapter:
+    return TypeAdapter(tp)
+
+
+def trusted_json_response(value: Any, tp: Any = None, status_code: int = 200) -> Response:
+    """
+    Serializza value in JSON senza passare dalla validazione del response_model.
+
+    Args:
+        value: Modello pydantic, oppure lista/dict di modelli (con tp)
+        tp: Tipo per la serializzazione (es. List[IncidentSummary]); se None
+            value deve essere un BaseModel
+        status_code: Codice HTTP della risposta
+    """
+    if tp is None:
+        body = value.model_dump_json()
+    else:
+        body = _adapter(tp).dump_json(value)
+    return Response(content=body, status_code=status_code, media_type="application/json")
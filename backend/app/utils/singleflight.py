@@ -0,0 +1,48 @@
+"""
+Deduplicazione delle elaborazioni concorrenti identiche (single-flight)
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+
+class SingleFlight:
+    """
+    Esegue una sola elaborazione per chiave tra le richieste concorrenti.
+
+    Le richieste che arrivano mentre un'elaborazione con la stessa chiave
+    è in corso ne attendono il risultato (o l'eccezione) invece di
+    ripeterla. Non è una cache: a elaborazione conclusa la chiave viene
+    rimossa e la richiesta successiva ricalcola.
+
+    Example:
+        >>> flights = SingleFlight()
+        >>> body, shared = await flights.do(("pdf", incident_id, 3), lambda: asyncio.to_thread(render, incident))
+    """
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        Returns:
+            (risultato, True se condiviso con un'elaborazione già in corso)
+        """
+        task = self._inflight.get(key)
+        shared = task is not None
+        if task is None:
+            # Task separato: se il client che l'ha avviato si disconnette,
+            # l'elaborazione prosegue per gli altri in attesa
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        return await asyncio.shield(task), shared
+
+    def _done(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            # Evita il warning "exception never retrieved" se tutti si sono disconnessi
+            task.exception()
+
+    def __len__(self) -> int:
+        return len(self._inflight)
@@ -185,3 +185,26 @@ def count_codes_by_category(taxonomy_codes: Dict[str, List[str]]) -> Dict[str, i
         counts[category] = counts.get(category, 0) + len(codes)
 
     return counts
+
+
+def build_code_index_fields(taxonomy_codes: Dict[str, List[str]]) -> Dict[str, object]:
+    """
+    Calcola i campi denormalizzati da salvare accanto a taxonomy_codes.
+
+    all_codes è un array piatto indicizzabile (indice multikey) e
+    macro_counts evita di ricalcolare i conteggi ad ogni lettura.
+
+    Example:
+        >>> build_code_index_fields({'BC:SE': ['BC:SE_HI'], 'TT:MA': ['TT:MA_RA']})
+        {'all_codes': ['BC:SE_HI', 'TT:MA_RA'], 'macro_counts': {'BC': 1, 'TT': 1}}
+
+    Args:
+        taxonomy_codes: Dict con codici raggruppati
+
+    Returns:
+        Dict con i campi all_codes e macro_counts
+    """
+    return {
+        "all_codes": extract_all_codes_from_taxonomy_dict(taxonomy_codes),
+        "macro_counts": count_codes_by_category(taxonomy_codes),
+    }
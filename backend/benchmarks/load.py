@@ -0,0 +1,152 @@
+"""
+Scenari di carico HTTP end-to-end
+
+Due modalità:
+- --base-url: contro un'istanza in esecuzione (con MongoDB reale)
+- --mock: in-process via ASGI, con mongomock-motor al posto di MongoDB
+  (utile per confrontare run sulla stessa macchina; non misura il database)
+"""
+import asyncio
+import os
+import random
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+from benchmarks.results import summarize
+from benchmarks.synthetic import IncidentGenerator, generate_documents
+
+# Scenario -> funzione (rng, ids, generator) -> (metodo, url, body)
+Request = Tuple[str, str, Optional[Dict[str, Any]]]
+
+SCENARIOS: Dict[str, Callable[[random.Random, List[str], IncidentGenerator], Request]] = {
+    "list_incidents": lambda rng, ids, gen: ("GET", "/api/incidents/", None),
+    "get_incident": lambda rng, ids, gen: ("GET", f"/api/incidents/{rng.choice(ids)}", None),
+    "stats": lambda rng, ids, gen: ("GET", "/api/incidents/stats", None),
+    "search_text": lambda rng, ids, gen: ("GET", "/api/incidents/search/text?q=ransomware", None),
+    "similar": lambda rng, ids, gen: ("GET", f"/api/incidents/{rng.choice(ids)}/similar", None),
+    "export_json": lambda rng, ids, gen: ("GET", f"/api/export/{rng.choice(ids)}/json", None),
+    "export_pdf": lambda rng, ids, gen: ("GET", f"/api/export/{rng.choice(ids)}/pdf", None),
+    "export_misp": lambda rng, ids, gen: ("GET", f"/api/export/{rng.choice(ids)}/misp", None),
+    "create_incident": lambda rng, ids, gen: ("POST", "/api/incidents/", gen.payload()),
+}
+
+# Operatori non supportati da mongomock ($text, $substrCP): solo contro istanze reali
+MOCK_UNSUPPORTED = {"stats", "search_text"}
+
+
+async def _run_scenario(
+    client: httpx.AsyncClient,
+    build_request: Callable[[random.Random, List[str], IncidentGenerator], Request],
+    ids: List[str],
+    requests: int,
+    concurrency: int,
+    seed: int,
+) -> Dict[str, Any]:
+    """Esegue requests richieste con concurrency worker e raccoglie le latenze"""
+    rng = random.Random(seed)
+    generator = IncidentGenerator(seed=seed)
+    latencies: List[float] = []
+    errors = 0
+    remaining = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for _ in remaining:
+            method, url, body = build_request(rng, ids, generator)
+            start = time.perf_counter()
+            try:
+                response = await client.request(method, url, json=body)
+                if response.status_code >= 400:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    return summarize(
+        latencies,
+        errors=errors,
+        requests_per_sec=round(len(latencies) / elapsed, 2),
+        concurrency=concurrency,
+    )
+
+
+async def _mock_client(docs: int, seed: int) -> Tuple[httpx.AsyncClient, List[str]]:
+    """Client in-process con l'app collegata a un database mongomock popolato"""
+    from mongomock_motor import AsyncMongoMockClient
+
+    # Il carico generato supera volutamente i limiti dell'admission control
+    os.environ.setdefault("ADMISSION_CONTROL_ENABLED", "false")
+
+    from app import db
+    from app.main import app
+    from app.services.similarity_service import load_similarity_index
+
+    db.client = AsyncMongoMockClient()
+    collection = db.get_collection("incidents")
+    documents = generate_documents(docs, seed=seed)
+    await collection.insert_many(documents)
+    await load_similarity_index(collection)
+
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    client = httpx.AsyncClient(transport=transport, base_url="http://ice-bench", timeout=60)
+    return client, [doc["_id"] for doc in documents]
+
+
+async def _remote_client(base_url: str, seed_docs: int, seed: int) -> Tuple[httpx.AsyncClient, List[str]]:
+    """Client verso un'istanza reale, popolata opzionalmente via API"""
+    # Con ADMIN_TOKEN le richieste non sono soggette all'admission control dell'istanza
+    headers = {"X-Admin-Token": os.environ["ADMIN_TOKEN"]} if os.getenv("ADMIN_TOKEN") else None
+    client = httpx.AsyncClient(base_url=base_url, timeout=60, headers=headers)
+    generator = IncidentGenerator(seed=seed)
+    for _ in range(seed_docs):
+        response = await client.post("/api/incidents/", json=generator.payload())
+        response.raise_for_status()
+
+    response = await client.get("/api/incidents/")
+    response.raise_for_status()
+    ids = [item["id"] for item in response.json()]
+    if not ids:
+        raise SystemExit("Nessun incidente presente: usare --seed-docs per popolare il database")
+    return client, ids
+
+
+async def run_load(
+    scenarios: List[str],
+    base_url: Optional[str] = None,
+    docs: int = 1000,
+    requests: int = 200,
+    concurrency: int = 10,
+    seed: int = 42,
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Esegue gli scenari di carico indicati.
+
+    Args:
+        scenarios: Nomi degli scenari (chiavi di SCENARIOS)
+        base_url: URL dell'istanza; None = in-process con mongomock
+        docs: Documenti da generare (mock) o da inserire via API (base_url)
+        requests: Richieste per scenario
+        concurrency: Richieste concorrenti
+        seed: Seed per dati e scelta degli ID
+
+    Returns:
+        Dict scenario -> statistiche di latenza e throughput
+    """
+    if base_url:
+        client, ids = await _remote_client(base_url, docs, seed)
+    else:
+        client, ids = await _mock_client(docs, seed)
+
+    results: Dict[str, Dict[str, Any]] = {}
+    async with client:
+        for name in scenarios:
+            results[f"http.{name}"] = await _run_scenario(
+                client, SCENARIOS[name], ids, requests, concurrency, seed,
+            )
+    return results
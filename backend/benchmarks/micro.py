@@ -0,0 +1,130 @@
+"""
+Micro-benchmark delle funzioni pure del backend
+
+Nessuna dipendenza da MongoDB: misura helper tassonomia, costruzione dei
+summary, validazione Pydantic, eventi MISP, report PDF e ricerca per
+similarità su documenti sintetici.
+"""
+import asyncio
+from typing import Any, Dict, List
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+from app.api.incidents import _build_summaries
+from app.models.incident import Incident, IncidentSummary
+from app.services.misp_service import create_misp_event
+from app.services.similarity_service import SimilarityIndex
+from app.services.taxonomy_service import taxonomy_service
+from app.utils import taxonomy_helpers
+from app.utils.incident_helpers import build_denormalized_fields
+from app.utils.serialization import model_from_db, trusted_json_response
+from benchmarks.results import bench
+from benchmarks.synthetic import generate_documents
+
+
+def _as_incident_dict(doc: Dict[str, Any]) -> Dict[str, Any]:
+    data = dict(doc)
+    data["id"] = data.pop("_id")
+    return data
+
+
+_response_fields: Dict[Any, Any] = {}
+
+
+def _validated_response(loop: asyncio.AbstractEventLoop, response_type: Any, content: Any) -> bytes:
+    """Percorso FastAPI standard: validazione del response_model e JSONResponse"""
+    field = _response_fields.get(response_type)
+    if field is None:
+        field = _response_fields[response_type] = create_response_field(name="response", type_=response_type)
+    data = loop.run_until_complete(serialize_response(field=field, response_content=content))
+    return JSONResponse(content=data).body
+
+
+def run_micro(docs: int = 1000, similarity_docs: int = 100_000, quick: bool = False) -> Dict[str, Dict[str, Any]]:
+    """
+    Esegue tutti i micro-benchmark.
+
+    Args:
+        docs: Numero di documenti per i benchmark "per lista"
+        similarity_docs: Dimensione dell'indice di similarità
+        quick: Meno ripetizioni (per smoke test)
+
+    Returns:
+        Dict nome benchmark -> statistiche
+    """
+    repeat = 5 if quick else 20
+    documents = generate_documents(docs, seed=1)
+    sample = documents[0]
+    codes = [code for doc in documents[:50] for code in doc["all_codes"]]
+    incident_dicts = [_as_incident_dict(doc) for doc in documents]
+
+    results: Dict[str, Dict[str, Any]] = {}
+
+    results[f"taxonomy_helpers.build_taxonomy_key[{len(codes)} codes]"] = bench(
+        lambda: [taxonomy_helpers.build_taxonomy_key(c) for c in codes], repeat=repeat, number=10,
+    )
+    results[f"taxonomy_helpers.group_codes_by_taxonomy_key[{len(codes)} codes]"] = bench(
+        lambda: taxonomy_helpers.group_codes_by_taxonomy_key(codes), repeat=repeat, number=10,
+    )
+    results[f"taxonomy_helpers.count_codes_by_category[{docs} docs]"] = bench(
+        lambda: [taxonomy_helpers.count_codes_by_category(d["taxonomy_codes"]) for d in documents], repeat=repeat,
+    )
+    results[f"taxonomy_helpers.extract_all_codes_from_taxonomy_dict[{docs} docs]"] = bench(
+        lambda: [taxonomy_helpers.extract_all_codes_from_taxonomy_dict(d["taxonomy_codes"]) for d in documents],
+        repeat=repeat,
+    )
+    results[f"incident_helpers.build_denormalized_fields[{docs} docs]"] = bench(
+        lambda: [build_denormalized_fields(d) for d in documents], repeat=repeat,
+    )
+    results[f"taxonomy_service.validate_code[{len(codes)} codes]"] = bench(
+        lambda: [taxonomy_service.validate_code(c) for c in codes], repeat=repeat,
+    )
+
+    results[f"incidents.list_summaries[{docs} docs]"] = bench(
+        lambda: _build_summaries(documents), repeat=repeat,
+    )
+    results[f"models.Incident.validate[{docs} docs]"] = bench(
+        lambda: [Incident(**d) for d in incident_dicts], repeat=repeat,
+    )
+
+    # Letture dal database: validazione completa + response_model contro percorso fidato
+    loop = asyncio.new_event_loop()
+    results[f"response.list_incidents[validated][{docs} docs]"] = bench(
+        lambda: _validated_response(
+            loop, List[IncidentSummary],
+            [IncidentSummary(**summary.__dict__) for summary in _build_summaries(documents)],
+        ),
+        repeat=repeat,
+    )
+    results[f"response.list_incidents[trusted][{docs} docs]"] = bench(
+        lambda: trusted_json_response(_build_summaries(documents), List[IncidentSummary]).body, repeat=repeat,
+    )
+    results[f"response.get_incident[validated][{docs} docs]"] = bench(
+        lambda: [_validated_response(loop, Incident, Incident(**d)) for d in incident_dicts], repeat=repeat,
+    )
+    results[f"response.get_incident[trusted][{docs} docs]"] = bench(
+        lambda: [trusted_json_response(model_from_db(Incident, d)).body for d in documents], repeat=repeat,
+    )
+    loop.close()
+
+    results["misp_service.create_misp_event"] = bench(
+        lambda: create_misp_event(incident_dicts[0], taxonomy_service), repeat=repeat, number=20,
+    )
+
+    from app.services.report_service import generate_pdf_report
+    results["report_service.generate_pdf_report"] = bench(
+        lambda: generate_pdf_report(_as_incident_dict(sample), taxonomy_service), repeat=max(3, repeat // 4),
+    )
+
+    index = SimilarityIndex(taxonomy_service.get_code_index().keys())
+    # Replica i codici generati fino alla dimensione richiesta (la generazione completa è lenta)
+    codes = [doc["all_codes"] for doc in generate_documents(min(similarity_docs, 2000), seed=2)]
+    for i in range(max(similarity_docs, len(codes))):
+        index.upsert(str(i), codes[i % len(codes)])
+    results[f"similarity.query_jaccard[{len(index)} docs]"] = bench(
+        lambda: index.query(sample["all_codes"], k=10), repeat=repeat,
+    )
+
+    return results
@@ -0,0 +1,129 @@
+"""
+Misurazione, salvataggio e confronto dei risultati dei benchmark
+"""
+import json
+import math
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Percentile (nearest-rank) di una lista di valori"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(samples_ms: List[float], **extra: Any) -> Dict[str, Any]:
+    """Statistiche standard di una serie di latenze in millisecondi"""
+    return {
+        "median_ms": round(statistics.median(samples_ms), 4),
+        "p95_ms": round(percentile(samples_ms, 95), 4),
+        "p99_ms": round(percentile(samples_ms, 99), 4),
+        "min_ms": round(min(samples_ms), 4),
+        "samples": len(samples_ms),
+        **extra,
+    }
+
+
+def bench(fn: Callable[[], Any], repeat: int = 20, number: int = 1, warmup: int = 2) -> Dict[str, Any]:
+    """
+    Misura una funzione pura: repeat campioni, ognuno di number chiamate.
+
+    Returns:
+        Statistiche per singola chiamata (ms)
+    """
+    for _ in range(warmup):
+        fn()
+
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        samples.append((time.perf_counter() - start) * 1000 / number)
+    return summarize(samples, number=number)
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def build_report(suite: str, results: Dict[str, Dict[str, Any]], params: Dict[str, Any]) -> Dict[str, Any]:
+    """Report completo con i metadati necessari per confrontare run diversi"""
+    return {
+        "suite": suite,
+        "created_at": datetime.utcnow().isoformat(),
+        "git_revision": _git_revision(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "params": params,
+        "results": results,
+    }
+
+
+def save_report(report: Dict[str, Any], output: Optional[Path] = None) -> Path:
+    """Salva il report JSON (default: benchmarks/results/<suite>-<timestamp>.json)"""
+    if output is None:
+        RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+        stamp = datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+        output = RESULTS_DIR / f"{report['suite']}-{stamp}.json"
+    output.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    return output
+
+
+def compare_reports(
+    baseline: Dict[str, Any],
+    current: Dict[str, Any],
+    threshold: float = 0.10,
+    metric: str = "median_ms",
+) -> List[Dict[str, Any]]:
+    """
+    Confronta due report e segnala le regressioni.
+
+    Args:
+        baseline: Report di riferimento
+        current: Report da valutare
+        threshold: Peggioramento relativo tollerato (0.10 = +10%)
+        metric: Statistica da confrontare
+
+    Returns:
+        Una riga per benchmark presente in entrambi i report
+    """
+    rows = []
+    for name, base in baseline["results"].items():
+        cur = current["results"].get(name)
+        if cur is None or not base.get(metric):
+            continue
+        ratio = cur[metric] / base[metric]
+        rows.append({
+            "name": name,
+            "baseline": base[metric],
+            "current": cur[metric],
+            "ratio": round(ratio, 3),
+            "regression": ratio > 1 + threshold,
+        })
+    return rows
+
+
+def print_results(results: Dict[str, Dict[str, Any]]) -> None:
+    """Stampa una tabella leggibile dei risultati"""
+    print(f"{'Benchmark':<58} {'median ms':>10} {'p95 ms':>10}")
+    for name, stats in results.items():
+        print(f"{name:<58} {stats['median_ms']:>10.3f} {stats['p95_ms']:>10.3f}")
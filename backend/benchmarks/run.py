@@ -0,0 +1,126 @@
+"""
+Suite di benchmark ICE
+
+Uso (dalla cartella backend):
+    python -m benchmarks.run micro [--docs 1000] [--output FILE]
+    python -m benchmarks.run load --mock [--docs 1000] [--requests 200] [--concurrency 10]
+    python -m benchmarks.run load --base-url http://localhost:8000 [--seed-docs 0]
+    python -m benchmarks.run compare BASELINE.json CURRENT.json [--threshold 0.10]
+
+I risultati sono salvati in JSON (default benchmarks/results/) per confrontare
+run diversi; compare esce con codice 1 se trova regressioni.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+from pathlib import Path
+
+# La tassonomia viene letta dal repository se non è configurato un percorso
+_BACKEND_DIR = Path(__file__).resolve().parent.parent
+os.environ.setdefault("TAXONOMY_PATH", str(_BACKEND_DIR / "ACN_Taxonomy.json"))
+os.environ.setdefault("MISP_TAXONOMY_PATH", str(_BACKEND_DIR / "MISP_ACN_Taxonomy.json"))
+os.environ.setdefault("TAXONOMY_SNAPSHOT_PATH", str(_BACKEND_DIR / "taxonomy.snapshot"))
+
+from benchmarks.results import build_report, compare_reports, print_results, save_report  # noqa: E402
+
+
+def _micro(args: argparse.Namespace) -> int:
+    from benchmarks.micro import run_micro
+
+    results = run_micro(docs=args.docs, similarity_docs=args.similarity_docs, quick=args.quick)
+    print_results(results)
+    report = build_report("micro", results, {
+        "docs": args.docs, "similarity_docs": args.similarity_docs, "quick": args.quick,
+    })
+    print(f"\nRisultati salvati in {save_report(report, args.output)}")
+    return 0
+
+
+def _load(args: argparse.Namespace) -> int:
+    from benchmarks.load import MOCK_UNSUPPORTED, SCENARIOS, run_load
+
+    if not args.mock and not args.base_url:
+        print("Specificare --mock oppure --base-url")
+        return 2
+
+    scenarios = args.scenario or [name for name in SCENARIOS if name != "create_incident"]
+    if args.mock:
+        skipped = [name for name in scenarios if name in MOCK_UNSUPPORTED]
+        if skipped:
+            print(f"Scenari non eseguibili con --mock, ignorati: {', '.join(skipped)}")
+        scenarios = [name for name in scenarios if name not in MOCK_UNSUPPORTED]
+    results = asyncio.run(run_load(
+        scenarios,
+        base_url=None if args.mock else args.base_url,
+        docs=args.docs if args.mock else args.seed_docs,
+        requests=args.requests,
+        concurrency=args.concurrency,
+    ))
+    print_results(results)
+    report = build_report("load-mock" if args.mock else "load", results, {
+        "base_url": args.base_url, "docs": args.docs, "requests": args.requests,
+        "concurrency": args.concurrency, "scenarios": scenarios,
+    })
+    print(f"\nRisultati salvati in {save_report(report, args.output)}")
+    return 0
+
+
+def _compare(args: argparse.Namespace) -> int:
+    baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+    current = json.loads(Path(args.current).read_text(encoding="utf-8"))
+    rows = compare_reports(baseline, current, threshold=args.threshold, metric=args.metric)
+
+    print(f"{'Benchmark':<58} {'base':>10} {'attuale':>10} {'ratio':>7}")
+    for row in rows:
+        flag = "  REGRESSIONE" if row["regression"] else ""
+        print(f"{row['name']:<58} {row['baseline']:>10.3f} {row['current']:>10.3f} {row['ratio']:>7.3f}{flag}")
+
+    regressions = [row for row in rows if row["regression"]]
+    if regressions:
+        print(f"\n{len(regressions)} regressioni oltre +{args.threshold:.0%}")
+        return 1
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.run", description="Suite di benchmark ICE")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    micro = commands.add_parser("micro", help="Micro-benchmark delle funzioni pure")
+    micro.add_argument("--docs", type=int, default=1000)
+    micro.add_argument("--similarity-docs", type=int, default=100_000)
+    micro.add_argument("--quick", action="store_true", help="Meno ripetizioni (smoke test)")
+    micro.add_argument("--output", type=Path)
+    micro.set_defaults(handler=_micro)
+
+    load = commands.add_parser("load", help="Scenari di carico HTTP end-to-end")
+    target = load.add_mutually_exclusive_group()
+    target.add_argument("--base-url", help="URL di un'istanza in esecuzione")
+    target.add_argument("--mock", action="store_true", help="In-process con mongomock-motor")
+    load.add_argument("--docs", type=int, default=1000, help="Documenti sintetici (solo --mock)")
+    load.add_argument("--seed-docs", type=int, default=0, help="Incidenti da creare via API prima del test")
+    load.add_argument("--requests", type=int, default=200, help="Richieste per scenario")
+    load.add_argument("--concurrency", type=int, default=10)
+    load.add_argument("--scenario", action="append", help="Scenario da eseguire (ripetibile)")
+    load.add_argument("--output", type=Path)
+    load.set_defaults(handler=_load)
+
+    compare = commands.add_parser("compare", help="Confronta due report e segnala regressioni")
+    compare.add_argument("baseline")
+    compare.add_argument("current")
+    compare.add_argument("--threshold", type=float, default=0.10)
+    compare.add_argument("--metric", default="median_ms")
+    compare.set_defaults(handler=_compare)
+
+    return parser
+
+
+def main(argv=None) -> None:
+    args = build_parser().parse_args(argv)
+    sys.exit(args.handler(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+Generatore di incidenti sintetici con set di codici realistici
+
+I codici sono estratti da ACN_Taxonomy.json rispettando la struttura reale
+(una severity, 1-3 impatti, pochi threat type con distribuzione sbilanciata,
+asset coinvolti sotto AC:IN:<subpredicato>), così i benchmark lavorano su
+documenti di forma e dimensione simili a quelli di produzione.
+"""
+import json
+import random
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+from app.utils.incident_helpers import build_denormalized_fields
+
+DEFAULT_TAXONOMY_PATH = Path(__file__).resolve().parent.parent / "ACN_Taxonomy.json"
+
+_WORDS = (
+    "ransomware phishing exfiltration credential server database backup vpn firewall "
+    "endpoint malware campaign lateral movement privilege escalation outage ddos "
+    "supplier cloud tenant account mailbox compromise encryption ricatto attacco "
+    "violazione dati esfiltrazione disservizio rete sistema utente amministratore"
+).split()
+
+# (chiave, quanti valori minimo/massimo, probabilità che il predicato sia presente)
+_PREDICATE_PLAN = {
+    "BC:IM": (1, 3, 0.95),
+    "BC:RO": (1, 1, 0.6),
+    "BC:SE": (1, 1, 1.0),
+    "BC:VG": (1, 2, 0.8),
+    "TA:AM": (1, 1, 0.5),
+    "TA:AD": (1, 1, 0.3),
+    "AC:VE": (1, 2, 0.7),
+}
+
+
+class TaxonomyCodes:
+    """Codici della tassonomia raggruppati per chiave (es. "TT:MA", "AC:IN:HW-CS")"""
+
+    def __init__(self, taxonomy_path: Path = DEFAULT_TAXONOMY_PATH):
+        data = json.loads(Path(taxonomy_path).read_text(encoding="utf-8"))
+        self.by_key: Dict[str, List[str]] = {}
+        for mc in data["taxonomy"]["macrocategories"]:
+            for pred in mc["predicates"]:
+                key = f"{mc['code']}:{pred['code']}"
+                if pred.get("values"):
+                    self.by_key[key] = [v["code"] for v in pred["values"]]
+                for sub in pred.get("subpredicates", []):
+                    self.by_key[f"{key}:{sub['code']}"] = [v["code"] for v in sub["values"]]
+
+        self.threat_keys = sorted(k for k in self.by_key if k.startswith("TT:"))
+        self.asset_keys = sorted(k for k in self.by_key if k.startswith("AC:IN:"))
+        self.other_ac_keys = sorted(
+            k for k in self.by_key if k.startswith("AC:") and not k.startswith("AC:IN:") and k != "AC:VE"
+        )
+
+    @property
+    def universe(self) -> List[str]:
+        return sorted(code for codes in self.by_key.values() for code in codes)
+
+
+def _zipf_weights(n: int, s: float = 1.1) -> List[float]:
+    return [1.0 / (rank ** s) for rank in range(1, n + 1)]
+
+
+class IncidentGenerator:
+    """
+    Generatore deterministico (seed) di incidenti sintetici.
+
+    Example:
+        >>> gen = IncidentGenerator(seed=42)
+        >>> payload = gen.payload()
+        >>> "BC:SE" in payload["taxonomy_codes"]
+        True
+    """
+
+    def __init__(self, seed: int = 42, taxonomy: Optional[TaxonomyCodes] = None):
+        self.rng = random.Random(seed)
+        self.taxonomy = taxonomy or TaxonomyCodes()
+        # Pochi threat type e asset dominano, come nei dati reali
+        self._threat_order = self.taxonomy.threat_keys[:]
+        self.rng.shuffle(self._threat_order)
+        self._threat_weights = _zipf_weights(len(self._threat_order))
+        self._asset_order = self.taxonomy.asset_keys[:]
+        self.rng.shuffle(self._asset_order)
+        self._asset_weights = _zipf_weights(len(self._asset_order))
+
+    def _pick(self, key: str, low: int, high: int) -> List[str]:
+        values = self.taxonomy.by_key[key]
+        return self.rng.sample(values, min(len(values), self.rng.randint(low, high)))
+
+    def _weighted_keys(self, keys: List[str], weights: List[float], count: int) -> List[str]:
+        chosen: List[str] = []
+        while len(chosen) < min(count, len(keys)):
+            key = self.rng.choices(keys, weights=weights, k=1)[0]
+            if key not in chosen:
+                chosen.append(key)
+        return chosen
+
+    def taxonomy_codes(self) -> Dict[str, List[str]]:
+        """Genera un dizionario taxonomy_codes realistico"""
+        codes: Dict[str, List[str]] = {}
+        for key, (low, high, probability) in _PREDICATE_PLAN.items():
+            if self.rng.random() < probability:
+                codes[key] = self._pick(key, low, high)
+
+        for key in self._weighted_keys(self._threat_order, self._threat_weights, self.rng.randint(1, 3)):
+            codes[key] = self._pick(key, 1, 2)
+        for key in self._weighted_keys(self._asset_order, self._asset_weights, self.rng.randint(1, 3)):
+            codes[key] = self._pick(key, 1, 2)
+        for key in self.taxonomy.other_ac_keys:
+            if self.rng.random() < 0.2:
+                codes[key] = self._pick(key, 1, 1)
+        return codes
+
+    def _sentence(self, low: int, high: int) -> str:
+        return " ".join(self.rng.choices(_WORDS, k=self.rng.randint(low, high))).capitalize()
+
+    def payload(self) -> Dict[str, Any]:
+        """Payload come quello inviato dal frontend (IncidentCreate)"""
+        taxonomy_codes = self.taxonomy_codes()
+        all_codes = [c for values in taxonomy_codes.values() for c in values]
+        return {
+            "title": self._sentence(3, 8),
+            "description": self._sentence(20, 80),
+            "discovered_at": None,
+            "taxonomy_codes": taxonomy_codes,
+            "code_details": {
+                code: self._sentence(5, 20) for code in all_codes if self.rng.random() < 0.3
+            },
+            "tags": self.rng.sample(_WORDS, self.rng.randint(0, 3)),
+            "notes": self._sentence(5, 30) if self.rng.random() < 0.5 else None,
+        }
+
+    def document(self, created_at: Optional[datetime] = None) -> Dict[str, Any]:
+        """Documento MongoDB completo (con _id, timestamp e campi derivati)"""
+        doc = self.payload()
+        created_at = created_at or datetime(2024, 1, 1) + timedelta(minutes=self.rng.randint(0, 60 * 24 * 700))
+        doc["discovered_at"] = created_at - timedelta(hours=self.rng.randint(0, 72))
+        doc.update(build_denormalized_fields(doc))
+        doc["_id"] = str(uuid.UUID(int=self.rng.getrandbits(128), version=4))
+        doc["created_at"] = created_at
+        doc["updated_at"] = created_at + timedelta(hours=self.rng.randint(0, 240))
+        return doc
+
+    def documents(self, n: int) -> Iterator[Dict[str, Any]]:
+        for _ in range(n):
+            yield self.document()
+
+
+def generate_documents(n: int, seed: int = 42) -> List[Dict[str, Any]]:
+    """Genera n documenti incidente sintetici"""
+    return list(IncidentGenerator(seed=seed).documents(n))
+
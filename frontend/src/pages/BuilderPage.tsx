@@ -1,7 +1,7 @@
 import React, { useState, useEffect } from 'react';
 import { useNavigate } from 'react-router-dom';
 import './BuilderPage.css';
-import { taxonomyAPI, incidentsAPI } from '../services/api';
+import { taxonomyAPI, incidentsAPI, newIdempotencyKey } from '../services/api';
 import { MacroCategory, Predicate, SubPredicate } from '../types/taxonomy';
 import { IncidentCreate } from '../types/incident';
 import { groupCodesByTaxonomyKey } from '../utils/taxonomyHelpers';
@@ -39,6 +39,8 @@ const BuilderPage: React.FC = () => {
   const [expandedPredicates, setExpandedPredicates] = useState<Set<string>>(new Set());
   const [expandedSubpredicates, setExpandedSubpredicates] = useState<Set<string>>(new Set());
   const [loading, setLoading] = useState(true);
+  // Stessa chiave per tutti i tentativi di salvataggio: un retry non crea duplicati
+  const [idempotencyKey] = useState(newIdempotencyKey);
 
   useEffect(() => {
     loadTaxonomy();
@@ -46,7 +48,8 @@ const BuilderPage: React.FC = () => {
 
   const loadTaxonomy = async () => {
     try {
-      const macros = await taxonomyAPI.getMacrocategories();
+      // Struttura senza descrizioni (payload ridotto): le descrizioni arrivano dopo
+      const macros = await taxonomyAPI.getMacrocategories({ fields: 'code,name,label,has_subpredicates' });
       setMacrocategories(macros);
 
       // Converti la tassonomia in blocchi
@@ -59,7 +62,7 @@ const BuilderPage: React.FC = () => {
               id: `${mc.code}-${pred.code}-${value.code}`,
               code: value.code,
               label: value.label,
-              description: value.description,
+              description: value.description || '',
               category: mc.code,
               predicate: pred.code,
               predicateName: pred.name,
@@ -73,7 +76,7 @@ const BuilderPage: React.FC = () => {
                 id: `${mc.code}-${pred.code}-${subpred.code}-${value.code}`,
                 code: value.code,
                 label: value.label,
-                description: value.description,
+                description: value.description || '',
                 category: mc.code,
                 predicate: pred.code,
                 predicateName: pred.name,
@@ -86,12 +89,24 @@ const BuilderPage: React.FC = () => {
 
       setAvailableBlocks(blocks);
       setLoading(false);
+      loadDescriptions();
     } catch (error) {
       console.error('Errore caricamento tassonomia:', error);
       setLoading(false);
     }
   };
 
+  const loadDescriptions = async () => {
+    try {
+      const descriptions = await taxonomyAPI.getValueDescriptions();
+      const withDescription = (block: Block) => ({ ...block, description: descriptions[block.code] ?? block.description });
+      setAvailableBlocks((prev) => prev.map(withDescription));
+      setSelectedBlocks((prev) => prev.map(withDescription));
+    } catch (error) {
+      console.error('Errore caricamento descrizioni tassonomia:', error);
+    }
+  };
+
   const handleDragStart = (block: Block) => {
     setDraggedBlock(block);
   };
@@ -172,7 +187,7 @@ const BuilderPage: React.FC = () => {
     };
 
     try {
-      const incident = await incidentsAPI.create(incidentData);
+      const incident = await incidentsAPI.create(incidentData, idempotencyKey);
       navigate(`/incidents/${incident.id}`);
     } catch (error) {
       console.error('Errore salvataggio:', error);
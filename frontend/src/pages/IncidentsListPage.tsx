@@ -29,9 +29,18 @@ const IncidentsListPage: React.FC = () => {
     try {
       const text = await file.text();
       const json = JSON.parse(text);
-      await incidentsAPI.importFromJSON(json);
-      await loadIncidents();
-      alert('Import completato');
+      if (Array.isArray(json)) {
+        const result = await incidentsAPI.importBulk(json);
+        await loadIncidents();
+        alert(
+          `Import completato: ${result.created.length} creati, ${result.skipped.length} già presenti` +
+            (result.errors.length ? `, ${result.errors.length} non validi` : '')
+        );
+      } else {
+        await incidentsAPI.importFromJSON(json);
+        await loadIncidents();
+        alert('Import completato');
+      }
     } catch (error) {
       console.error('Errore import:', error);
       alert('Import fallito: verifica il file JSON esportato');
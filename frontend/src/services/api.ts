@@ -1,6 +1,6 @@
 import axios from 'axios';
-import { Incident, IncidentCreate, IncidentSummary } from '../types/incident';
-import { MacroCategory, WizardStep } from '../types/taxonomy';
+import { BulkImportResult, Incident, IncidentCreate, IncidentRevision, IncidentStats, IncidentSummary, TextSearchResult } from '../types/incident';
+import { MacroCategory, TaxonomySearchResult, WizardStep } from '../types/taxonomy';
 
 const API_URL = process.env.REACT_APP_API_URL || 'http://localhost:8000';
 
@@ -11,6 +11,12 @@ const api = axios.create({
   },
 });
 
+// Chiave per l'header Idempotency-Key (una per incidente da creare, riusata nei retry)
+export const newIdempotencyKey = (): string =>
+  typeof crypto !== 'undefined' && 'randomUUID' in crypto
+    ? crypto.randomUUID()
+    : `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+
 // Incidents API
 export const incidentsAPI = {
   list: async (): Promise<IncidentSummary[]> => {
@@ -23,8 +29,9 @@ export const incidentsAPI = {
     return response.data;
   },
 
-  create: async (data: IncidentCreate): Promise<Incident> => {
-    const response = await api.post('/api/incidents/', data);
+  create: async (data: IncidentCreate, idempotencyKey?: string): Promise<Incident> => {
+    const headers = idempotencyKey ? { 'Idempotency-Key': idempotencyKey } : undefined;
+    const response = await api.post('/api/incidents/', data, { headers });
     return response.data;
   },
 
@@ -41,15 +48,56 @@ export const incidentsAPI = {
     const response = await api.post('/api/incidents/import', data);
     return response.data;
   },
+
+  importBulk: async (data: any[]): Promise<BulkImportResult> => {
+    const response = await api.post('/api/incidents/import/bulk', data);
+    return response.data;
+  },
+
+  stats: async (top: number = 10): Promise<IncidentStats> => {
+    const response = await api.get('/api/incidents/stats', { params: { top } });
+    return response.data;
+  },
+
+  searchText: async (q: string, page: number = 1, pageSize: number = 20): Promise<TextSearchResult> => {
+    const response = await api.get('/api/incidents/search/text', { params: { q, page, page_size: pageSize } });
+    return response.data;
+  },
+
+  revisions: async (id: string): Promise<IncidentRevision[]> => {
+    const response = await api.get(`/api/incidents/${id}/revisions`);
+    return response.data;
+  },
+
+  getRevision: async (id: string, revision: number): Promise<Incident> => {
+    const response = await api.get(`/api/incidents/${id}/revisions/${revision}`);
+    return response.data;
+  },
 };
 
 // Taxonomy API
 export const taxonomyAPI = {
-  getMacrocategories: async (): Promise<MacroCategory[]> => {
-    const response = await api.get('/api/taxonomy/macrocategories');
+  getMacrocategories: async (params?: { fields?: string; macro?: string }): Promise<MacroCategory[]> => {
+    const response = await api.get('/api/taxonomy/macrocategories', { params });
     return response.data;
   },
 
+  // Mappa codice -> descrizione dei valori (caricata dopo la struttura ridotta)
+  getValueDescriptions: async (): Promise<Record<string, string>> => {
+    const macros: MacroCategory[] = (
+      await api.get('/api/taxonomy/macrocategories', { params: { fields: 'code,description' } })
+    ).data;
+    const descriptions: Record<string, string> = {};
+    macros.forEach((mc) =>
+      mc.predicates.forEach((pred) => {
+        [...pred.values, ...(pred.subpredicates || []).flatMap((sub) => sub.values)].forEach((value) => {
+          descriptions[value.code] = value.description;
+        });
+      })
+    );
+    return descriptions;
+  },
+
   getMacrocategory: async (code: string): Promise<MacroCategory> => {
     const response = await api.get(`/api/taxonomy/macrocategories/${code}`);
     return response.data;
@@ -60,6 +108,11 @@ export const taxonomyAPI = {
     return response.data;
   },
 
+  search: async (q: string, limit = 10, macro?: string): Promise<TaxonomySearchResult[]> => {
+    const response = await api.get('/api/taxonomy/search', { params: { q, limit, macro } });
+    return response.data;
+  },
+
   validateCode: async (code: string): Promise<{ code: string; valid: boolean }> => {
     const response = await api.get(`/api/taxonomy/validate/${code}`);
     return response.data;
@@ -76,6 +129,10 @@ export const exportAPI = {
     return `${API_URL}/api/export/${incidentId}/pdf`;
   },
 
+  downloadSTIX: (incidentId: string) => {
+    return `${API_URL}/api/export/${incidentId}/stix`;
+  },
+
   getMISPEvent: async (incidentId: string) => {
     const response = await api.get(`/api/export/${incidentId}/misp`);
     return response.data;
@@ -23,6 +23,7 @@ export interface Incident {
 
   created_at: string;
   updated_at: string;
+  revision?: number;
 }
 
 export interface IncidentCreate {
@@ -53,3 +54,52 @@ export interface IncidentSummary {
   // Primo codice severity per display veloce
   severity_code?: string;
 }
+
+export interface CodeCount {
+  code?: string;
+  label?: string;
+  macro?: string;
+  count: number;
+}
+
+export interface IncidentStats {
+  total: number;
+  by_severity: CodeCount[];
+  by_threat_type: CodeCount[];
+  by_month: { month: string; count: number }[];
+  top_codes: CodeCount[];
+  generated_at: string;
+}
+
+export interface TextSearchHit {
+  id: string;
+  title: string;
+  created_at: string;
+  score: number;
+  // Snippet con i termini evidenziati in <mark>
+  snippets: { field: string; text: string }[];
+  matched_codes: string[];
+}
+
+export interface TextSearchResult {
+  query: string;
+  total: number;
+  page: number;
+  page_size: number;
+  results: TextSearchHit[];
+}
+
+export interface IncidentRevision {
+  revision: number;
+  // create, update, delete o baseline (stato precedente allo storico)
+  operation: string;
+  author?: string;
+  created_at: string;
+  changes: Record<string, any>;
+}
+
+export interface BulkImportResult {
+  created: string[];
+  skipped: { index: number; id: string | null }[];
+  errors: { index: number; detail: string }[];
+}
@@ -34,3 +34,16 @@ export interface WizardStep {
   macrocategory: string;
   predicates: string[];
 }
+
+export interface TaxonomySearchResult {
+  code: string;
+  score: number;
+  label: string;
+  description: string;
+  macro: string;
+  macro_name: string;
+  predicate: string;
+  predicate_name: string;
+  subpredicate: string | null;
+  subpredicate_name: string | null;
+}